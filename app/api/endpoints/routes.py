@@ -1,278 +1,490 @@
-import os
-import shutil
-
-from db.database import get_db
-from db.models import Like, Media, Subscribers, Subscriptions, Tweet, User
-from fastapi import APIRouter, Depends, Header, HTTPException, UploadFile
-from sqlalchemy import desc
-from sqlalchemy.orm import Session
-
-media_dir = "static/images"
-if not os.path.exists(media_dir):
-    os.makedirs(media_dir)
+import asyncio
+from typing import Optional
+
+from api import feed
+from api.schemas import (
+    FeedResponse,
+    MediaUploadedResponse,
+    ResultResponse,
+    SearchResponse,
+    TrendingResponse,
+    TweetCreatedResponse,
+    TweetsCreatedResponse,
+    UserOut,
+    UserResponse,
+    UserShortOut,
+)
+from core import settings
+from core.media import save_upload
+from core.metrics import registry
+from core.pubsub import StreamFull, stream_hub
+from core.security import CurrentUser, get_current_user
+from core.versions import make_etag, not_modified, versions
+from db import follows, likes, search, timeline, tweets
+from db.database import get_db, get_read_db
+from db.jobs import job_runner
+from db.like_buffer import like_buffer
+from db.models import Media, Tweet, User
+from db.trending import trending_board
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
 
 
-# Функция получения всех твитов
-@router.get("/api/tweets")
-def get_tweets(api_key: str = Header(), db: Session = Depends(get_db)):
-    User.validate_api_key(db, api_key)
-
-    tweets = db.query(Tweet).order_by(desc(Tweet.id)).all()
-    tweets_response = [
-        {
-            "id": tweet.id,
-            "content": tweet.text,
-            "attachments": [
-                media.image_url
-                for media in db.query(Media).filter_by(tweet_id=tweet.id).all()
-            ],
-            "author": {"id": tweet.user_id, "name": tweet.author.username},
-            "likes": [
-                {"user_id": like.user.id, "name": like.user.username}
-                for like in tweet.likes
-                if like.user is not None
-            ]
-            if tweet.likes
-            else [],
-        }
-        for tweet in tweets
-    ]
-
-    return {"result": True, "tweets": tweets_response}
+def user_out(user_id: int, username: str, followers, following) -> UserOut:
+    return UserOut(
+        id=user_id,
+        name=username,
+        followers=[
+            UserShortOut(id=follower.id, name=follower.username)
+            for follower in followers
+        ],
+        following=[
+            UserShortOut(id=followee.id, name=followee.username)
+            for followee in following
+        ],
+    )
 
 
-# Фукция добавления нового твита
-@router.post("/api/tweets")
-async def create_tweet(
-    tweet_data: dict, api_key: str = Header(), db: Session = Depends(get_db)
+# Функция выставляет ETag ответа. Сразу после изменений реплика может
+# отставать, и прочитанный с неё ответ не должен закрепиться под новым ETag.
+def set_etag(response: Response, db: AsyncSession, etag: str) -> None:
+    if db.info.get("replica") and versions.changed_within(
+        settings.DB_READ_YOUR_WRITES_WINDOW
+    ):
+        return
+    response.headers["ETag"] = etag
+
+
+# Функция получения домашней ленты постранично (keyset по Tweet.id):
+# твиты пользователя и тех, на кого он подписан
+@router.get("/api/tweets", response_model=FeedResponse)
+async def get_tweets(
+    request: Request,
+    response: Response,
+    user: CurrentUser = Depends(get_current_user),
+    limit: int = Query(
+        default=settings.TWEETS_PAGE_SIZE,
+        ge=1,
+        le=settings.TWEETS_MAX_PAGE_SIZE,
+    ),
+    before_id: Optional[int] = Query(default=None, ge=1),
+    cursor: Optional[int] = Query(default=None, ge=1),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    user = User.validate_api_key(db, api_key)
+    # cursor - синоним before_id, который возвращается как next_cursor
+    if before_id is None:
+        before_id = cursor
+
+    # Лента меняется при изменении твитов/лайков и подписок пользователя
+    etag = make_etag(
+        "feed",
+        user.id,
+        versions.feed,
+        versions.user(user.id),
+        limit,
+        before_id,
+    )
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    set_etag(response, db, etag)
 
-    new_tweet = Tweet(text=tweet_data["tweet_data"], user_id=user.id)
+    # Берём на одну запись больше, чтобы узнать о следующей странице
+    tweet_ids = await timeline.get_home_timeline(
+        db, user.id, before_id, limit + 1
+    )
+    next_cursor = None
+    if len(tweet_ids) > limit:
+        tweet_ids = tweet_ids[:limit]
+        next_cursor = tweet_ids[-1]
+
+    tweets_response = await feed.render_tweets(db, tweet_ids)
+
+    return FeedResponse(tweets=tweets_response, next_cursor=next_cursor)
+
+
+# Функция полнотекстового поиска твитов: по убыванию релевантности,
+# страницы по курсору "релевантность,id"
+@router.get("/api/tweets/search", response_model=SearchResponse)
+async def search_tweets(
+    q: str = Query(min_length=1, max_length=200),
+    user: CurrentUser = Depends(get_current_user),
+    limit: int = Query(
+        default=settings.TWEETS_PAGE_SIZE,
+        ge=1,
+        le=settings.TWEETS_MAX_PAGE_SIZE,
+    ),
+    cursor: Optional[str] = Query(default=None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    after = None
+    if cursor is not None:
+        try:
+            score, tweet_id = cursor.split(",")
+            after = (float(score), int(tweet_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+    found = await search.search_tweet_ids(db, q, limit + 1, after)
+    next_cursor = None
+    if len(found) > limit:
+        found = found[:limit]
+        next_cursor = "{!r},{}".format(found[-1][1], found[-1][0])
+
+    tweets_response = await feed.render_tweets(
+        db, [tweet_id for tweet_id, _ in found]
+    )
+    return SearchResponse(tweets=tweets_response, next_cursor=next_cursor)
+
+
+# Функция возвращает самые популярные твиты последних TRENDING_WINDOW
+# секунд из рейтинга в памяти, без сортировки таблицы tweets
+@router.get("/api/tweets/trending", response_model=TrendingResponse)
+async def trending_tweets(
+    user: CurrentUser = Depends(get_current_user),
+    limit: int = Query(
+        default=settings.TWEETS_PAGE_SIZE,
+        ge=1,
+        le=settings.TWEETS_MAX_PAGE_SIZE,
+    ),
+    db: AsyncSession = Depends(get_read_db),
+):
+    tweets_response = await feed.render_tweets(db, trending_board.top(limit))
+    return TrendingResponse(tweets=tweets_response)
+
+
+# Функция отдаёт поток событий ленты (Server-Sent Events): новые твиты
+# (tweet), удаления (delete) и изменения числа лайков (likes) твитов
+# пользователя и тех, на кого он подписан. После переподключения с
+# заголовком Last-Event-ID пропущенные события досылаются; событие reset
+# означает, что ленту нужно перечитать через GET /api/tweets.
+@router.get("/api/stream")
+async def stream_events(
+    user: CurrentUser = Depends(get_current_user),
+    last_event_id: Optional[str] = Header(default=None),
+    db: AsyncSession = Depends(get_db),
+):
+    # Без Last-Event-ID поток начинается с момента запроса: события,
+    # пришедшие, пока читаются подписки, досылаются из буфера
+    since = last_event_id or stream_hub.last_event_id
+    following = await follows.get_following_ids(db, user.id)
+    # Подключение живёт долго и не должно держать соединение пула
+    await db.close()
+    try:
+        subscriber, backlog = stream_hub.subscribe(
+            user.id, [user.id, *following], since
+        )
+    except StreamFull:
+        raise HTTPException(
+            status_code=503, detail="Слишком много подключений к потоку"
+        )
 
-    db.add(new_tweet)
-    db.commit()
-    db.refresh(new_tweet)
+    async def events():
+        try:
+            yield b"retry: 3000\n\n"
+            for frame in backlog:
+                yield frame
+            while not (subscriber.closed and subscriber.queue.empty()):
+                try:
+                    item = await asyncio.wait_for(
+                        subscriber.queue.get(), settings.STREAM_HEARTBEAT
+                    )
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                yield item
+        finally:
+            stream_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    tweet_media_ids = tweet_data.get("tweet_media_ids", [])
 
-    if tweet_media_ids:
-        for media_id in tweet_media_ids:
-            media = db.query(Media).filter(Media.id == media_id).first()
-            if media:
-                new_tweet.media.append(media)
-                media.tweet_id = new_tweet.id
+# Фукция добавления нового твита
+@router.post("/api/tweets", response_model=TweetCreatedResponse)
+async def create_tweet(
+    tweet_data: dict,
+    user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    tweet_media_ids = tweet_data.get("tweet_media_ids") or []
+    created = await tweets.create_tweets(
+        db, user.id, [(tweet_data["tweet_data"], tweet_media_ids)]
+    )
+    [tweet_id] = created
+    deferred = await timeline.distribute_tweets(
+        db, user.id, user.followers_count, [tweet_id]
+    )
+    await db.commit()
+    if deferred:
+        job_runner.wake()
+    versions.bump_feed()
+    feed.publish_new_tweets(user, created, [tweet_data["tweet_data"]])
+
+    return TweetCreatedResponse(tweet_id=tweet_id)
+
+
+# Функция пакетного создания твитов (импорт, отложенные публикации):
+# все твиты и их медиа создаются одним запросом в одной транзакции
+@router.post("/api/tweets/bulk", response_model=TweetsCreatedResponse)
+async def create_tweets_bulk(
+    payload: dict,
+    user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    items = [
+        (item["tweet_data"], item.get("tweet_media_ids") or [])
+        for item in payload["tweets"]
+    ]
+    if not items:
+        return TweetsCreatedResponse(tweet_ids=[])
+    if len(items) > settings.TWEETS_BULK_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail="Слишком много твитов в одном запросе",
+        )
 
-    db.commit()
+    created = await tweets.create_tweets(db, user.id, items)
+    tweet_ids = list(created)
+    deferred = await timeline.distribute_tweets(
+        db, user.id, user.followers_count, tweet_ids
+    )
+    await db.commit()
+    if deferred:
+        job_runner.wake()
+    versions.bump_feed()
+    feed.publish_new_tweets(user, created, [text for text, _ in items])
 
-    return {"result": True, "tweet_id": new_tweet.id}
+    return TweetsCreatedResponse(tweet_ids=tweet_ids)
 
 
 # Функция загрузки изображений к твитам
-@router.post("/api/medias")
+@router.post("/api/medias", response_model=MediaUploadedResponse)
 async def upload_media(
-    file: UploadFile, api_key: str = Header(), db: Session = Depends(get_db)
+    file: UploadFile,
+    user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    user = User.validate_api_key(db, api_key)
-
-    with open(f"{media_dir}/{file.filename}", "wb") as image:
-        shutil.copyfileobj(file.file, image)
+    async with save_upload(file) as filename:
+        # Тот же файл, ещё не прикреплённый к твиту, повторно не создаём
+        media = await db.scalar(
+            select(Media)
+            .where(
+                Media.image_url == filename,
+                Media.user_id == user.id,
+                Media.tweet_id.is_(None),
+            )
+            .limit(1)
+        )
+        if media is not None:
+            return MediaUploadedResponse(media_id=media.id)
 
-    new_media = Media(image_url=file.filename, user_id=user.id)
-    db.add(new_media)
-    db.commit()
-    db.refresh(new_media)
+        new_media = Media(image_url=filename, user_id=user.id)
+        db.add(new_media)
+        await db.commit()
 
-    return {"result": True, "media_id": new_media.id}
+    return MediaUploadedResponse(media_id=new_media.id)
 
 
 # Функция удаления твита по id
-@router.delete("/api/tweets/{tweet_id}")
+@router.delete("/api/tweets/{tweet_id}", response_model=ResultResponse)
 async def delete_tweet(
-    tweet_id: int, api_key: str = Header(), db: Session = Depends(get_db)
+    tweet_id: int,
+    user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    user = User.validate_api_key(db, api_key)
-
-    tweet = (
-        db.query(Tweet)
-        .filter(Tweet.id == tweet_id, Tweet.user_id == user.id)
-        .first()
+    tweet = await db.scalar(
+        select(Tweet.id).where(Tweet.id == tweet_id, Tweet.user_id == user.id)
     )
 
     if tweet is None:
         raise HTTPException(status_code=404, detail="Твит не найден")
 
-    db.delete(tweet)
-    db.commit()
+    await timeline.remove_tweet(db, tweet_id)
+    purge = await tweets.delete_tweet(db, tweet_id)
+    await db.commit()
+    if purge:
+        job_runner.wake()
+    feed.invalidate_tweets([tweet_id])
+    trending_board.remove(tweet_id)
+    versions.bump_feed()
+    stream_hub.publish("delete", user.id, {"id": tweet_id})
 
-    return {"result": True}
+    return ResultResponse()
 
 
 # Функция для лайка твита
-@router.post("/api/tweets/{tweet_id}/likes")
+@router.post("/api/tweets/{tweet_id}/likes", response_model=ResultResponse)
 async def like_tweet(
-    tweet_id: int, api_key: str = Header(), db: Session = Depends(get_db)
+    tweet_id: int,
+    user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    user = User.validate_api_key(db, api_key)
-
-    tweet = db.query(Tweet).filter(Tweet.id == tweet_id).first()
-
-    if tweet is not None:
-        if not any(like.user_id == user.id for like in tweet.likes):
-            tweet.likes.append(Like(user_id=user.id, user=user))
-            tweet.count_likes = str(int(tweet.count_likes) + 1)
-            db.commit()
-
-        return {"result": True}
+    liked = await likes.add_like(db, user.id, tweet_id)
+    if not liked:
+        tweet = await db.scalar(select(Tweet.id).where(Tweet.id == tweet_id))
+        if tweet is None:
+            raise HTTPException(status_code=404, detail="Твит не найден")
+
+    await db.commit()
+    if liked:
+        like_buffer.add(tweet_id, 1)
+        trending_board.update(tweet_id, liked.count_likes, liked.created_at)
+        feed.invalidate_tweets([tweet_id])
+        versions.bump_feed()
+        stream_hub.publish(
+            "likes",
+            liked.author_id,
+            {"id": tweet_id, "count_likes": liked.count_likes},
+        )
 
-    raise HTTPException(status_code=404, detail="Твит не найден")
+    return ResultResponse()
 
 
 # Функция для удаления лайка с твита
-@router.delete("/api/tweets/{tweet_id}/likes")
+@router.delete("/api/tweets/{tweet_id}/likes", response_model=ResultResponse)
 async def unlike_tweet(
-    tweet_id: int, api_key: str = Header(), db: Session = Depends(get_db)
+    tweet_id: int,
+    user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    user = User.validate_api_key(db, api_key)
-
-    tweet = db.query(Tweet).filter(Tweet.id == tweet_id).first()
-
-    if tweet is None:
-        raise HTTPException(status_code=404, detail="Твит не найден")
-
-    like_to_remove = next(
-        (like for like in tweet.likes if like.user_id == user.id), None
-    )
-
-    if like_to_remove:
-        tweet.likes.remove(like_to_remove)
-        tweet.count_likes = str(int(tweet.count_likes) - 1)
-        db.commit()
+    unliked = await likes.remove_like(db, user.id, tweet_id)
+    if not unliked:
+        tweet = await db.scalar(select(Tweet.id).where(Tweet.id == tweet_id))
+        if tweet is None:
+            raise HTTPException(status_code=404, detail="Твит не найден")
+
+    await db.commit()
+    if unliked:
+        like_buffer.add(tweet_id, -1)
+        trending_board.update(
+            tweet_id, unliked.count_likes, unliked.created_at
+        )
+        feed.invalidate_tweets([tweet_id])
+        versions.bump_feed()
+        stream_hub.publish(
+            "likes",
+            unliked.author_id,
+            {"id": tweet_id, "count_likes": unliked.count_likes},
+        )
 
-    return {"result": True}
+    return ResultResponse()
 
 
 # Функция для подписки на пользователя
-@router.post("/api/users/{user_id}/follow")
+@router.post("/api/users/{user_id}/follow", response_model=ResultResponse)
 async def follow_user(
-    user_id: int, api_key: str = Header(), db: Session = Depends(get_db)
+    user_id: int,
+    user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    user = User.validate_api_key(db, api_key)
-
-    subscriber = db.query(User).filter(User.id == user_id).first()
+    followee = await db.scalar(select(User.id).where(User.id == user_id))
 
-    if subscriber is None:
+    if followee is None:
         raise HTTPException(
             status_code=404, detail="Пользователь для подписки не найден"
         )
-    db.add(Subscriptions(user=user, subscriber=subscriber))
-    db.add(Subscribers(user=user, subscribed_user=subscriber))
-    db.commit()
-    return {"result": True}
+
+    followed = await follows.follow(db, user.id, user_id)
+    if followed:
+        await timeline.follow_author(db, user.id, user_id)
+    await db.commit()
+    if followed:
+        versions.bump_user(user.id)
+        versions.bump_user(user_id)
+        stream_hub.follow(user.id, user_id)
+    return ResultResponse()
 
 
 # Функция для удаления подписки на пользователя
-@router.delete("/api/users/{user_id}/follow")
+@router.delete("/api/users/{user_id}/follow", response_model=ResultResponse)
 async def unfollow_user(
-    user_id: int, api_key: str = Header(), db: Session = Depends(get_db)
+    user_id: int,
+    user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    user = User.validate_api_key(db, api_key)
-
-    subscription = (
-        db.query(Subscriptions)
-        .filter(
-            Subscriptions.user == user,
-            Subscriptions.subscriber.has(id=user_id),
-        )
-        .first()
-    )
-    if not subscription:
+    followers_count = await follows.unfollow(db, user.id, user_id)
+    if followers_count is None:
         raise HTTPException(
             status_code=400, detail="Вы не подписаны на этого пользователя"
         )
 
-    db.delete(subscription)
-
-    subscriber = (
-        db.query(Subscribers)
-        .filter(
-            Subscribers.subscribers_id == user.id,
-            Subscribers.subscriber_id == user_id,
-        )
-        .first()
-    )
-    if subscriber:
-        db.delete(subscriber)
-
-    db.commit()
-    return {"result": True}
+    await timeline.unfollow_author(db, user.id, user_id)
+    await timeline.author_unfollowed(db, user_id, followers_count)
+    await db.commit()
+    versions.bump_user(user.id)
+    versions.bump_user(user_id)
+    stream_hub.unfollow(user.id, user_id)
+    return ResultResponse()
 
 
 # Фукция получения информации о текущем пользователе
-@router.get("/api/users/me")
-async def user_info(api_key: str = Header(), db: Session = Depends(get_db)):
-    user = User.validate_api_key(db, api_key)
+@router.get("/api/users/me", response_model=UserResponse)
+async def user_info(
+    request: Request,
+    response: Response,
+    user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+):
+    etag = make_etag("user", user.id, versions.user(user.id))
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    set_etag(response, db, etag)
 
-    subscriptions = (
-        db.query(Subscriptions).filter_by(subscriber_id=user.id).all()
-    )
-    subscribers = db.query(Subscribers).filter_by(subscriber_id=user.id).all()
-
-    user_response = {
-        "id": user.id,
-        "name": user.username,
-        "followers": [
-            {
-                "id": subscriber.subscribers_id,
-                "name": subscriber.subscribed_user.username,
-            }
-            for subscriber in subscribers
-        ],
-        "following": [
-            {
-                "id": subscription.subscriptions_id,
-                "name": subscription.user.username,
-            }
-            for subscription in subscriptions
-        ],
-    }
+    followers = await follows.get_followers(db, user.id)
+    following = await follows.get_following(db, user.id)
 
-    return {"result": True, "user": user_response}
+    return UserResponse(
+        user=user_out(user.id, user.username, followers, following)
+    )
 
 
 # Функция получения информации о другом пользователе
-@router.get("/api/users/{user_id}")
-async def user_info_by_id(user_id: int, db: Session = Depends(get_db)) -> dict:
-    another_user = db.query(User).filter(User.id == user_id).first()
+@router.get("/api/users/{user_id}", response_model=UserResponse)
+async def user_info_by_id(
+    user_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
+):
+    etag = make_etag("user", user_id, versions.user(user_id))
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    another_user = await db.get(User, user_id)
 
     if another_user is None:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
+    set_etag(response, db, etag)
+
+    followers = await follows.get_followers(db, user_id)
+    following = await follows.get_following(db, user_id)
+
+    return UserResponse(
+        user=user_out(
+            another_user.id, another_user.username, followers, following
+        )
+    )
+
 
-    subscriptions = (
-        db.query(Subscriptions).filter_by(subscriber_id=user_id).all()
+# Функция отдаёт метрики процесса в текстовом формате Prometheus
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4"
     )
-    subscribers = db.query(Subscribers).filter_by(subscriber_id=user_id).all()
-
-    return {
-        "result": True,
-        "user": {
-            "id": another_user.id,
-            "name": another_user.username,
-            "followers": [
-                {
-                    "id": subscriber.subscribers_id,
-                    "name": subscriber.subscribed_user.username,
-                }
-                for subscriber in subscribers
-            ],
-            "following": [
-                {
-                    "id": subscription.subscriptions_id,
-                    "name": subscription.user.username,
-                }
-                for subscription in subscriptions
-            ],
-        },
-    }
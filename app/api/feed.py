@@ -0,0 +1,156 @@
+from functools import partial
+from typing import Dict, Iterable, List, Sequence
+
+from api.schemas import AuthorOut, LikeOut, TweetOut
+from core import settings
+from core.cache import LRUCache
+from core.pubsub import stream_hub
+from core.security import CurrentUser
+from core.versions import versions
+from db.jobs import job_runner
+from db.like_buffer import like_buffer
+from db.models import Like, Tweet
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+
+# Готовые представления твитов по id. Запись сбрасывается, когда меняются
+# лайки, медиа или сам твит; count_likes досчитывается при выдаче с учётом
+# ещё не записанных дельт like_buffer.
+tweet_cache = LRUCache(maxsize=settings.TWEET_CACHE_SIZE)
+
+# Недавно изменённые твиты: реплика может ещё отдавать их старую версию,
+# поэтому прочитанное с реплики для них не кэшируется
+recently_changed = LRUCache(
+    maxsize=settings.TWEET_CACHE_SIZE,
+    ttl=settings.DB_READ_YOUR_WRITES_WINDOW,
+)
+
+
+# Журнал сбросов: номер последнего сброса каждого из size недавно
+# сброшенных твитов. Представление, загрузка которого началась до сброса,
+# в кэш не кладётся: иначе лайк, пришедший во время запроса к БД, был бы
+# перезаписан устаревшими данными.
+class InvalidationLog:
+    def __init__(self, size: int):
+        self.size = size
+        self.counter = 0
+        self._last = LRUCache(maxsize=size)
+
+    def add(self, tweet_id: int) -> None:
+        self.counter += 1
+        self._last.set(tweet_id, self.counter)
+
+    # Сбрасывался ли твит после отметки mark (значения counter). Если
+    # сбросов было больше size, журнал мог их вытеснить: считаем, что да.
+    def changed_since(self, tweet_id: int, mark: int) -> bool:
+        if self.counter - mark >= self.size:
+            return True
+        return self._last.peek(tweet_id, 0) > mark
+
+
+invalidations = InvalidationLog(size=settings.TWEET_CACHE_SIZE)
+
+
+def invalidate_tweets(tweet_ids: Iterable[int]) -> None:
+    for tweet_id in tweet_ids:
+        tweet_cache.pop(tweet_id)
+        recently_changed.set(tweet_id, True)
+        invalidations.add(tweet_id)
+
+
+like_buffer.add_flush_listener(invalidate_tweets)
+# Отложенная рассылка меняет ленты подписчиков: их ETag должен смениться
+job_runner.add_done_listener("fan_out", lambda payload: versions.bump_feed())
+
+
+def render_tweet(tweet: Tweet) -> TweetOut:
+    return TweetOut(
+        id=tweet.id,
+        content=tweet.text,
+        attachments=[media.image_url for media in tweet.media],
+        author=AuthorOut(id=tweet.user_id, name=tweet.author.username),
+        count_likes=tweet.count_likes,
+        likes=[
+            LikeOut(user_id=like.user.id, name=like.user.username)
+            for like in tweet.likes
+            if like.user is not None
+        ],
+    )
+
+
+def _new_tweet_data(
+    author: CurrentUser, tweet_id: int, attachments: List[str], text: str
+) -> dict:
+    return TweetOut(
+        id=tweet_id,
+        content=text,
+        attachments=attachments,
+        author=AuthorOut(id=author.id, name=author.username),
+        count_likes=0,
+        likes=[],
+    ).model_dump()
+
+
+# Функция публикует в поток ленты только что созданные твиты. created -
+# результат tweets.create_tweets, так что представление собирается без
+# запросов к БД, и только если событие кому-то понадобится.
+def publish_new_tweets(
+    author: CurrentUser, created: Dict[int, List[str]], texts: Sequence[str]
+) -> None:
+    for (tweet_id, attachments), text in zip(created.items(), texts):
+        stream_hub.publish(
+            "tweet",
+            author.id,
+            partial(_new_tweet_data, author, tweet_id, attachments, text),
+        )
+
+
+def _with_pending_likes(tweet: TweetOut) -> TweetOut:
+    pending = like_buffer.pending(tweet.id)
+    if not pending:
+        return tweet
+    return tweet.model_copy(
+        update={"count_likes": tweet.count_likes + pending}
+    )
+
+
+# Функция возвращает представления твитов в порядке tweet_ids. Промахи кэша
+# загружаются одним пакетом: авторы, медиа и лайкнувшие подгружаются на всю
+# пачку, поэтому число запросов не зависит от количества твитов и лайков.
+async def render_tweets(
+    db: AsyncSession, tweet_ids: List[int]
+) -> List[TweetOut]:
+    rendered = {}
+    missing = []
+    for tweet_id in tweet_ids:
+        tweet = tweet_cache.get(tweet_id)
+        if tweet is None:
+            missing.append(tweet_id)
+        else:
+            rendered[tweet_id] = tweet
+
+    if missing:
+        mark = invalidations.counter
+        tweets = await db.scalars(
+            select(Tweet)
+            .options(
+                joinedload(Tweet.author),
+                selectinload(Tweet.media),
+                selectinload(Tweet.likes).joinedload(Like.user),
+            )
+            .where(Tweet.id.in_(missing))
+        )
+        replica = db.info.get("replica", False)
+        for tweet in tweets:
+            rendered[tweet.id] = render_tweet(tweet)
+            if invalidations.changed_since(tweet.id, mark):
+                continue
+            if not (replica and recently_changed.get(tweet.id)):
+                tweet_cache.set(tweet.id, rendered[tweet.id])
+
+    return [
+        _with_pending_likes(rendered[tweet_id])
+        for tweet_id in tweet_ids
+        if tweet_id in rendered
+    ]
@@ -0,0 +1,79 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+# Модели ответов API. Роуты возвращают их экземпляры: FastAPI сериализует
+# их через pydantic без обхода jsonable_encoder, а /docs показывает
+# настоящую схему ответов.
+
+
+class AuthorOut(BaseModel):
+    id: int
+    name: str
+
+
+class LikeOut(BaseModel):
+    user_id: int
+    name: str
+
+
+class TweetOut(BaseModel):
+    id: int
+    content: str
+    attachments: List[str]
+    author: AuthorOut
+    count_likes: int
+    likes: List[LikeOut]
+
+
+class FeedResponse(BaseModel):
+    result: bool = True
+    tweets: List[TweetOut]
+    next_cursor: Optional[int] = None
+
+
+class SearchResponse(BaseModel):
+    result: bool = True
+    tweets: List[TweetOut]
+    next_cursor: Optional[str] = None
+
+
+class TrendingResponse(BaseModel):
+    result: bool = True
+    tweets: List[TweetOut]
+
+
+class UserShortOut(BaseModel):
+    id: int
+    name: str
+
+
+class UserOut(BaseModel):
+    id: int
+    name: str
+    followers: List[UserShortOut]
+    following: List[UserShortOut]
+
+
+class UserResponse(BaseModel):
+    result: bool = True
+    user: UserOut
+
+
+class ResultResponse(BaseModel):
+    result: bool = True
+
+
+class TweetCreatedResponse(BaseModel):
+    result: bool = True
+    tweet_id: int
+
+
+class TweetsCreatedResponse(BaseModel):
+    result: bool = True
+    tweet_ids: List[int]
+
+
+class MediaUploadedResponse(BaseModel):
+    result: bool = True
+    media_id: int
@@ -0,0 +1,73 @@
+import argparse
+import json
+import sys
+from typing import Dict, List, Tuple
+
+METRICS = ("p50_ms", "p99_ms", "rps")
+
+
+def _index(report: dict) -> Dict[Tuple[str, str], dict]:
+    return {
+        (result["dataset"], result["scenario"]): result
+        for result in report["results"]
+    }
+
+
+def _change(old: float, new: float) -> float:
+    if not old:
+        return 0.0
+    return (new - old) / old
+
+
+# Функция сравнивает два прогона и возвращает строки отчёта и список
+# регрессий: задержка выросла или пропускная способность упала больше
+# чем на threshold (доля)
+def compare(
+    baseline: dict, candidate: dict, threshold: float = 0.1
+) -> Tuple[List[str], List[str]]:
+    old_results = _index(baseline)
+    new_results = _index(candidate)
+
+    lines = [
+        "{:<8} {:<14} {:>18} {:>18} {:>18}".format(
+            "dataset", "scenario", *METRICS
+        )
+    ]
+    regressions = []
+    for key in sorted(old_results.keys() & new_results.keys()):
+        old, new = old_results[key], new_results[key]
+        cells = []
+        for metric in METRICS:
+            change = _change(old[metric], new[metric])
+            worse = -change if metric == "rps" else change
+            mark = "!" if worse > threshold else " "
+            if worse > threshold:
+                regressions.append(f"{key[0]}/{key[1]} {metric}")
+            cells.append(f"{new[metric]:>9.2f} {change:>+7.1%}{mark}")
+        lines.append("{:<8} {:<14} ".format(*key) + " ".join(cells))
+
+    return lines, regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Сравнение результатов двух прогонов бенчмарка"
+    )
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(args.baseline) as baseline, open(args.candidate) as candidate:
+        lines, regressions = compare(
+            json.load(baseline), json.load(candidate), args.threshold
+        )
+
+    print("\n".join(lines))
+    if regressions:
+        print("Регрессии: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
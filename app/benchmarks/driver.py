@@ -0,0 +1,441 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+from api.feed import tweet_cache
+from benchmarks.seed import SIZES, DatasetSize, api_key, migrate, seed_database
+from benchmarks.stats import percentile
+from core.limits import rate_limiter
+from core.media import media_dir
+from core.security import api_key_cache
+from db.database import get_db, get_read_db, make_engine
+from db.trending import trending_board
+from main import app
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+# Один запрос сценария: метод, путь и необязательные json/files
+class BenchRequest(NamedTuple):
+    method: str
+    path: str
+    api_key: Optional[str]
+    json: Optional[dict] = None
+    files: Optional[dict] = None
+
+
+# Состояние прогона, общее для сценариев одного набора данных
+class Context:
+    def __init__(self, size: DatasetSize, rng: random.Random):
+        self.size = size
+        self.rng = rng
+        # Запросы, отменяющие успешные лайки, подписки и созданные твиты:
+        # по ним работают сценарии unlike, unfollow и delete_tweet
+        self.undo: Dict[str, List[BenchRequest]] = {}
+
+    def remember(self, scenario: str, request: BenchRequest, body) -> None:
+        if scenario == "create_tweet":
+            path = f"/api/tweets/{body['tweet_id']}"
+        elif scenario in ("like", "follow"):
+            path = request.path
+        else:
+            return
+        self.undo.setdefault(scenario, []).append(
+            BenchRequest("DELETE", path, request.api_key)
+        )
+
+    def pop_undo(self, scenario: str) -> Optional[BenchRequest]:
+        pending = self.undo.get(scenario)
+        return pending.pop() if pending else None
+
+    def user(self) -> int:
+        return self.rng.randint(1, self.size.users)
+
+    def tweet(self) -> int:
+        return self.rng.randint(1, self.size.tweets)
+
+
+def _feed(ctx: Context) -> BenchRequest:
+    return BenchRequest("GET", "/api/tweets", api_key(ctx.user()))
+
+
+def _feed_page(ctx: Context) -> BenchRequest:
+    return BenchRequest(
+        "GET", f"/api/tweets?cursor={ctx.tweet()}", api_key(ctx.user())
+    )
+
+
+def _trending(ctx: Context) -> BenchRequest:
+    return BenchRequest("GET", "/api/tweets/trending", api_key(ctx.user()))
+
+
+def _me(ctx: Context) -> BenchRequest:
+    return BenchRequest("GET", "/api/users/me", api_key(ctx.user()))
+
+
+def _profile(ctx: Context) -> BenchRequest:
+    return BenchRequest("GET", f"/api/users/{ctx.user()}", None)
+
+
+def _create_tweet(ctx: Context) -> BenchRequest:
+    return BenchRequest(
+        "POST",
+        "/api/tweets",
+        api_key(ctx.user()),
+        json={"tweet_data": "benchmark tweet", "tweet_media_ids": []},
+    )
+
+
+def _bulk_create(ctx: Context) -> BenchRequest:
+    return BenchRequest(
+        "POST",
+        "/api/tweets/bulk",
+        api_key(ctx.user()),
+        json={"tweets": [{"tweet_data": "benchmark bulk"}] * 10},
+    )
+
+
+def _upload_media(ctx: Context) -> BenchRequest:
+    content = ctx.rng.getrandbits(8 * 4096).to_bytes(4096, "little")
+    return BenchRequest(
+        "POST",
+        "/api/medias",
+        api_key(ctx.user()),
+        files={"file": ("bench.jpg", content, "image/jpeg")},
+    )
+
+
+def _like(ctx: Context) -> BenchRequest:
+    return BenchRequest(
+        "POST", f"/api/tweets/{ctx.tweet()}/likes", api_key(ctx.user())
+    )
+
+
+def _unlike(ctx: Context) -> Optional[BenchRequest]:
+    return ctx.pop_undo("like")
+
+
+def _follow(ctx: Context) -> BenchRequest:
+    return BenchRequest(
+        "POST", f"/api/users/{ctx.user()}/follow", api_key(ctx.user())
+    )
+
+
+def _unfollow(ctx: Context) -> Optional[BenchRequest]:
+    return ctx.pop_undo("follow")
+
+
+def _delete_tweet(ctx: Context) -> Optional[BenchRequest]:
+    return ctx.pop_undo("create_tweet")
+
+
+def _metrics(ctx: Context) -> BenchRequest:
+    return BenchRequest("GET", "/metrics", None)
+
+
+# Сценарии выполняются в этом порядке: unlike, unfollow и delete_tweet
+# отменяют то, что сделали like, follow и create_tweet. Ответы с
+# result: false (например, подписка на самого себя) считаются в errors.
+SCENARIOS: Dict[str, Callable[[Context], Optional[BenchRequest]]] = {
+    "feed": _feed,
+    "feed_page": _feed_page,
+    "trending": _trending,
+    "user_me": _me,
+    "user_profile": _profile,
+    "create_tweet": _create_tweet,
+    "bulk_create": _bulk_create,
+    "upload_media": _upload_media,
+    "like": _like,
+    "unlike": _unlike,
+    "follow": _follow,
+    "unfollow": _unfollow,
+    "delete_tweet": _delete_tweet,
+    "metrics": _metrics,
+}
+
+
+def summarize(latencies: List[float], seconds: float, errors: int) -> dict:
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        "requests": count,
+        "errors": errors,
+        "seconds": round(seconds, 4),
+        "rps": round(count / seconds, 2) if seconds else 0.0,
+        "mean_ms": round(sum(ordered) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+async def _send(client: httpx.AsyncClient, request: BenchRequest):
+    headers = {"api-key": request.api_key} if request.api_key else {}
+    start = time.perf_counter()
+    response = await client.request(
+        request.method,
+        request.path,
+        headers=headers,
+        json=request.json,
+        files=request.files,
+    )
+    elapsed = time.perf_counter() - start
+
+    ok = response.status_code == 200
+    body = None
+    if ok and response.headers.get("content-type", "").startswith(
+        "application/json"
+    ):
+        body = response.json()
+        ok = body.get("result") is not False
+    return elapsed, ok, body
+
+
+# Функция выполняет запросы с заданной конкурентностью и возвращает
+# задержки каждого запроса, общее время и число ошибок
+async def run_requests(
+    client: httpx.AsyncClient,
+    requests: List[BenchRequest],
+    concurrency: int,
+    on_response: Optional[Callable] = None,
+):
+    queue = list(reversed(requests))
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            request = queue.pop()
+            elapsed, ok, body = await _send(client, request)
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+            elif on_response is not None:
+                on_response(request, body)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, errors
+
+
+async def bench_dataset(
+    url: str,
+    size: DatasetSize,
+    scenarios: List[str],
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    seed: int,
+) -> List[dict]:
+    engine = make_engine(url)
+    factory = async_sessionmaker(
+        bind=engine, autoflush=False, expire_on_commit=False
+    )
+
+    async def override_get_db():
+        async with factory() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    api_key_cache.clear()
+    tweet_cache.clear()
+    # Рейтинг популярного строится по набору данных, как после рестарта
+    session_factory = trending_board.session_factory
+    trending_board.session_factory = factory
+    # Бенчмарк меряет обработку запросов, а не лимиты частоты: несколько
+    # пользователей драйвера упирались бы в них за доли секунды
+    rate_limit_enabled = rate_limiter.enabled
+    rate_limiter.enabled = False
+
+    ctx = Context(size, random.Random(seed))
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    try:
+        await trending_board.rebuild()
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            for name in scenarios:
+                build = SCENARIOS[name]
+                batch = [build(ctx) for _ in range(warmup + requests)]
+                batch = [request for request in batch if request is not None]
+
+                def remember(request, body, name=name):
+                    ctx.remember(name, request, body)
+
+                await run_requests(
+                    client, batch[:warmup], concurrency, remember
+                )
+                latencies, seconds, errors = await run_requests(
+                    client, batch[warmup:], concurrency, remember
+                )
+                results.append(
+                    {
+                        "dataset": size.name,
+                        "scenario": name,
+                        "concurrency": concurrency,
+                        **summarize(latencies, seconds, errors),
+                    }
+                )
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        app.dependency_overrides.pop(get_read_db, None)
+        trending_board.session_factory = session_factory
+        rate_limiter.enabled = rate_limit_enabled
+        await engine.dispose()
+
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_database(url: str, size: DatasetSize, seed: int, reset: bool):
+    database = make_url(url).database
+    if make_url(url).get_backend_name() == "sqlite" and database:
+        if os.path.exists(database):
+            os.remove(database)
+    migrate(url, reset=reset)
+    return seed_database(url, size, seed)
+
+
+# Функция прогоняет сценарии на каждом наборе данных и возвращает
+# результаты в виде, пригодном для сохранения в JSON и сравнения
+def run_benchmark(
+    url_template: str,
+    sizes: List[str],
+    scenarios: List[str],
+    requests: int = 200,
+    concurrency: int = 10,
+    warmup: int = 20,
+    seed: int = 0,
+    reset: bool = False,
+) -> dict:
+    uploaded_before = set(os.listdir(media_dir))
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": requests,
+            "concurrency": concurrency,
+            "warmup": warmup,
+            "seed": seed,
+        },
+        "datasets": {},
+        "results": [],
+    }
+
+    try:
+        for name in sizes:
+            size = SIZES[name]
+            url = url_template.format(size=name)
+            start = time.perf_counter()
+            counts = prepare_database(url, size, seed, reset)
+            report["datasets"][name] = {
+                **counts,
+                "backend": make_url(url).get_backend_name(),
+                "seed_seconds": round(time.perf_counter() - start, 2),
+            }
+            report["results"].extend(
+                asyncio.run(
+                    bench_dataset(
+                        url,
+                        size,
+                        scenarios,
+                        requests,
+                        concurrency,
+                        warmup,
+                        seed,
+                    )
+                )
+            )
+    finally:
+        # Файлы, загруженные сценарием upload_media, не оставляем
+        for filename in set(os.listdir(media_dir)) - uploaded_before:
+            os.remove(os.path.join(media_dir, filename))
+
+    return report
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        "{:<8} {:<14} {:>6} {:>6} {:>9} {:>9} {:>9}".format(
+            "dataset", "scenario", "reqs", "errors", "rps", "p50 ms", "p99 ms"
+        )
+    ]
+    for result in report["results"]:
+        lines.append(
+            "{dataset:<8} {scenario:<14} {requests:>6} {errors:>6} "
+            "{rps:>9.1f} {p50_ms:>9.2f} {p99_ms:>9.2f}".format(**result)
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк API")
+    parser.add_argument(
+        "--url",
+        default="sqlite+aiosqlite:///./bench-{size}.db",
+        help="URL БД; {size} заменяется именем набора данных",
+    )
+    parser.add_argument("--sizes", default="tiny,small")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="откатить миграции перед заполнением (для не-SQLite БД)",
+    )
+    parser.add_argument("--output", default="bench-results.json")
+    args = parser.parse_args()
+
+    sizes = args.sizes.split(",")
+    scenarios = args.scenarios.split(",")
+    for name in sizes:
+        if name not in SIZES:
+            parser.error(f"неизвестный набор данных: {name}")
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"неизвестный сценарий: {name}")
+
+    report = run_benchmark(
+        args.url,
+        sizes,
+        scenarios,
+        requests=args.requests,
+        concurrency=args.concurrency,
+        warmup=args.warmup,
+        seed=args.seed,
+        reset=args.reset,
+    )
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2, ensure_ascii=False)
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
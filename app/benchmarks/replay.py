@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+from benchmarks.stats import percentile, route_of
+
+# Заголовки, которые httpx выставляет сам
+SKIPPED_HEADERS = {
+    "host",
+    "content-length",
+    "transfer-encoding",
+    "connection",
+    "content-type",
+}
+
+
+def load_capture(path: str) -> List[dict]:
+    with open(path, "rb") as capture:
+        records = [json.loads(line) for line in capture if line.strip()]
+    return sorted(records, key=lambda record: record["ts"])
+
+
+# Пользователи записи (хэши api-key) по порядку появления раскладываются
+# по переданным api-key: так записанная нагрузка воспроизводится на
+# тестовых пользователях (например, bench-1..N из benchmarks.seed)
+class KeyMapper:
+    def __init__(self, api_keys: List[str]):
+        self.api_keys = api_keys
+        self._assigned: Dict[str, str] = {}
+
+    def __call__(self, user: Optional[str]) -> Optional[str]:
+        if user is None or not self.api_keys:
+            return None
+        if user not in self._assigned:
+            index = len(self._assigned) % len(self.api_keys)
+            self._assigned[user] = self.api_keys[index]
+        return self._assigned[user]
+
+
+def build_request(record: dict, api_key: Optional[str]) -> dict:
+    headers = {
+        name: value
+        for name, value in record["headers"].items()
+        if name not in SKIPPED_HEADERS
+    }
+    if api_key is not None:
+        headers["api-key"] = api_key
+
+    url = record["path"]
+    if record.get("query"):
+        url += "?" + record["query"]
+
+    request = {"method": record["method"], "url": url, "headers": headers}
+    content_type = record["headers"].get("content-type", "")
+    if content_type.startswith("multipart/"):
+        # Содержимое файлов не записывается: загружаем случайные байты
+        # примерно того же размера
+        size = max(1, record["body_size"] - 200)
+        request["files"] = {
+            "file": ("replay.bin", os.urandom(size), "image/jpeg")
+        }
+    elif record.get("body"):
+        request["content"] = record["body"].encode()
+        headers["content-type"] = content_type or "application/json"
+    return request
+
+
+def _summary(latencies: List[float], errors: int) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(ordered, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+# Функция воспроизводит записанные запросы. Интервалы между запросами
+# сохраняются с ускорением speed (0 - без пауз), одновременно выполняется
+# не больше concurrency запросов. Возвращает распределения задержек по
+# роутам и общее, а также отставание от расписания.
+async def replay(
+    client: httpx.AsyncClient,
+    records: List[dict],
+    concurrency: int = 10,
+    speed: float = 1.0,
+    api_keys: Optional[List[str]] = None,
+) -> dict:
+    key_for = KeyMapper(api_keys or [])
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    lags: List[float] = []
+    tasks = set()
+
+    async def send(record: dict, request: dict, scheduled: float):
+        lags.append(max(0.0, time.perf_counter() - scheduled))
+        route = f"{record['method']} {route_of(record['path'])}"
+        start = time.perf_counter()
+        try:
+            response = await client.request(**request)
+            failed = response.status_code >= 500 or (
+                response.status_code != record["status"]
+            )
+        except httpx.HTTPError:
+            failed = True
+        finally:
+            semaphore.release()
+        latencies[route].append(time.perf_counter() - start)
+        if failed:
+            errors[route] += 1
+
+    first_ts = records[0]["ts"] if records else 0.0
+    started = time.perf_counter()
+    for record in records:
+        scheduled = started
+        if speed > 0:
+            scheduled += (record["ts"] - first_ts) / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await semaphore.acquire()
+
+        request = build_request(record, key_for(record.get("user")))
+        task = asyncio.create_task(send(record, request, scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    seconds = time.perf_counter() - started
+
+    everything = [value for values in latencies.values() for value in values]
+    return {
+        "seconds": round(seconds, 4),
+        "rps": round(len(everything) / seconds, 2) if seconds else 0.0,
+        "total": _summary(everything, sum(errors.values())),
+        "lag_p99_ms": round(percentile(sorted(lags), 0.99) * 1000, 3),
+        "routes": {
+            route: _summary(values, errors[route])
+            for route, values in sorted(latencies.items())
+        },
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        "{:<36} {:>7} {:>6} {:>9} {:>9} {:>9}".format(
+            "route", "reqs", "errors", "p50 ms", "p90 ms", "p99 ms"
+        )
+    ]
+    rows = list(report["routes"].items()) + [("total", report["total"])]
+    for route, summary in rows:
+        lines.append(
+            "{:<36} {requests:>7} {errors:>6} {p50_ms:>9.2f} "
+            "{p90_ms:>9.2f} {p99_ms:>9.2f}".format(route, **summary)
+        )
+    lines.append(
+        "{} rps, отставание от расписания p99 {} мс".format(
+            report["rps"], report["lag_p99_ms"]
+        )
+    )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Воспроизведение записанного трафика (CAPTURE_FILE)"
+    )
+    parser.add_argument("capture", help="JSONL-файл с записью запросов")
+    parser.add_argument("--base-url", default="http://localhost:81")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="ускорение относительно записи; 0 - без пауз",
+    )
+    parser.add_argument(
+        "--api-keys",
+        default="",
+        help="api-key через запятую, на которые раскладываются пользователи",
+    )
+    parser.add_argument(
+        "--bench-users",
+        type=int,
+        default=0,
+        help="использовать api-key bench-1..N из benchmarks.seed",
+    )
+    parser.add_argument("--output", help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    api_keys = [key for key in args.api_keys.split(",") if key]
+    api_keys += [f"bench-{user}" for user in range(1, args.bench_users + 1)]
+
+    async def run():
+        async with httpx.AsyncClient(
+            base_url=args.base_url, timeout=30
+        ) as client:
+            return await replay(
+                client,
+                load_capture(args.capture),
+                concurrency=args.concurrency,
+                speed=args.speed,
+                api_keys=api_keys,
+            )
+
+    report = asyncio.run(run())
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2, ensure_ascii=False)
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
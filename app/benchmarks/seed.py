@@ -0,0 +1,280 @@
+import argparse
+import bisect
+import os
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+from typing import Dict, Iterable, List, NamedTuple
+
+from alembic import command
+from alembic.config import Config
+from core import settings
+from db.models import Follow, Like, Media, TimelineEntry, Tweet, User, utcnow
+from sqlalchemy import create_engine, func, insert, select, text, union_all
+from sqlalchemy.engine import Connection, make_url
+
+ALEMBIC_INI = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "alembic.ini"
+)
+
+BATCH_SIZE = 5000
+
+# Твиты набора равномерно распределены по последним SEED_SPAN, чтобы в
+# окне рейтинга популярного оказалась только их часть
+SEED_SPAN = timedelta(days=3)
+
+
+# Размер синтетического набора данных. Популярность авторов и активность
+# пользователей распределены по степенному закону, поэтому в больших
+# наборах появляются авторы, чьи твиты подмешиваются в ленты при чтении.
+class DatasetSize(NamedTuple):
+    name: str
+    users: int
+    tweets: int
+    follows_per_user: int
+    likes_per_tweet: float
+    media_ratio: float
+
+
+SIZES: Dict[str, DatasetSize] = {
+    size.name: size
+    for size in (
+        DatasetSize("tiny", 50, 500, 5, 2, 0.2),
+        DatasetSize("small", 1000, 10000, 20, 3, 0.2),
+        DatasetSize("medium", 10000, 100000, 30, 5, 0.2),
+        DatasetSize("large", 50000, 1000000, 50, 5, 0.2),
+    )
+}
+
+
+def api_key(user_id: int) -> str:
+    return f"bench-{user_id}"
+
+
+SYNC_DRIVERS = {
+    "sqlite+aiosqlite": "sqlite",
+    "postgresql+asyncpg": "postgresql+psycopg2",
+}
+
+
+# Синхронный URL для сидирования из URL приложения (aiosqlite/asyncpg)
+def sync_url(url: str) -> str:
+    parsed = make_url(url)
+    drivername = SYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    return parsed.set(drivername=drivername).render_as_string(
+        hide_password=False
+    )
+
+
+def migrate(url: str, reset: bool = False) -> None:
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("sqlalchemy.url", url.replace("%", "%%"))
+    config.attributes["configure_logger"] = False
+    if reset:
+        command.downgrade(config, "base")
+    command.upgrade(config, "head")
+
+
+def _power_law(count: int, exponent: float) -> List[float]:
+    return list(
+        accumulate(1 / (rank + 1) ** exponent for rank in range(count))
+    )
+
+
+def _pick(rng: random.Random, cum_weights: List[float]) -> int:
+    # Номер (с 1) по накопленным весам
+    point = rng.random() * cum_weights[-1]
+    return bisect.bisect_left(cum_weights, point) + 1
+
+
+def _insert_batches(connection: Connection, table, rows: Iterable[dict]):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            connection.execute(insert(table), batch)
+            batch = []
+    if batch:
+        connection.execute(insert(table), batch)
+
+
+def _follows(rng: random.Random, size: DatasetSize, popularity):
+    edges = set()
+    for follower in range(1, size.users + 1):
+        wanted = min(
+            size.users - 1, int(rng.expovariate(1 / size.follows_per_user))
+        )
+        followees = set()
+        attempts = 0
+        while len(followees) < wanted and attempts < wanted * 5:
+            attempts += 1
+            followee = _pick(rng, popularity)
+            if followee != follower:
+                followees.add(followee)
+        edges.update((follower, followee) for followee in followees)
+    return sorted(edges)
+
+
+def _reset_sequences(connection: Connection) -> None:
+    for table in ("users", "tweets", "likes", "media"):
+        connection.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"(SELECT max(id) FROM {table}))"
+            )
+        )
+
+
+# Функция заполняет пустую БД (схема уже создана миграциями) набором
+# данных size. Одинаковый random_seed даёт одинаковые данные.
+def seed_database(
+    url: str, size: DatasetSize, random_seed: int = 0
+) -> Dict[str, int]:
+    rng = random.Random(random_seed)
+    popularity = _power_law(size.users, 1.1)
+    activity = _power_law(size.users, 0.8)
+    engine = create_engine(sync_url(url))
+    counts = {"users": size.users, "tweets": size.tweets}
+
+    with engine.begin() as connection:
+        if connection.scalar(select(func.count()).select_from(User)):
+            raise RuntimeError("База для бенчмарка должна быть пустой")
+
+        edges = _follows(rng, size, popularity)
+        followers_count = [0] * (size.users + 1)
+        for _, followee in edges:
+            followers_count[followee] += 1
+
+        _insert_batches(
+            connection,
+            User.__table__,
+            (
+                {
+                    "id": user_id,
+                    "username": f"user{user_id}",
+                    "api_key": api_key(user_id),
+                    "followers_count": followers_count[user_id],
+                }
+                for user_id in range(1, size.users + 1)
+            ),
+        )
+        _insert_batches(
+            connection,
+            Follow.__table__,
+            (
+                {"follower_id": follower, "followee_id": followee}
+                for follower, followee in edges
+            ),
+        )
+        counts["follows"] = len(edges)
+        counts["likes"] = counts["media"] = 0
+
+        like_id = media_id = 0
+        now = utcnow()
+        for start in range(1, size.tweets + 1, BATCH_SIZE):
+            tweets, likes, media = [], [], []
+            for tweet_id in range(
+                start, min(start + BATCH_SIZE, size.tweets + 1)
+            ):
+                author = _pick(rng, activity)
+                likers = {
+                    rng.randint(1, size.users)
+                    for _ in range(
+                        int(rng.expovariate(1 / size.likes_per_tweet))
+                    )
+                }
+                tweets.append(
+                    {
+                        "id": tweet_id,
+                        "text": f"tweet {tweet_id} by user{author}",
+                        "user_id": author,
+                        "count_likes": len(likers),
+                        "created_at": now
+                        - SEED_SPAN * (size.tweets - tweet_id) / size.tweets,
+                    }
+                )
+                for liker in sorted(likers):
+                    like_id += 1
+                    likes.append(
+                        {"id": like_id, "user_id": liker, "tweet_id": tweet_id}
+                    )
+                if rng.random() < size.media_ratio:
+                    media_id += 1
+                    media.append(
+                        {
+                            "id": media_id,
+                            "image_url": f"{rng.getrandbits(128):032x}.jpg",
+                            "tweet_id": tweet_id,
+                            "user_id": author,
+                        }
+                    )
+
+            connection.execute(insert(Tweet.__table__), tweets)
+            _insert_batches(connection, Like.__table__, likes)
+            _insert_batches(connection, Media.__table__, media)
+            counts["likes"] += len(likes)
+            counts["media"] += len(media)
+
+        # Ленты собираются так же, как их раскладывает приложение: твиты
+        # авторов с TIMELINE_FANOUT_LIMIT подписчиков и больше не рассылаются
+        tweets_table = Tweet.__table__
+        follows_table = Follow.__table__
+        users_table = User.__table__
+        connection.execute(
+            insert(TimelineEntry.__table__).from_select(
+                ["user_id", "tweet_id"],
+                union_all(
+                    select(tweets_table.c.user_id, tweets_table.c.id),
+                    select(follows_table.c.follower_id, tweets_table.c.id)
+                    .join(
+                        follows_table,
+                        follows_table.c.followee_id == tweets_table.c.user_id,
+                    )
+                    .join(
+                        users_table,
+                        users_table.c.id == tweets_table.c.user_id,
+                    )
+                    .where(
+                        users_table.c.followers_count
+                        < settings.TIMELINE_FANOUT_LIMIT
+                    ),
+                ),
+            )
+        )
+        counts["timelines"] = connection.scalar(
+            select(func.count()).select_from(TimelineEntry)
+        )
+
+        if connection.dialect.name == "postgresql":
+            _reset_sequences(connection)
+
+    engine.dispose()
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Заполнение БД синтетическими данными для бенчмарка"
+    )
+    parser.add_argument("url", help="URL БД, например sqlite+aiosqlite:///x")
+    parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="откатить все миграции перед заполнением (удаляет данные)",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    migrate(args.url, reset=args.reset)
+    counts = seed_database(args.url, SIZES[args.size], args.seed)
+    print(
+        ", ".join(f"{name}: {count}" for name, count in counts.items()),
+        f"({time.perf_counter() - start:.1f} s)",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+import re
+from typing import List
+
+
+# Перцентиль по методу ближайшего ранга; значения уже отсортированы
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+# Путь без конкретных id, чтобы группировать запросы по роутам
+def route_of(path: str) -> str:
+    return re.sub(r"/\d+(?=/|$)", "/{id}", path)
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Deque, Optional
+
+import anyio
+import orjson
+from core import settings
+from core.instrumentation import is_event_stream
+from core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Заголовки с секретами в запись не попадают. Вместо api-key пишется его
+# хэш: по нему replay различает пользователей, не зная их ключей.
+SECRET_HEADERS = {"api-key", "authorization", "cookie", "x-api-key"}
+
+captured_requests = registry.counter(
+    "capture_requests_total", "Записано запросов для replay"
+)
+dropped_requests = registry.counter(
+    "capture_dropped_total", "Запросов не записано из-за переполнения буфера"
+)
+
+
+def user_tag(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+# Буфер записи трафика: middleware только кладёт запись в очередь в
+# памяти, а фоновая задача раз в flush_interval секунд дописывает
+# накопленное в JSONL-файл в отдельном потоке. При переполнении очереди
+# записи отбрасываются, запрос при этом не ждёт диска.
+class CaptureWriter:
+    def __init__(
+        self,
+        path: str,
+        enabled: bool,
+        flush_interval: float,
+        max_pending: int,
+    ):
+        self.path = path
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Deque[bytes] = deque()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, record: dict) -> None:
+        if len(self._pending) >= self.max_pending:
+            dropped_requests.inc()
+            return
+        self._pending.append(orjson.dumps(record) + b"\n")
+        captured_requests.inc()
+
+    def _write(self, lines) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "ab") as capture:
+            capture.writelines(lines)
+
+    async def flush(self) -> None:
+        lines = []
+        while self._pending:
+            lines.append(self._pending.popleft())
+        if lines:
+            await anyio.to_thread.run_sync(self._write, lines)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Не удалось записать захваченные запросы")
+
+    async def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    # Останавливает фоновую задачу и дописывает всё, что осталось в буфере
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+
+
+capture_writer = CaptureWriter(
+    path=settings.CAPTURE_FILE,
+    enabled=settings.CAPTURE_ENABLED,
+    flush_interval=settings.CAPTURE_FLUSH_INTERVAL,
+    max_pending=settings.CAPTURE_MAX_PENDING,
+)
+
+
+# ASGI-middleware: записывает долю CAPTURE_SAMPLE_RATE запросов к /api/
+# (метод, путь, заголовки без секретов, тело, статус и время ответа)
+class RequestCaptureMiddleware:
+    def __init__(self, app, writer: CaptureWriter = capture_writer):
+        self.app = app
+        self.writer = writer
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not self.writer.enabled
+            or not scope["path"].startswith("/api/")
+            or random.random() >= settings.CAPTURE_SAMPLE_RATE
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        size = 0
+        status = 500
+
+        async def receive_wrapper():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                size += len(body)
+                if size <= settings.CAPTURE_MAX_BODY:
+                    chunks.append(body)
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                streaming = is_event_stream(message)
+            await send(message)
+
+        # Потоки событий не записываются: при replay они не завершатся
+        streaming = False
+        started_at = time.time()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            if not streaming:
+                self.writer.add(
+                    self._record(
+                        scope,
+                        started_at,
+                        time.perf_counter() - start,
+                        status,
+                        b"".join(chunks),
+                        size,
+                    )
+                )
+
+    def _record(self, scope, started_at, seconds, status, body, size):
+        headers = {}
+        user = None
+        for name, value in scope["headers"]:
+            name = name.decode("latin-1").lower()
+            if name == "api-key":
+                user = user_tag(value.decode("latin-1"))
+            elif name not in SECRET_HEADERS:
+                headers[name] = value.decode("latin-1")
+
+        # Загружаемые файлы не сохраняются, только их размер
+        content_type = headers.get("content-type", "")
+        text = None
+        if size <= settings.CAPTURE_MAX_BODY and not content_type.startswith(
+            "multipart/"
+        ):
+            text = body.decode("utf-8", errors="replace")
+
+        return {
+            "ts": started_at,
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope["query_string"].decode("latin-1"),
+            "headers": headers,
+            "user": user,
+            "body": text,
+            "body_size": size,
+            "status": status,
+            "duration_ms": round(seconds * 1000, 3),
+        }
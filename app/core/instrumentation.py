@@ -0,0 +1,194 @@
+import logging
+import re
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from core import settings
+from core.metrics import registry
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Время обработки запроса",
+    labelnames=("method", "route", "status"),
+)
+request_queries = registry.histogram(
+    "http_request_db_queries",
+    "Число запросов к БД за HTTP-запрос",
+    buckets=QUERY_BUCKETS,
+    labelnames=("method", "route"),
+)
+request_db_seconds = registry.histogram(
+    "http_request_db_seconds",
+    "Время запросов к БД за HTTP-запрос",
+    labelnames=("method", "route"),
+)
+slow_requests = registry.counter(
+    "http_slow_requests_total",
+    "Запросов дольше SLOW_REQUEST_THRESHOLD",
+    labelnames=("method", "route"),
+)
+query_duration = registry.histogram(
+    "db_query_duration_seconds", "Время выполнения запроса к БД"
+)
+
+
+# Запросы к БД, выполненные в рамках одного HTTP-запроса
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        # текст запроса -> [количество, секунды]
+        self.statements: Dict[str, List[float]] = {}
+
+    def add(self, statement: str, seconds: float) -> None:
+        self.queries += 1
+        self.db_seconds += seconds
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    # Самые дорогие запросы для лога медленного запроса
+    def breakdown(self, top: int = 5) -> str:
+        heaviest = sorted(
+            self.statements.items(), key=lambda item: item[1][1], reverse=True
+        )[:top]
+        return "; ".join(
+            "{}x {:.1f}ms {}".format(
+                int(count),
+                seconds * 1000,
+                re.sub(r"\s+", " ", statement)[:200],
+            )
+            for statement, (count, seconds) in heaviest
+        )
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    seconds = time.perf_counter() - conn.info["query_start"].pop()
+    query_duration.observe(seconds)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.add(statement, seconds)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start"):
+        connection.info["query_start"].pop()
+
+
+# Функция возвращает шаблон пути роута (/api/tweets/{tweet_id}), чтобы
+# метки метрик не зависели от конкретных id
+def _route_path(scope) -> str:
+    endpoint = scope.get("endpoint")
+    app = scope.get("app")
+    if endpoint is None or app is None:
+        return "unmatched"
+
+    paths = getattr(app.state, "route_paths", None)
+    if paths is None:
+        paths = {}
+        for route in app.routes:
+            target = getattr(route, "endpoint", None) or getattr(
+                route, "app", None
+            )
+            paths[target] = route.path
+        app.state.route_paths = paths
+    return paths.get(endpoint, "unmatched")
+
+
+def is_event_stream(message) -> bool:
+    return any(
+        name.lower() == b"content-type"
+        and value.startswith(b"text/event-stream")
+        for name, value in message.get("headers", ())
+    )
+
+
+# ASGI-middleware: время ответа по роутам и статусам, число и время
+# запросов к БД за запрос, лог медленных запросов с разбивкой по запросам
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = 500
+        start = time.perf_counter()
+        # У потока событий меряется время до заголовков ответа: сам поток
+        # длится, пока клиент подключён
+        headers_sent = None
+
+        async def send_wrapper(message):
+            nonlocal status, headers_sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if is_event_stream(message):
+                    headers_sent = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            end = headers_sent or time.perf_counter()
+            self._record(scope, status, end - start, stats)
+
+    def _record(self, scope, status, seconds, stats: RequestStats) -> None:
+        method = scope["method"]
+        route = _route_path(scope)
+
+        request_duration.labels(method, route, status).observe(seconds)
+        request_queries.labels(method, route).observe(stats.queries)
+        request_db_seconds.labels(method, route).observe(stats.db_seconds)
+
+        threshold = settings.SLOW_REQUEST_THRESHOLD
+        if threshold and seconds >= threshold:
+            slow_requests.labels(method, route).inc()
+            logger.warning(
+                "Медленный запрос %s %s: %.1f мс, статус %s, "
+                "запросов к БД %s (%.1f мс): %s",
+                method,
+                scope["path"],
+                seconds * 1000,
+                status,
+                stats.queries,
+                stats.db_seconds * 1000,
+                stats.breakdown(),
+            )
@@ -0,0 +1,273 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Tuple
+
+from core import settings
+from core.instrumentation import is_event_stream
+from core.metrics import registry
+from core.security import api_key_cache, lookup_user
+from db.database import session
+from db.pool import recent_pool_wait
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import Headers
+
+READ = "read"
+WRITE = "write"
+UPLOAD = "upload"
+
+rate_limited = registry.counter(
+    "rate_limited_total",
+    "Запросов отклонено по лимиту частоты",
+    labelnames=("budget",),
+)
+shed_requests = registry.counter(
+    "shed_requests_total", "Запросов отклонено из-за перегрузки"
+)
+
+
+class Budget(NamedTuple):
+    rate: float
+    burst: int
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float
+
+
+# Token bucket на каждую пару (вид запросов, ключ): корзина вмещает burst
+# токенов и пополняется на rate токенов в секунду, запрос забирает один.
+# Корзины пополняются лениво при обращении, поэтому фоновой задачи нет, а
+# в памяти держится не больше max_keys недавно использованных корзин:
+# вытесненная корзина при следующем запросе создаётся полной.
+class RateLimiter:
+    def __init__(
+        self, budgets: Dict[str, Budget], max_keys: int, enabled: bool
+    ):
+        self.budgets = budgets
+        self.max_keys = max_keys
+        self.enabled = enabled
+        # (вид, ключ) -> [токены, время последнего пополнения]
+        self._buckets: "OrderedDict[Tuple[str, str], list]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+    # Ограничен ли вид запросов: без лимита ключ корзины не нужен
+    def limits(self, kind: str) -> bool:
+        return self.enabled and self.budgets[kind].rate > 0
+
+    def acquire(self, key: str, kind: str) -> Decision:
+        budget = self.budgets[kind]
+        if not self.limits(kind):
+            return Decision(True, budget.burst, budget.burst, 0.0)
+
+        now = time.monotonic()
+        bucket = self._buckets.get((kind, key))
+        if bucket is None:
+            bucket = [float(budget.burst), now]
+            self._buckets[(kind, key)] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end((kind, key))
+            bucket[0] = min(
+                budget.burst, bucket[0] + (now - bucket[1]) * budget.rate
+            )
+            bucket[1] = now
+
+        if bucket[0] < 1:
+            retry_after = (1 - bucket[0]) / budget.rate
+            return Decision(False, budget.burst, 0, retry_after)
+        bucket[0] -= 1
+        return Decision(True, budget.burst, int(bucket[0]), 0.0)
+
+
+# Глобальный предел одновременно обрабатываемых запросов. Обычно он
+# равен max_concurrency, а пока среднее ожидание соединения из пула
+# дольше pool_wait - min_concurrency: запросы сверх него отклоняются
+# сразу, а не встают в очередь к пулу. Оставшихся запросов хватает, чтобы
+# среднее ожидание обновлялось и предел вернулся, когда пул разгрузится.
+class LoadShedder:
+    def __init__(
+        self,
+        max_concurrency: int,
+        min_concurrency: int,
+        pool_wait: float,
+        retry_after: int,
+    ):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.pool_wait = pool_wait
+        self.retry_after = retry_after
+        self.in_flight = 0
+
+    @property
+    def overloaded(self) -> bool:
+        return bool(self.pool_wait) and (
+            recent_pool_wait.seconds > self.pool_wait
+        )
+
+    @property
+    def limit(self) -> int:
+        if self.overloaded and self.min_concurrency:
+            return self.min_concurrency
+        return self.max_concurrency
+
+    def admit(self) -> bool:
+        limit = self.limit
+        if limit and self.in_flight >= limit:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+
+rate_limiter = RateLimiter(
+    budgets={
+        READ: Budget(
+            settings.RATE_LIMIT_READ_RATE, settings.RATE_LIMIT_READ_BURST
+        ),
+        WRITE: Budget(
+            settings.RATE_LIMIT_WRITE_RATE, settings.RATE_LIMIT_WRITE_BURST
+        ),
+        UPLOAD: Budget(
+            settings.RATE_LIMIT_UPLOAD_RATE, settings.RATE_LIMIT_UPLOAD_BURST
+        ),
+    },
+    max_keys=settings.RATE_LIMIT_MAX_KEYS,
+    enabled=settings.RATE_LIMIT_ENABLED,
+)
+
+load_shedder = LoadShedder(
+    max_concurrency=settings.SHED_MAX_CONCURRENCY,
+    min_concurrency=settings.SHED_MIN_CONCURRENCY,
+    pool_wait=settings.SHED_POOL_WAIT,
+    retry_after=settings.SHED_RETRY_AFTER,
+)
+
+registry.gauge(
+    "requests_in_flight",
+    "Запросов к API в обработке",
+    lambda: load_shedder.in_flight,
+)
+
+
+def request_budget(method: str, path: str) -> str:
+    if method in ("GET", "HEAD"):
+        return READ
+    if method == "POST" and path.rstrip("/") == "/api/medias":
+        return UPLOAD
+    return WRITE
+
+
+# Ключ корзины: пользователь по api-key, иначе адрес клиента. Если ключа
+# нет в кэше авторизации, пользователь ищется в БД тем же запросом, что и
+# в get_current_user, и попадает в кэш - роут в БД уже не пойдёт. Так
+# настоящий ключ с истёкшей записью в кэше сразу получает свою корзину, а
+# неизвестные ключи и запросы без ключа делят корзину адреса клиента:
+# случайные ключи не получают по полной корзине каждый и не расходуют и
+# не вытесняют корзины пользователей.
+class ClientKeys:
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    async def resolve(self, scope) -> str:
+        api_key = Headers(scope=scope).get("api-key")
+        user = api_key_cache.peek(api_key) if api_key else None
+        if user is None and api_key:
+            async with self.session_factory() as db:
+                user = await lookup_user(db, api_key)
+        if user is not None:
+            return f"user:{user.id}"
+        return "ip:{}".format((scope.get("client") or ("",))[0])
+
+
+client_keys = ClientKeys(session_factory=session)
+
+
+def _rejection(status: int, error_type: str, message: str, headers):
+    return ORJSONResponse(
+        {"result": False, "error_type": error_type, "error_message": message},
+        status_code=status,
+        headers=headers,
+    )
+
+
+# ASGI-middleware перед роутами /api: глобальный предел одновременных
+# запросов, затем лимит частоты по ключу из client_keys. Предел идёт
+# первым, чтобы поиск api-key в БД тоже не вставал в очередь к пулу при
+# перегрузке. Место в пределе освобождается после ответа и закрытия
+# сессии БД (teardown зависимостей идёт после отправки тела), а у потока
+# событий - с заголовками ответа: поток держит подключение долго, а с БД
+# работает только до них.
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        if not load_shedder.admit():
+            shed_requests.inc()
+            response = _rejection(
+                503,
+                "ServiceUnavailable",
+                "Сервер перегружен, повторите запрос позже",
+                {"Retry-After": str(load_shedder.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        released = False
+
+        async def send_wrapper(message):
+            nonlocal released
+            if (
+                message["type"] == "http.response.start"
+                and is_event_stream(message)
+                and not released
+            ):
+                released = True
+                load_shedder.release()
+            await send(message)
+
+        try:
+            kind = request_budget(scope["method"], scope["path"])
+            key = ""
+            if rate_limiter.limits(kind):
+                key = await client_keys.resolve(scope)
+            decision = rate_limiter.acquire(key, kind)
+            if not decision.allowed:
+                rate_limited.labels(kind).inc()
+                retry_after = max(1, math.ceil(decision.retry_after))
+                message = (
+                    f"Превышен лимит запросов, повторите через {retry_after} с"
+                )
+                response = _rejection(
+                    429,
+                    "TooManyRequests",
+                    message,
+                    {
+                        "Retry-After": str(retry_after),
+                        "X-RateLimit-Limit": str(decision.limit),
+                        "X-RateLimit-Remaining": str(decision.remaining),
+                    },
+                )
+                await response(scope, receive, send)
+                return
+
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not released:
+                load_shedder.release()
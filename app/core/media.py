@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, List
+
+import anyio
+from core import settings
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import Headers
+
+media_dir = "static/images"
+if not os.path.exists(media_dir):
+    os.makedirs(media_dir)
+
+MEDIA_CHUNK_SIZE = 64 * 1024
+# Запас на заголовки и границы multipart сверх MEDIA_MAX_SIZE
+MEDIA_FORM_OVERHEAD = 64 * 1024
+
+
+# Ошибка размера загрузки отдаётся с настоящим статусом 413 (см. main.py),
+# чтобы клиент не повторял тот же запрос
+class MediaTooLarge(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=413, detail="Файл слишком большой")
+
+
+def too_large_response() -> ORJSONResponse:
+    return ORJSONResponse(
+        {
+            "result": False,
+            "error_type": "HTTPException",
+            "error_message": "Файл слишком большой",
+        },
+        status_code=413,
+    )
+
+
+# ASGI-middleware для POST /api/medias: Starlette разбирает форму и
+# сохраняет файл во временный до вызова роута, поэтому размер тела
+# ограничивается здесь. Запрос с Content-Length больше предела
+# отклоняется сразу, а при чтении тела без него (chunked) разбор формы
+# прерывается, как только получено больше предела.
+class MediaSizeLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"].rstrip("/") != "/api/medias"
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        limit = settings.MEDIA_MAX_SIZE + MEDIA_FORM_OVERHEAD
+        length = Headers(scope=scope).get("content-length", "")
+        if length.isdigit() and int(length) > limit:
+            await too_large_response()(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise MediaTooLarge()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _extension(filename: str) -> str:
+    extension = os.path.splitext(filename or "")[1].lower()
+    if re.fullmatch(r"\.[a-z0-9]{1,10}", extension):
+        return extension
+    return ""
+
+
+# Блокировки файлов медиа: загрузка держит блокировку своего файла до
+# commit записи медиа, а удаление файла проверяет ссылки на него под той
+# же блокировкой, поэтому не удалит файл только что загруженного медиа.
+# Блокировки живут в памяти процесса: приложение и обработчик задач
+# работают в одном процессе uvicorn.
+_file_locks: Dict[str, List] = {}
+
+
+@asynccontextmanager
+async def file_lock(filename: str) -> AsyncIterator[None]:
+    # имя файла -> [блокировка, число владельцев и ожидающих]
+    entry = _file_locks.setdefault(filename, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _file_locks[filename]
+
+
+def _create_part() -> str:
+    fd, tmp_path = tempfile.mkstemp(dir=media_dir, suffix=".part")
+    os.close(fd)
+    return tmp_path
+
+
+def _place(tmp_path: str, path: str) -> None:
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+
+
+# Функция потоково сохраняет загруженный файл под именем sha256 от его
+# содержимого и отдаёт это имя, держа блокировку файла: запись медиа нужно
+# закоммитить внутри async with. Одинаковые файлы хранятся один раз.
+# Операции с файловой системой идут в отдельном потоке, как и запись.
+@asynccontextmanager
+async def save_upload(file: UploadFile) -> AsyncIterator[str]:
+    if file.size is not None and file.size > settings.MEDIA_MAX_SIZE:
+        raise MediaTooLarge()
+
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = await anyio.to_thread.run_sync(_create_part)
+
+    try:
+        async with await anyio.open_file(tmp_path, "wb") as image:
+            while chunk := await file.read(MEDIA_CHUNK_SIZE):
+                size += len(chunk)
+                if size > settings.MEDIA_MAX_SIZE:
+                    raise MediaTooLarge()
+                digest.update(chunk)
+                await image.write(chunk)
+
+    except BaseException:
+        # Временный файл удаляется и при отмене запроса
+        with anyio.CancelScope(shield=True):
+            await anyio.to_thread.run_sync(os.remove, tmp_path)
+        raise
+
+    filename = digest.hexdigest() + _extension(file.filename)
+    async with file_lock(filename):
+        path = os.path.join(media_dir, filename)
+        await anyio.to_thread.run_sync(_place, tmp_path, path)
+        yield filename
+
+
+# Функция удаляет файлы медиа в отдельном потоке
+async def remove_files(filenames: Iterable[str]) -> None:
+    def remove():
+        for filename in filenames:
+            try:
+                os.remove(os.path.join(media_dir, filename))
+            except FileNotFoundError:
+                pass
+
+    await anyio.to_thread.run_sync(remove)
@@ -0,0 +1,236 @@
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Метрики процесса в текстовом формате Prometheus (GET /metrics).
+# Значения хранятся в памяти процесса, при нескольких воркерах каждый
+# отдаёт свои.
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _sample(name: str, labels: str, value: str) -> str:
+    if labels:
+        return f"{name}{{{labels}}} {value}"
+    return f"{name} {value}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def samples(self, labels: str = "") -> List[str]:
+        return [_sample(self.name, labels, _format(self.value))]
+
+
+# Значение гауджа либо выставляется через set, либо вычисляется
+# функцией в момент сбора метрик
+class Gauge:
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        function: Optional[Callable[[], float]] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def get(self) -> float:
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+    def samples(self, labels: str = "") -> List[str]:
+        return [_sample(self.name, labels, _format(self.get()))]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+
+    def samples(self, labels: str = "") -> List[str]:
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+
+        prefix = labels + "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(
+                _sample(
+                    f"{self.name}_bucket",
+                    f'{prefix}le="{_format(bound)}"',
+                    str(cumulative),
+                )
+            )
+        lines.append(_sample(f"{self.name}_sum", labels, _format(total)))
+        lines.append(_sample(f"{self.name}_count", labels, str(count)))
+        return lines
+
+
+# Набор однотипных метрик с метками: labels(...) возвращает метрику для
+# конкретного сочетания значений меток
+class Family:
+    def __init__(
+        self,
+        metric_class,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        **options,
+    ):
+        self.kind = metric_class.kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._metric_class = metric_class
+        self._options = options
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._metric_class(
+                        self.name, self.documentation, **self._options
+                    )
+                    self._children[key] = child
+        return child
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, child in list(self._children.items()):
+            labels = ",".join(
+                f'{name}="{_escape(value)}"'
+                for name, value in zip(self.labelnames, key)
+            )
+            lines.extend(child.samples(labels))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    # Повторная регистрация под тем же именем возвращает уже созданную
+    # метрику, чтобы повторный импорт модуля не ломал сбор
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ):
+        if labelnames:
+            return self._register(
+                Family(Counter, name, documentation, labelnames)
+            )
+        return self._register(Counter(name, documentation))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        function: Optional[Callable[[], float]] = None,
+    ) -> Gauge:
+        gauge = self._register(Gauge(name, documentation, function))
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        labelnames: Sequence[str] = (),
+    ):
+        if labelnames:
+            return self._register(
+                Family(
+                    Histogram,
+                    name,
+                    documentation,
+                    labelnames,
+                    buckets=buckets,
+                )
+            )
+        return self._register(Histogram(name, documentation, buckets))
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
@@ -0,0 +1,193 @@
+import asyncio
+import secrets
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set
+
+import orjson
+from core import settings
+from core.metrics import registry
+
+published_events = registry.counter(
+    "stream_events_total", "Событий ленты, опубликованных в поток"
+)
+dropped_subscribers = registry.counter(
+    "stream_dropped_total", "Отключено подписчиков, не успевавших за потоком"
+)
+
+
+# Событие в буфере. Кадр собирается при первой доставке или досылке:
+# событие автора, на которого сейчас никто не подписан, не сериализуется,
+# пока его не запросят после переподключения. data - данные события или
+# функция без аргументов, которая их возвращает.
+class StreamEvent:
+    __slots__ = ("seq", "author_id", "event_id", "event", "data", "_frame")
+
+    def __init__(
+        self, seq: int, author_id: int, event_id: str, event: str, data: Any
+    ):
+        self.seq = seq
+        self.author_id = author_id
+        self.event_id = event_id
+        self.event = event
+        self.data = data
+        self._frame: Optional[bytes] = None
+
+    @property
+    def frame(self) -> bytes:
+        if self._frame is None:
+            data = self.data() if callable(self.data) else self.data
+            self._frame = b"id: %s\nevent: %s\ndata: %s\n\n" % (
+                self.event_id.encode(),
+                self.event.encode(),
+                orjson.dumps(data),
+            )
+            self.data = None
+        return self._frame
+
+
+class StreamFull(Exception):
+    pass
+
+
+# Подключённый клиент: события авторов authors копятся в его очереди
+# ограниченного размера, пока клиент их не заберёт
+class Subscriber:
+    def __init__(self, user_id: int, authors: Iterable[int], queue_size: int):
+        self.user_id = user_id
+        self.authors: Set[int] = set(authors)
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.closed = False
+
+
+# Хаб событий ленты в памяти процесса. Роуты публикуют события после
+# commit, хаб не больше одного раза сериализует событие в кадр
+# Server-Sent Events и раскладывает его только подписчикам автора твита:
+# подписчики проиндексированы по авторам, поэтому тысячи простаивающих
+# подключений не перебираются на каждое событие.
+#
+# Медленный клиент не задерживает остальных: если его очередь заполнена,
+# он отключается и переподключается с Last-Event-ID. Пропущенное он
+# получает из кольцевого буфера последних history_size событий, а если
+# буфер уже ушёл вперёд (или процесс перезапущен) - событие reset, после
+# которого ленту нужно перечитать целиком.
+class PubSubHub:
+    def __init__(
+        self, history_size: int, queue_size: int, max_subscribers: int
+    ):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.epoch = secrets.token_hex(4)
+        self._seq = 0
+        self._history: Deque[StreamEvent] = deque(maxlen=history_size)
+        self._by_author: Dict[int, Set[Subscriber]] = {}
+        self._by_user: Dict[int, Set[Subscriber]] = {}
+        self.subscribers = 0
+
+    @property
+    def last_event_id(self) -> str:
+        return f"{self.epoch}-{self._seq}"
+
+    @property
+    def full(self) -> bool:
+        return self.subscribers >= self.max_subscribers
+
+    def publish(self, event: str, author_id: int, data) -> None:
+        self._seq += 1
+        item = StreamEvent(
+            self._seq, author_id, self.last_event_id, event, data
+        )
+        self._history.append(item)
+        published_events.inc()
+
+        for subscriber in list(self._by_author.get(author_id, ())):
+            self._deliver(subscriber, item.frame)
+
+    def _deliver(self, subscriber: Subscriber, item) -> None:
+        try:
+            subscriber.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.unsubscribe(subscriber)
+            subscriber.closed = True
+            dropped_subscribers.inc()
+
+    # Подписывает клиента и возвращает его вместе с кадрами, пропущенными
+    # после last_event_id. Между выборкой из буфера и подпиской нет await,
+    # поэтому события не теряются и не дублируются. При max_subscribers
+    # подключений бросает StreamFull.
+    def subscribe(
+        self,
+        user_id: int,
+        authors: Iterable[int],
+        last_event_id: Optional[str] = None,
+    ):
+        if self.full:
+            raise StreamFull
+        subscriber = Subscriber(user_id, authors, self.queue_size)
+        backlog: List[bytes] = []
+        if last_event_id:
+            backlog = self._missed(subscriber, last_event_id)
+
+        for author_id in subscriber.authors:
+            self._by_author.setdefault(author_id, set()).add(subscriber)
+        self._by_user.setdefault(user_id, set()).add(subscriber)
+        self.subscribers += 1
+        return subscriber, backlog
+
+    def _missed(self, subscriber: Subscriber, last_event_id: str):
+        epoch, _, seq = last_event_id.partition("-")
+        oldest = self._history[0].seq if self._history else self._seq + 1
+        if epoch != self.epoch or not seq.isdigit() or int(seq) < oldest - 1:
+            return [
+                b"id: %s\nevent: reset\ndata: {}\n\n"
+                % self.last_event_id.encode()
+            ]
+        return [
+            event.frame
+            for event in self._history
+            if event.seq > int(seq) and event.author_id in subscriber.authors
+        ]
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscribers = self._by_user.get(subscriber.user_id)
+        if not subscribers or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._by_user[subscriber.user_id]
+        for author_id in subscriber.authors:
+            self._unindex(author_id, subscriber)
+        self.subscribers -= 1
+
+    def _unindex(self, author_id: int, subscriber: Subscriber) -> None:
+        subscribers = self._by_author.get(author_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._by_author[author_id]
+
+    # Подписки пользователя изменились: его подключения сразу начинают
+    # (или перестают) получать события автора
+    def follow(self, user_id: int, author_id: int) -> None:
+        for subscriber in self._by_user.get(user_id, ()):
+            subscriber.authors.add(author_id)
+            self._by_author.setdefault(author_id, set()).add(subscriber)
+
+    def unfollow(self, user_id: int, author_id: int) -> None:
+        if author_id == user_id:
+            return
+        for subscriber in self._by_user.get(user_id, ()):
+            subscriber.authors.discard(author_id)
+            self._unindex(author_id, subscriber)
+
+
+stream_hub = PubSubHub(
+    history_size=settings.STREAM_HISTORY_SIZE,
+    queue_size=settings.STREAM_QUEUE_SIZE,
+    max_subscribers=settings.STREAM_MAX_SUBSCRIBERS,
+)
+
+registry.gauge(
+    "stream_subscribers",
+    "Подключённых клиентов потока ленты",
+    lambda: stream_hub.subscribers,
+)
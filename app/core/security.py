@@ -0,0 +1,72 @@
+from typing import NamedTuple, Optional
+
+from core import settings
+from core.cache import LRUCache
+from db.database import get_db
+from db.models import User
+from fastapi import Depends, Header, HTTPException
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+# Минимальные сведения о вызывающем пользователе, которых хватает роутам
+class CurrentUser(NamedTuple):
+    id: int
+    username: str
+    followers_count: int = 0
+
+
+api_key_cache = LRUCache(
+    maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL
+)
+
+
+# Функция сбрасывает кэш для api-key (например, при его смене)
+def invalidate_api_key(api_key: str) -> None:
+    api_key_cache.pop(api_key)
+
+
+# Функция сбрасывает все закэшированные api-key пользователя
+def invalidate_user(user_id: int) -> None:
+    api_key_cache.pop_where(lambda user: user.id == user_id)
+
+
+# Функция ищет пользователя по api-key, в БД идёт только при промахе кэша
+async def lookup_user(db: AsyncSession, api_key: str) -> Optional[CurrentUser]:
+    user = api_key_cache.get(api_key)
+    if user is not None:
+        return user
+
+    result = await db.execute(
+        select(User.id, User.username, User.followers_count).where(
+            User.api_key == api_key
+        )
+    )
+    row = result.first()
+    if row is None:
+        return None
+
+    user = CurrentUser(
+        id=row.id, username=row.username, followers_count=row.followers_count
+    )
+    api_key_cache.set(api_key, user)
+    return user
+
+
+# Зависимость: пользователь по api-key
+async def get_current_user(
+    api_key: str = Header(), db: AsyncSession = Depends(get_db)
+) -> CurrentUser:
+    user = await lookup_user(db, api_key)
+    if user is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Sorry. Wrong api-key token. This user does not exist.",
+        )
+    return user
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_user(target.id)
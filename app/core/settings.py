@@ -8,3 +8,96 @@ DB_PASS: str = env.str("DB_PASS")
 DB_HOST: str = env.str("DB_HOST")
 DB_PORT: str = env.str("DB_PORT")
 DB_NAME: str = env.str("DB_NAME")
+
+TWEETS_PAGE_SIZE: int = env.int("TWEETS_PAGE_SIZE", 50)
+TWEETS_MAX_PAGE_SIZE: int = env.int("TWEETS_MAX_PAGE_SIZE", 200)
+
+# Авторы с таким числом подписчиков не рассылают твиты по лентам,
+# их твиты подмешиваются в ленту при чтении
+TIMELINE_FANOUT_LIMIT: int = env.int("TIMELINE_FANOUT_LIMIT", 10000)
+TIMELINE_BACKFILL_SIZE: int = env.int("TIMELINE_BACKFILL_SIZE", 50)
+
+AUTH_CACHE_SIZE: int = env.int("AUTH_CACHE_SIZE", 10000)
+AUTH_CACHE_TTL: float = env.float("AUTH_CACHE_TTL", 300)
+
+MEDIA_MAX_SIZE: int = env.int("MEDIA_MAX_SIZE", 10 * 1024 * 1024)
+
+# Отложенная пакетная запись счётчиков лайков (см. db/like_buffer.py)
+LIKE_BUFFER_ENABLED: bool = env.bool("LIKE_BUFFER_ENABLED", False)
+LIKE_BUFFER_FLUSH_INTERVAL: float = env.float("LIKE_BUFFER_FLUSH_INTERVAL", 1)
+LIKE_BUFFER_MAX_PENDING: int = env.int("LIKE_BUFFER_MAX_PENDING", 1000)
+
+TWEET_CACHE_SIZE: int = env.int("TWEET_CACHE_SIZE", 10000)
+TWEETS_BULK_MAX_SIZE: int = env.int("TWEETS_BULK_MAX_SIZE", 1000)
+
+# Пул соединений с БД; таймауты в секундах, 0 отключает таймаут запроса
+DB_POOL_SIZE: int = env.int("DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW: int = env.int("DB_MAX_OVERFLOW", 20)
+DB_POOL_TIMEOUT: float = env.float("DB_POOL_TIMEOUT", 30)
+DB_POOL_RECYCLE: int = env.int("DB_POOL_RECYCLE", 1800)
+DB_POOL_PRE_PING: bool = env.bool("DB_POOL_PRE_PING", True)
+DB_STATEMENT_TIMEOUT: float = env.float("DB_STATEMENT_TIMEOUT", 30)
+
+# Реплика для чтения (пустая строка - реплики нет) и время после записи,
+# в течение которого чтения пользователя идут в основную БД
+DB_REPLICA_URL: str = env.str("DB_REPLICA_URL", "")
+DB_READ_YOUR_WRITES_WINDOW: float = env.float("DB_READ_YOUR_WRITES_WINDOW", 5)
+
+# Запросы дольше этого (в секундах) пишутся в лог с разбивкой по запросам
+# к БД; 0 отключает лог
+SLOW_REQUEST_THRESHOLD: float = env.float("SLOW_REQUEST_THRESHOLD", 1)
+
+# Запись доли запросов к API в JSONL для replay (benchmarks/replay.py)
+CAPTURE_ENABLED: bool = env.bool("CAPTURE_ENABLED", False)
+CAPTURE_FILE: str = env.str("CAPTURE_FILE", "captures/requests.jsonl")
+CAPTURE_SAMPLE_RATE: float = env.float("CAPTURE_SAMPLE_RATE", 0.01)
+CAPTURE_MAX_BODY: int = env.int("CAPTURE_MAX_BODY", 64 * 1024)
+CAPTURE_FLUSH_INTERVAL: float = env.float("CAPTURE_FLUSH_INTERVAL", 1)
+CAPTURE_MAX_PENDING: int = env.int("CAPTURE_MAX_PENDING", 10000)
+
+# Рейтинг популярного (db/trending.py): твиты за последние TRENDING_WINDOW
+# секунд по числу лайков, которое убывает вдвое за TRENDING_HALF_LIFE
+# секунд возраста твита. В памяти держится TRENDING_CAPACITY лучших; раз в
+# TRENDING_REFRESH_INTERVAL секунд рейтинг пересчитывается по таблице likes
+TRENDING_WINDOW: float = env.float("TRENDING_WINDOW", 24 * 60 * 60)
+TRENDING_HALF_LIFE: float = env.float("TRENDING_HALF_LIFE", 6 * 60 * 60)
+TRENDING_CAPACITY: int = env.int("TRENDING_CAPACITY", 1000)
+TRENDING_REFRESH_INTERVAL: float = env.float("TRENDING_REFRESH_INTERVAL", 300)
+
+# Поток событий ленты /api/stream (core/pubsub.py): очередь на клиента,
+# буфер последних событий для переподключения, интервал пинга в секундах
+STREAM_QUEUE_SIZE: int = env.int("STREAM_QUEUE_SIZE", 100)
+STREAM_HISTORY_SIZE: int = env.int("STREAM_HISTORY_SIZE", 1000)
+STREAM_HEARTBEAT: float = env.float("STREAM_HEARTBEAT", 15)
+STREAM_MAX_SUBSCRIBERS: int = env.int("STREAM_MAX_SUBSCRIBERS", 10000)
+
+# Отложенные задачи (db/jobs.py): число одновременно выполняемых задач,
+# опрос очереди и повторы с экспоненциальной задержкой (в секундах).
+# Рассылка твита подписчикам уходит в задачу, если их больше
+# JOBS_FANOUT_INLINE_LIMIT.
+JOBS_CONCURRENCY: int = env.int("JOBS_CONCURRENCY", 4)
+JOBS_POLL_INTERVAL: float = env.float("JOBS_POLL_INTERVAL", 1)
+JOBS_MAX_ATTEMPTS: int = env.int("JOBS_MAX_ATTEMPTS", 5)
+JOBS_RETRY_DELAY: float = env.float("JOBS_RETRY_DELAY", 2)
+JOBS_RETRY_MAX_DELAY: float = env.float("JOBS_RETRY_MAX_DELAY", 600)
+JOBS_LEASE: float = env.float("JOBS_LEASE", 300)
+JOBS_FANOUT_INLINE_LIMIT: int = env.int("JOBS_FANOUT_INLINE_LIMIT", 1000)
+
+# Ограничение частоты запросов к /api по api-key (core/limits.py): на
+# каждый вид запросов - запросов в секунду и запас для всплеска
+RATE_LIMIT_ENABLED: bool = env.bool("RATE_LIMIT_ENABLED", True)
+RATE_LIMIT_READ_RATE: float = env.float("RATE_LIMIT_READ_RATE", 20)
+RATE_LIMIT_READ_BURST: int = env.int("RATE_LIMIT_READ_BURST", 100)
+RATE_LIMIT_WRITE_RATE: float = env.float("RATE_LIMIT_WRITE_RATE", 5)
+RATE_LIMIT_WRITE_BURST: int = env.int("RATE_LIMIT_WRITE_BURST", 50)
+RATE_LIMIT_UPLOAD_RATE: float = env.float("RATE_LIMIT_UPLOAD_RATE", 1)
+RATE_LIMIT_UPLOAD_BURST: int = env.int("RATE_LIMIT_UPLOAD_BURST", 10)
+RATE_LIMIT_MAX_KEYS: int = env.int("RATE_LIMIT_MAX_KEYS", 100000)
+
+# Сброс нагрузки: больше SHED_MAX_CONCURRENCY запросов одновременно не
+# обрабатывается, а если среднее ожидание соединения из пула дольше
+# SHED_POOL_WAIT секунд - больше SHED_MIN_CONCURRENCY. 0 отключает предел.
+SHED_MAX_CONCURRENCY: int = env.int("SHED_MAX_CONCURRENCY", 500)
+SHED_MIN_CONCURRENCY: int = env.int("SHED_MIN_CONCURRENCY", DB_POOL_SIZE)
+SHED_POOL_WAIT: float = env.float("SHED_POOL_WAIT", 0.5)
+SHED_RETRY_AFTER: int = env.int("SHED_RETRY_AFTER", 1)
@@ -0,0 +1,52 @@
+import secrets
+import time
+from typing import Dict
+
+from fastapi import Request
+
+# Версии ресурсов для ETag живут в памяти процесса. Случайный префикс
+# процесса не даёт ETag, выданному до перезапуска, совпасть с новым.
+# Счётчики не разделяются между воркерами: приложение запускается
+# одним процессом uvicorn.
+_instance = secrets.token_hex(4)
+
+
+class ResourceVersions:
+    def __init__(self):
+        self.feed = 0
+        self.changed_at = float("-inf")
+        self._users: Dict[int, int] = {}
+
+    # Любое изменение твитов или лайков
+    def bump_feed(self) -> None:
+        self.feed += 1
+        self.changed_at = time.monotonic()
+
+    # Изменение подписок пользователя (в любую сторону)
+    def bump_user(self, user_id: int) -> None:
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+        self.changed_at = time.monotonic()
+
+    def user(self, user_id: int) -> int:
+        return self._users.get(user_id, 0)
+
+    # Были ли изменения за последние seconds секунд
+    def changed_within(self, seconds: float) -> bool:
+        return time.monotonic() - self.changed_at < seconds
+
+
+versions = ResourceVersions()
+
+
+def make_etag(*parts) -> str:
+    return 'W/"{}"'.format("-".join(str(part) for part in (_instance, *parts)))
+
+
+# Функция проверяет заголовок If-None-Match запроса
+def not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (tag.strip() for tag in header.split(","))
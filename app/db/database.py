@@ -1,6 +1,13 @@
+from typing import Optional
+
 from core import settings
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from core.cache import LRUCache
+from db.pool import InstrumentedPool, register_pool_metrics
+from fastapi import Header
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base
 
 DB_USER = settings.DB_USER
 DB_PASS = settings.DB_PASS
@@ -8,19 +15,89 @@ DB_HOST = settings.DB_HOST
 DB_PORT = settings.DB_PORT
 DB_NAME = settings.DB_NAME
 DATABASE_URL = (
-    f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+)
+
+
+# Функция создаёт движок с пулом и таймаутами из настроек;
+# options переопределяют значения настроек
+def make_engine(url: str, **options):
+    engine_options = {
+        "poolclass": InstrumentedPool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    # Таймаут запроса выставляется на стороне PostgreSQL для каждого
+    # соединения, в SQLite аналога нет
+    if url.startswith("postgresql") and settings.DB_STATEMENT_TIMEOUT:
+        timeout_ms = int(settings.DB_STATEMENT_TIMEOUT * 1000)
+        engine_options["connect_args"] = {
+            "server_settings": {"statement_timeout": str(timeout_ms)}
+        }
+    engine_options.update(options)
+    return create_async_engine(url, **engine_options)
+
+
+engine = make_engine(DATABASE_URL)
+register_pool_metrics(engine.pool)
+
+# expire_on_commit=False: после commit атрибуты не перечитываются лениво,
+# что в асинхронной сессии привело бы к неявному запросу
+session = async_sessionmaker(
+    bind=engine, autoflush=False, expire_on_commit=False
 )
 
-engine = create_engine(DATABASE_URL)
+# Необязательная реплика для читающих роутов (см. get_read_db)
+replica_session = None
+if settings.DB_REPLICA_URL:
+    replica_engine = make_engine(settings.DB_REPLICA_URL)
+    replica_session = async_sessionmaker(
+        bind=replica_engine, autoflush=False, expire_on_commit=False
+    )
 
-session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# api-key пользователей, недавно записавших в основную БД: их чтения
+# какое-то время идут в основную БД, чтобы они видели свои изменения
+recent_writers = LRUCache(
+    maxsize=settings.AUTH_CACHE_SIZE,
+    ttl=settings.DB_READ_YOUR_WRITES_WINDOW,
+)
 
 Base = declarative_base()
 
 
-def get_db():
-    db = session()
-    try:
+# Сессия основной БД для роутов, которые пишут
+async def get_db(api_key: Optional[str] = Header(default=None)):
+    async with session() as db:
+        db.info["writer"] = api_key
         yield db
-    finally:
-        db.close()
+
+
+# Сессия для читающих роутов: реплика, если она настроена и пользователь
+# недавно ничего не записывал, иначе основная БД
+async def get_read_db(api_key: Optional[str] = Header(default=None)):
+    factory = session
+    if replica_session is not None and (
+        api_key is None or recent_writers.get(api_key) is None
+    ):
+        factory = replica_session
+
+    async with factory() as db:
+        db.info["replica"] = factory is not session
+        yield db
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_writer(db_session, *args):
+    writer = db_session.info.get("writer")
+    if writer is not None:
+        recent_writers.set(writer, True)
+
+
+# INSERT с поддержкой ON CONFLICT для диалекта, к которому привязана сессия
+def dialect_insert(db, table):
+    if db.bind.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
@@ -0,0 +1,82 @@
+from typing import List, Optional
+
+from db.database import dialect_insert
+from db.models import Follow, User
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+follows_table = Follow.__table__
+
+
+# Возвращает новое число подписчиков
+async def _change_followers_count(
+    db: AsyncSession, user_id: int, delta: int
+) -> int:
+    return await db.scalar(
+        update(User)
+        .where(User.id == user_id)
+        .values(followers_count=User.followers_count + delta)
+        .returning(User.followers_count)
+    )
+
+
+# Функция подписки одним INSERT ... ON CONFLICT DO NOTHING.
+# Возвращает False, если подписка уже была.
+async def follow(db: AsyncSession, follower_id: int, followee_id: int) -> bool:
+    result = await db.execute(
+        dialect_insert(db, follows_table)
+        .values(follower_id=follower_id, followee_id=followee_id)
+        .on_conflict_do_nothing(index_elements=["follower_id", "followee_id"])
+    )
+    if result.rowcount == 0:
+        return False
+
+    await _change_followers_count(db, followee_id, 1)
+    return True
+
+
+# Функция отписки одним DELETE ... RETURNING. Возвращает оставшееся
+# число подписчиков автора или None, если подписки не было.
+async def unfollow(
+    db: AsyncSession, follower_id: int, followee_id: int
+) -> Optional[int]:
+    result = await db.execute(
+        delete(follows_table)
+        .where(
+            follows_table.c.follower_id == follower_id,
+            follows_table.c.followee_id == followee_id,
+        )
+        .returning(follows_table.c.follower_id)
+    )
+    if result.first() is None:
+        return None
+
+    return await _change_followers_count(db, followee_id, -1)
+
+
+# Подписчики пользователя: (id, username)
+async def get_followers(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(User.id, User.username)
+        .join(Follow, Follow.follower_id == User.id)
+        .where(Follow.followee_id == user_id)
+    )
+    return result.all()
+
+
+# Пользователи, на которых подписан пользователь: (id, username)
+async def get_following(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(User.id, User.username)
+        .join(Follow, Follow.followee_id == User.id)
+        .where(Follow.follower_id == user_id)
+    )
+    return result.all()
+
+
+# id пользователей, на которых подписан пользователь
+async def get_following_ids(db: AsyncSession, user_id: int) -> List[int]:
+    result = await db.scalars(
+        select(Follow.followee_id).where(Follow.follower_id == user_id)
+    )
+    return list(result)
@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from core import settings
+from core.metrics import registry
+from db.database import session
+from db.models import Job, utcnow
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+jobs_table = Job.__table__
+
+PENDING = "pending"
+FAILED = "failed"
+
+Handler = Callable[[AsyncSession, dict], Awaitable[None]]
+
+job_lag = registry.histogram(
+    "job_lag_seconds",
+    "Задержка начала задачи относительно назначенного времени",
+    labelnames=("kind",),
+)
+job_duration = registry.histogram(
+    "job_duration_seconds", "Время выполнения задачи", labelnames=("kind",)
+)
+jobs_completed = registry.counter(
+    "jobs_completed_total", "Выполнено задач", labelnames=("kind",)
+)
+jobs_failed = registry.counter(
+    "jobs_failed_total", "Неудачных попыток выполнения", labelnames=("kind",)
+)
+jobs_dead = registry.counter(
+    "jobs_dead_total", "Задач, исчерпавших попытки", labelnames=("kind",)
+)
+
+
+# Выполнение отложенных задач из таблицы jobs. Роут ставит задачу в своей
+# транзакции (enqueue), поэтому она появляется в очереди только вместе с
+# изменениями, которые её породили, и переживает перезапуск.
+#
+# Фоновая задача забирает готовые к выполнению строки, выставляя им
+# аренду locked_until (на PostgreSQL с FOR UPDATE SKIP LOCKED, чтобы
+# воркеры не брали одну задачу), и выполняет не больше concurrency задач
+# одновременно. Обработчик работает в отдельной сессии, и строка задачи
+# удаляется в той же транзакции, что и результат его работы. При ошибке
+# задача откладывается на retry_delay * 2 ** (попытка - 1) секунд, после
+# max_attempts попыток остаётся со статусом failed. Задачу, воркер
+# которой упал, подберут после истечения аренды.
+class JobRunner:
+    def __init__(
+        self,
+        session_factory,
+        concurrency: int,
+        poll_interval: float,
+        max_attempts: int,
+        retry_delay: float,
+        retry_max_delay: float,
+        lease: float,
+    ):
+        self.session_factory = session_factory
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.lease = lease
+        self.handlers: Dict[str, Handler] = {}
+        self._done_listeners: Dict[str, List[Callable[[dict], None]]] = {}
+        self._running: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    # Декоратор регистрирует обработчик задач типа kind
+    def handler(self, kind: str) -> Callable[[Handler], Handler]:
+        def register(function: Handler) -> Handler:
+            self.handlers[kind] = function
+            return function
+
+        return register
+
+    # Слушатель вызывается после commit выполненной задачи типа kind
+    def add_done_listener(
+        self, kind: str, listener: Callable[[dict], None]
+    ) -> None:
+        self._done_listeners.setdefault(kind, []).append(listener)
+
+    # Функция ставит задачу в транзакции db; после commit роуту стоит
+    # вызвать wake(), чтобы задача не ждала следующего опроса
+    async def enqueue(
+        self, db: AsyncSession, kind: str, payload: dict, delay: float = 0
+    ) -> None:
+        if kind not in self.handlers:
+            raise ValueError(f"Нет обработчика задач {kind}")
+        now = utcnow()
+        await db.execute(
+            insert(jobs_table).values(
+                kind=kind,
+                payload=payload,
+                status=PENDING,
+                attempts=0,
+                run_at=now + timedelta(seconds=delay),
+                created_at=now,
+            )
+        )
+
+    def wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _claim(self, limit: int):
+        now = utcnow()
+        due = (
+            select(jobs_table.c.id)
+            .where(
+                jobs_table.c.status == PENDING,
+                jobs_table.c.run_at <= now,
+                or_(
+                    jobs_table.c.locked_until.is_(None),
+                    jobs_table.c.locked_until < now,
+                ),
+            )
+            .order_by(jobs_table.c.run_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(jobs_table)
+                .where(jobs_table.c.id.in_(due.scalar_subquery()))
+                .values(
+                    locked_until=now + timedelta(seconds=self.lease),
+                    attempts=jobs_table.c.attempts + 1,
+                )
+                .returning(
+                    jobs_table.c.id,
+                    jobs_table.c.kind,
+                    jobs_table.c.payload,
+                    jobs_table.c.attempts,
+                    jobs_table.c.run_at,
+                )
+            )
+            jobs = result.all()
+            await db.commit()
+        return jobs
+
+    async def _execute(self, job) -> None:
+        job_lag.labels(job.kind).observe(
+            max(0.0, (utcnow() - job.run_at).total_seconds())
+        )
+        start = time.perf_counter()
+        try:
+            handler = self.handlers.get(job.kind)
+            if handler is None:
+                raise LookupError(f"Нет обработчика задач {job.kind}")
+            async with self.session_factory() as db:
+                await handler(db, job.payload)
+                await db.execute(
+                    delete(jobs_table).where(jobs_table.c.id == job.id)
+                )
+                await db.commit()
+        except Exception as exc:
+            jobs_failed.labels(job.kind).inc()
+            logger.exception(
+                "Задача %s (%s) не выполнена, попытка %s",
+                job.id,
+                job.kind,
+                job.attempts,
+            )
+            await self._retry(job, exc)
+        else:
+            jobs_completed.labels(job.kind).inc()
+            for listener in self._done_listeners.get(job.kind, ()):
+                listener(job.payload)
+        finally:
+            job_duration.labels(job.kind).observe(time.perf_counter() - start)
+
+    async def _retry(self, job, exc: Exception) -> None:
+        dead = job.attempts >= self.max_attempts
+        delay = min(
+            self.retry_delay * 2 ** (job.attempts - 1), self.retry_max_delay
+        )
+        if dead:
+            jobs_dead.labels(job.kind).inc()
+        try:
+            async with self.session_factory() as db:
+                await db.execute(
+                    update(jobs_table)
+                    .where(jobs_table.c.id == job.id)
+                    .values(
+                        status=FAILED if dead else PENDING,
+                        run_at=utcnow() + timedelta(seconds=delay),
+                        locked_until=None,
+                        last_error=repr(exc)[:1000],
+                    )
+                )
+                await db.commit()
+        except Exception:
+            # Задачу повторят после истечения аренды
+            logger.exception("Не удалось отложить задачу %s", job.id)
+
+    # Выполняет все задачи, которым уже пора, и возвращает их число. Без
+    # фоновой задачи: для тестов и разовых запусков.
+    async def run_pending(self) -> int:
+        done = 0
+        while True:
+            jobs = await self._claim(self.concurrency)
+            if not jobs:
+                return done
+            await asyncio.gather(*(self._execute(job) for job in jobs))
+            done += len(jobs)
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self._running.discard(task)
+        self.wake()
+
+    async def _run(self) -> None:
+        while True:
+            free = self.concurrency - len(self._running)
+            jobs: List = []
+            if free > 0:
+                try:
+                    jobs = await self._claim(free)
+                except Exception:
+                    logger.exception("Не удалось получить задачи")
+            for job in jobs:
+                task = asyncio.create_task(self._execute(job))
+                self._running.add(task)
+                task.add_done_callback(self._finished)
+
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=self.poll_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    # Останавливает приём задач и дожидается уже начатых
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+
+job_runner = JobRunner(
+    session_factory=session,
+    concurrency=settings.JOBS_CONCURRENCY,
+    poll_interval=settings.JOBS_POLL_INTERVAL,
+    max_attempts=settings.JOBS_MAX_ATTEMPTS,
+    retry_delay=settings.JOBS_RETRY_DELAY,
+    retry_max_delay=settings.JOBS_RETRY_MAX_DELAY,
+    lease=settings.JOBS_LEASE,
+)
+
+registry.gauge(
+    "jobs_running", "Выполняемых сейчас задач", lambda: job_runner.running
+)
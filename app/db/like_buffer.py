@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from core import settings
+from db.database import session
+from db.models import Tweet
+from sqlalchemy import bindparam, update
+
+logger = logging.getLogger(__name__)
+
+tweets_table = Tweet.__table__
+
+
+# Буфер отложенной записи счётчиков лайков. Лайки и снятия лайков копят
+# дельты по твитам в памяти, а фоновая задача раз в flush_interval секунд
+# (или при накоплении max_pending твитов) записывает их одним пакетным
+# UPDATE. Так горячий твит не превращает строку tweets в точку конкуренции.
+class LikeCounterBuffer:
+    def __init__(
+        self,
+        session_factory,
+        enabled: bool,
+        flush_interval: float,
+        max_pending: int,
+    ):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.last_flush_size = 0
+        self._pending: Dict[int, int] = {}
+        self._flushing: Dict[int, int] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_listeners: List[Callable[[Iterable[int]], None]] = []
+
+    # Слушатель получает id твитов, счётчики которых только что записаны
+    def add_flush_listener(
+        self, listener: Callable[[Iterable[int]], None]
+    ) -> None:
+        self._flush_listeners.append(listener)
+
+    # Число твитов, дельты которых ещё не записаны в БД
+    @property
+    def backlog(self) -> int:
+        return len(self._pending) + len(self._flushing)
+
+    def add(self, tweet_id: int, delta: int) -> None:
+        if not self.enabled:
+            return
+
+        count = self._pending.get(tweet_id, 0) + delta
+        if count:
+            self._pending[tweet_id] = count
+        else:
+            self._pending.pop(tweet_id, None)
+
+        if len(self._pending) >= self.max_pending and self._wakeup:
+            self._wakeup.set()
+
+    # Незаписанная дельта твита, которую нужно прибавить к count_likes
+    def pending(self, tweet_id: int) -> int:
+        return self._pending.get(tweet_id, 0) + self._flushing.get(tweet_id, 0)
+
+    async def flush(self) -> None:
+        if not self._pending or self._flushing:
+            return
+
+        self._flushing, self._pending = self._pending, {}
+        started = time.perf_counter()
+        try:
+            async with self.session_factory() as db:
+                await db.execute(
+                    update(tweets_table)
+                    .where(tweets_table.c.id == bindparam("b_id"))
+                    .values(
+                        count_likes=tweets_table.c.count_likes
+                        + bindparam("b_delta")
+                    ),
+                    [
+                        {"b_id": tweet_id, "b_delta": delta}
+                        for tweet_id, delta in self._flushing.items()
+                    ],
+                )
+                await db.commit()
+        except BaseException:
+            # Возвращаем дельты в буфер, чтобы записать их в следующий раз
+            for tweet_id, delta in self._flushing.items():
+                self._pending[tweet_id] = (
+                    self._pending.get(tweet_id, 0) + delta
+                )
+            raise
+        finally:
+            flushed = list(self._flushing)
+            self._flushing = {}
+
+        self.flushes += 1
+        self.last_flush_size = len(flushed)
+        self.last_flush_seconds = time.perf_counter() - started
+        for listener in self._flush_listeners:
+            listener(flushed)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Не удалось записать счётчики лайков")
+
+    async def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    # Останавливает фоновую задачу и записывает всё, что осталось в буфере
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+
+
+like_buffer = LikeCounterBuffer(
+    session_factory=session,
+    enabled=settings.LIKE_BUFFER_ENABLED,
+    flush_interval=settings.LIKE_BUFFER_FLUSH_INTERVAL,
+    max_pending=settings.LIKE_BUFFER_MAX_PENDING,
+)
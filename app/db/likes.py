@@ -0,0 +1,90 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from db.database import dialect_insert
+from db.like_buffer import like_buffer
+from db.models import Like, Tweet
+from sqlalchemy import delete, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+likes_table = Like.__table__
+
+
+# Лайки твита после изменения, его автор и время создания: для рейтинга
+# популярного и потока событий ленты
+class LikeChange(NamedTuple):
+    count_likes: int
+    author_id: int
+    created_at: datetime
+
+
+# Счётчик, автора и время создания возвращает тот же UPDATE ... RETURNING.
+# В режиме буфера счётчик обновляет like_buffer после commit (см. роуты):
+# вместо UPDATE выполняется SELECT твита по первичному ключу, который не
+# блокирует строку, а счётчик досчитывается из незаписанных дельт.
+# RETURNING из INSERT/DELETE лайка не может вернуть столбцы tweets без
+# изменяющего CTE, которого нет в SQLite.
+async def _change_count(
+    db: AsyncSession, tweet_id: int, delta: int
+) -> LikeChange:
+    if like_buffer.enabled:
+        row = (
+            await db.execute(
+                select(
+                    Tweet.count_likes, Tweet.user_id, Tweet.created_at
+                ).where(Tweet.id == tweet_id)
+            )
+        ).one()
+        return LikeChange(
+            row.count_likes + like_buffer.pending(tweet_id) + delta,
+            row.user_id,
+            row.created_at,
+        )
+
+    row = (
+        await db.execute(
+            update(Tweet)
+            .where(Tweet.id == tweet_id)
+            .values(count_likes=Tweet.count_likes + delta)
+            .returning(Tweet.count_likes, Tweet.user_id, Tweet.created_at)
+        )
+    ).one()
+    return LikeChange(*row)
+
+
+# Функция ставит лайк одним INSERT ... ON CONFLICT DO NOTHING и увеличивает
+# счётчик на стороне БД. Возвращает None, если лайк уже был или твита нет.
+async def add_like(
+    db: AsyncSession, user_id: int, tweet_id: int
+) -> Optional[LikeChange]:
+    result = await db.execute(
+        dialect_insert(db, likes_table)
+        .from_select(
+            ["user_id", "tweet_id"],
+            select(literal(user_id), Tweet.id).where(Tweet.id == tweet_id),
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "tweet_id"])
+    )
+    if result.rowcount == 0:
+        return None
+
+    return await _change_count(db, tweet_id, 1)
+
+
+# Функция снимает лайк одним DELETE ... RETURNING и уменьшает счётчик.
+# Возвращает None, если лайка не было.
+async def remove_like(
+    db: AsyncSession, user_id: int, tweet_id: int
+) -> Optional[LikeChange]:
+    result = await db.execute(
+        delete(likes_table)
+        .where(
+            likes_table.c.user_id == user_id,
+            likes_table.c.tweet_id == tweet_id,
+        )
+        .returning(likes_table.c.id)
+    )
+    if result.first() is None:
+        return None
+
+    return await _change_count(db, tweet_id, -1)
@@ -1,18 +1,37 @@
 import secrets
+from datetime import datetime, timezone
 
 from db.database import Base
-from fastapi import HTTPException
-from sqlalchemy import Column, ForeignKey, Integer, String
-from sqlalchemy.orm import Session, relationship
+from sqlalchemy import (
+    JSON,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+)
+from sqlalchemy.orm import relationship
+
+
+# Текущее время в UTC без часового пояса, как оно хранится в БД
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 class Tweet(Base):
     __tablename__ = "tweets"
+    __table_args__ = (
+        Index("ix_tweets_user_id_id", "user_id", "id"),
+        Index("ix_tweets_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True)
     text = Column(String, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"))
     count_likes = Column(Integer, default=0)
+    # Время создания в UTC задаёт приложение, а не часовой пояс сервера БД
+    created_at = Column(DateTime, nullable=False, default=utcnow)
 
     author = relationship("User", back_populates="tweets")
     media = relationship("Media", back_populates="tweet")
@@ -26,9 +45,13 @@ class Tweet(Base):
 
 class Like(Base):
     __tablename__ = "likes"
+    __table_args__ = (
+        Index("uq_likes_user_tweet", "user_id", "tweet_id", unique=True),
+    )
+
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    tweet_id = Column(Integer, ForeignKey("tweets.id"))
+    tweet_id = Column(Integer, ForeignKey("tweets.id"), index=True)
 
     user = relationship("User", back_populates="likes")
     tweet = relationship("Tweet", back_populates="likes")
@@ -38,50 +61,59 @@ class Media(Base):
     __tablename__ = "media"
 
     id = Column(Integer, primary_key=True)
-    image_url = Column(String)
-    tweet_id = Column(Integer, ForeignKey("tweets.id"))
-    user_id = Column(Integer, ForeignKey("users.id"))
+    image_url = Column(String, index=True)
+    tweet_id = Column(Integer, ForeignKey("tweets.id"), index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
 
     user = relationship("User", back_populates="user_media")
     tweet = relationship("Tweet", back_populates="media")
 
 
-class Subscribers(Base):
-    __tablename__ = "subscribers"
+# Ребро подписки: follower подписан на followee. Первичный ключ покрывает
+# "на кого подписан", индекс followee_id + follower_id - "кто подписан".
+class Follow(Base):
+    __tablename__ = "follows"
+    __table_args__ = (
+        Index("ix_follows_followee_follower", "followee_id", "follower_id"),
+    )
 
-    id = Column(Integer, primary_key=True)
-    subscribers_id = Column(Integer, ForeignKey("users.id"))
-    subscriber_id = Column(Integer, ForeignKey("users.id"))
+    follower_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    followee_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
 
-    user = relationship(
-        "User", back_populates="subscribers", foreign_keys=[subscribers_id]
-    )
-    subscribed_user = relationship("User", foreign_keys=[subscriber_id])
+    follower = relationship("User", foreign_keys=[follower_id])
+    followee = relationship("User", foreign_keys=[followee_id])
 
     def __repr__(self):
-        return "Подписчик {} подписан на пользователя {}".format(
-            self.user.username,
-            self.subscribed_user.username,
+        return "Пользователь {} подписан на пользователя {}".format(
+            self.follower_id,
+            self.followee_id,
         )
 
 
-class Subscriptions(Base):
-    __tablename__ = "subscriptions"
+class TimelineEntry(Base):
+    __tablename__ = "timelines"
 
-    id = Column(Integer, primary_key=True)
-    subscriptions_id = Column(Integer, ForeignKey("users.id"))
-    subscriber_id = Column(Integer, ForeignKey("users.id"))
-
-    user = relationship(
-        "User", back_populates="subscriptions", foreign_keys=[subscriptions_id]
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    tweet_id = Column(
+        Integer, ForeignKey("tweets.id"), primary_key=True, index=True
     )
-    subscriber = relationship("User", foreign_keys=[subscriber_id])
 
-    def __repr__(self):
-        return "Пользователь {} подписан на пользователя {}".format(
-            self.user.username,
-            self.subscriber.username,
-        )
+
+# Отложенная задача (db/jobs.py). Выполненная задача удаляется вместе с
+# результатом своей работы; исчерпавшая попытки остаётся со статусом failed.
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_status_run_at", "status", "run_at"),)
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String(10), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    run_at = Column(DateTime, nullable=False, default=utcnow)
+    locked_until = Column(DateTime)
+    last_error = Column(String)
+    created_at = Column(DateTime, nullable=False, default=utcnow)
 
 
 class User(Base):
@@ -90,34 +122,11 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     username = Column(String(50), nullable=False)
     api_key = Column(String, default=secrets.token_urlsafe(32), unique=True)
+    followers_count = Column(Integer, default=0, nullable=False)
 
     tweets = relationship("Tweet", back_populates="author")
     likes = relationship("Like", back_populates="user")
-    subscribers = relationship(
-        "Subscribers",
-        back_populates="user",
-        foreign_keys=[Subscribers.subscribers_id],
-    )
-    subscriptions = relationship(
-        "Subscriptions",
-        back_populates="user",
-        foreign_keys=[Subscriptions.subscriptions_id],
-    )
     user_media = relationship("Media", back_populates="user")
 
     def __repr__(self):
         return f"Пользователь {self.username}"
-
-    @classmethod
-    def get_user_api_key(cls, db: Session, api_key: str):
-        return db.query(cls).filter(cls.api_key == api_key).first()
-
-    @classmethod
-    def validate_api_key(cls, db: Session, api_key: str):
-        user = cls.get_user_api_key(db, api_key)
-        if not user:
-            raise HTTPException(
-                status_code=401,
-                detail="Sorry. Wrong api-key token. This user does not exist.",
-            )
-        return user
@@ -0,0 +1,93 @@
+import time
+
+from core.metrics import registry
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool
+
+pool_checkouts = registry.counter(
+    "db_pool_checkouts_total", "Выдано соединений из пула"
+)
+pool_connects = registry.counter(
+    "db_pool_connections_created_total", "Открыто новых соединений с БД"
+)
+pool_invalidations = registry.counter(
+    "db_pool_invalidations_total",
+    "Соединений признано негодными (pre-ping, обрыв)",
+)
+pool_timeouts = registry.counter(
+    "db_pool_timeouts_total", "Ожиданий соединения, завершившихся таймаутом"
+)
+pool_wait_seconds = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Время ожидания соединения из пула"
+)
+
+
+# Скользящее среднее времени ожидания соединения из пула: по нему
+# core/limits.py отсекает нагрузку, пока пул не успевает
+class RecentWait:
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.seconds = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.seconds += self.weight * (seconds - self.seconds)
+
+
+recent_pool_wait = RecentWait(weight=0.2)
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_checkouts.inc()
+
+
+def _on_connect(dbapi_connection, connection_record):
+    pool_connects.inc()
+
+
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_invalidations.inc()
+
+
+# Пул соединений, который считает выдачи, новые и негодные соединения и
+# замеряет время ожидания свободного соединения
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        event.listen(self, "checkout", _on_checkout)
+        event.listen(self, "connect", _on_connect)
+        event.listen(self, "invalidate", _on_invalidate)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_timeouts.inc()
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            pool_wait_seconds.observe(seconds)
+            recent_pool_wait.observe(seconds)
+
+
+# Функция регистрирует гауджи текущего состояния пула: они считаются
+# в момент сбора метрик
+def register_pool_metrics(pool: Pool) -> None:
+    registry.gauge(
+        "db_pool_size", "Размер пула соединений", lambda: pool.size()
+    )
+    registry.gauge(
+        "db_pool_checked_out",
+        "Соединений выдано и не возвращено",
+        lambda: pool.checkedout(),
+    )
+    registry.gauge(
+        "db_pool_checked_in",
+        "Свободных соединений в пуле",
+        lambda: pool.checkedin(),
+    )
+    registry.gauge(
+        "db_pool_overflow",
+        "Соединений сверх pool_size",
+        lambda: max(pool.overflow(), 0),
+    )
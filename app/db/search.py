@@ -0,0 +1,103 @@
+from typing import List, Optional, Tuple
+
+from db.models import Tweet
+from sqlalchemy import (
+    Float,
+    Integer,
+    and_,
+    func,
+    literal_column,
+    or_,
+    select,
+    text,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Полнотекстовый поиск по Tweet.text. На PostgreSQL - GIN-индекс по
+# to_tsvector('simple', text), на SQLite - FTS5-таблица tweets_fts,
+# которую поддерживают триггеры (миграция 0002). Так стоимость поиска
+# зависит от числа совпадений, а не от размера таблицы.
+
+SEARCH_TABLE = "tweets_fts"
+SEARCH_INDEX = "ix_tweets_text_search"
+
+# Выражение должно совпадать с выражением индекса SEARCH_INDEX
+_ts_config = literal_column("'simple'::regconfig")
+
+
+# Объекты поиска создаются миграцией и не описаны в моделях, поэтому
+# autogenerate и сравнение схемы с моделями их пропускают
+def include_name(name, type_, parent_names) -> bool:
+    if type_ == "table":
+        return not name.startswith(SEARCH_TABLE)
+    if type_ == "index":
+        return name != SEARCH_INDEX
+    return True
+
+
+def _match_terms(query: str) -> List[str]:
+    return [term for term in query.split() if term]
+
+
+def _postgres_matches(query: str):
+    vector = func.to_tsvector(_ts_config, Tweet.text)
+    tsquery = func.plainto_tsquery(_ts_config, query)
+    return (
+        select(
+            Tweet.id.label("id"),
+            func.ts_rank(vector, tsquery).label("score"),
+        )
+        .where(vector.op("@@")(tsquery))
+        .subquery()
+    )
+
+
+def _sqlite_matches(query: str):
+    # Каждое слово в кавычках: спецсимволы FTS5 в запросе не работают
+    # как операторы, слова объединяются через AND
+    fts_query = " ".join(
+        '"{}"'.format(term.replace('"', '""')) for term in _match_terms(query)
+    )
+    # bm25 тем меньше, чем лучше совпадение
+    return (
+        text(
+            f"SELECT rowid AS id, -bm25({SEARCH_TABLE}) AS score "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :query"
+        )
+        .bindparams(query=fts_query)
+        .columns(id=Integer, score=Float)
+        .subquery()
+    )
+
+
+# Функция возвращает (id, score) найденных твитов по убыванию
+# релевантности; after - (score, id) последнего твита предыдущей страницы
+async def search_tweet_ids(
+    db: AsyncSession,
+    query: str,
+    limit: int,
+    after: Optional[Tuple[float, int]] = None,
+) -> List[Tuple[int, float]]:
+    if not _match_terms(query):
+        return []
+
+    if db.bind.dialect.name == "postgresql":
+        matches = _postgres_matches(query)
+    else:
+        matches = _sqlite_matches(query)
+
+    statement = select(matches.c.id, matches.c.score)
+    if after is not None:
+        score, tweet_id = after
+        statement = statement.where(
+            or_(
+                matches.c.score < score,
+                and_(matches.c.score == score, matches.c.id < tweet_id),
+            )
+        )
+    result = await db.execute(
+        statement.order_by(matches.c.score.desc(), matches.c.id.desc()).limit(
+            limit
+        )
+    )
+    return [(row.id, row.score) for row in result]
@@ -0,0 +1,223 @@
+from typing import List, Optional
+
+from core import settings
+from db.database import dialect_insert
+from db.jobs import job_runner
+from db.models import Follow, TimelineEntry, Tweet, User
+from sqlalchemy import (
+    delete,
+    desc,
+    exists,
+    insert,
+    literal,
+    select,
+    true,
+    union,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Лента пользователя хранится заранее: при публикации твит раскладывается
+# в timelines автору и его подписчикам (fan-out on write). Авторы, у которых
+# подписчиков не меньше TIMELINE_FANOUT_LIMIT, не рассылают твиты, а
+# подмешиваются в ленту при чтении (fan-out on read).
+
+
+def _is_celebrity(author_id):
+    return (
+        select(User.followers_count)
+        .where(User.id == author_id)
+        .scalar_subquery()
+        >= settings.TIMELINE_FANOUT_LIMIT
+    )
+
+
+# Функция раскладывает новые твиты автора по его ленте и лентам подписчиков
+# одним INSERT ... SELECT. ON CONFLICT DO NOTHING: подписчик, появившийся
+# до выполнения отложенной рассылки, уже получил твит при подписке.
+async def fan_out_tweets(
+    db: AsyncSession,
+    author_id: int,
+    tweet_ids: List[int],
+    to_author: bool = True,
+    to_followers: bool = True,
+) -> None:
+    targets = []
+    if to_author:
+        targets.append(
+            select(literal(author_id), Tweet.id).where(Tweet.id.in_(tweet_ids))
+        )
+    if to_followers:
+        targets.append(
+            select(Follow.follower_id, Tweet.id)
+            .join(Tweet, Tweet.user_id == Follow.followee_id)
+            .where(
+                Follow.followee_id == author_id,
+                Tweet.id.in_(tweet_ids),
+                ~_is_celebrity(author_id),
+            )
+        )
+    await db.execute(
+        dialect_insert(db, TimelineEntry.__table__)
+        .from_select(
+            ["user_id", "tweet_id"],
+            union(*targets) if len(targets) > 1 else targets[0],
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "tweet_id"])
+    )
+
+
+# Функция публикует новые твиты: автору они попадают в ленту сразу, а
+# подписчикам - сразу или, если подписчиков больше
+# JOBS_FANOUT_INLINE_LIMIT, отложенной задачей в той же транзакции.
+# Возвращает True, если задача поставлена.
+async def distribute_tweets(
+    db: AsyncSession, author_id: int, followers_count: int, tweet_ids
+) -> bool:
+    deferred = followers_count > settings.JOBS_FANOUT_INLINE_LIMIT
+    await fan_out_tweets(db, author_id, tweet_ids, to_followers=not deferred)
+    if deferred:
+        await job_runner.enqueue(
+            db, "fan_out", {"author_id": author_id, "tweet_ids": tweet_ids}
+        )
+    return deferred
+
+
+# Удалённые к моменту выполнения твиты не раскладываются: подписчики
+# выбираются вместе с самими твитами
+@job_runner.handler("fan_out")
+async def _fan_out_job(db: AsyncSession, payload: dict) -> None:
+    await fan_out_tweets(
+        db, payload["author_id"], payload["tweet_ids"], to_author=False
+    )
+
+
+# Функция убирает удаляемый твит из всех лент
+async def remove_tweet(db: AsyncSession, tweet_id: int) -> None:
+    await db.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.tweet_id == tweet_id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Функция добавляет в ленту последние твиты автора после подписки
+async def follow_author(
+    db: AsyncSession, user_id: int, author_id: int
+) -> None:
+    recent = (
+        select(literal(user_id), Tweet.id)
+        .where(
+            Tweet.user_id == author_id,
+            ~exists().where(
+                TimelineEntry.user_id == user_id,
+                TimelineEntry.tweet_id == Tweet.id,
+            ),
+        )
+        .order_by(desc(Tweet.id))
+        .limit(settings.TIMELINE_BACKFILL_SIZE)
+    )
+    await db.execute(
+        insert(TimelineEntry).from_select(["user_id", "tweet_id"], recent)
+    )
+
+
+# Функция убирает из ленты твиты автора после отписки
+async def unfollow_author(
+    db: AsyncSession, user_id: int, author_id: int
+) -> None:
+    if user_id == author_id:
+        return
+
+    await db.execute(
+        delete(TimelineEntry)
+        .where(
+            TimelineEntry.user_id == user_id,
+            TimelineEntry.tweet_id.in_(
+                select(Tweet.id).where(Tweet.user_id == author_id)
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Функция раскладывает подписчикам последние TIMELINE_BACKFILL_SIZE твитов
+# автора, как при подписке. Автор, снова ставший популярным, пропускается:
+# его твиты опять подмешиваются при чтении.
+async def backfill_followers(db: AsyncSession, author_id: int) -> None:
+    recent = (
+        select(Tweet.id)
+        .where(Tweet.user_id == author_id)
+        .order_by(desc(Tweet.id))
+        .limit(settings.TIMELINE_BACKFILL_SIZE)
+        .subquery()
+    )
+    await db.execute(
+        dialect_insert(db, TimelineEntry.__table__)
+        .from_select(
+            ["user_id", "tweet_id"],
+            select(Follow.follower_id, recent.c.id)
+            .join(recent, true())
+            .where(Follow.followee_id == author_id, ~_is_celebrity(author_id)),
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "tweet_id"])
+    )
+
+
+# Функция вызывается после отписки от автора. Твиты, опубликованные, пока
+# у автора было не меньше TIMELINE_FANOUT_LIMIT подписчиков, не разосланы
+# и видны только через подмешивание при чтении. Когда автор опускается
+# ниже лимита, подмешивание прекращается, поэтому его последние твиты
+# раскладываются оставшимся подписчикам - сразу или, если их больше
+# JOBS_FANOUT_INLINE_LIMIT, отложенной задачей в той же транзакции.
+async def author_unfollowed(
+    db: AsyncSession, author_id: int, followers_count: int
+) -> None:
+    if followers_count != settings.TIMELINE_FANOUT_LIMIT - 1:
+        return
+
+    if followers_count > settings.JOBS_FANOUT_INLINE_LIMIT:
+        await job_runner.enqueue(
+            db, "backfill_followers", {"author_id": author_id}
+        )
+    else:
+        await backfill_followers(db, author_id)
+
+
+@job_runner.handler("backfill_followers")
+async def _backfill_followers_job(db: AsyncSession, payload: dict) -> None:
+    await backfill_followers(db, payload["author_id"])
+
+
+# Функция возвращает id твитов ленты пользователя (новые сначала)
+async def get_home_timeline(
+    db: AsyncSession, user_id: int, before_id: Optional[int], limit: int
+) -> List[int]:
+    fanned_out = select(TimelineEntry.tweet_id.label("id")).where(
+        TimelineEntry.user_id == user_id
+    )
+    celebrities = (
+        select(Follow.followee_id)
+        .join(User, User.id == Follow.followee_id)
+        .where(
+            Follow.follower_id == user_id,
+            User.followers_count >= settings.TIMELINE_FANOUT_LIMIT,
+        )
+    )
+    merged = select(Tweet.id.label("id")).where(Tweet.user_id.in_(celebrities))
+
+    if before_id is not None:
+        fanned_out = fanned_out.where(TimelineEntry.tweet_id < before_id)
+        merged = merged.where(Tweet.id < before_id)
+
+    fanned_out = (
+        fanned_out.order_by(desc(TimelineEntry.tweet_id))
+        .limit(limit)
+        .subquery()
+    )
+    merged = merged.order_by(desc(Tweet.id)).limit(limit).subquery()
+    timeline = union(select(fanned_out.c.id), select(merged.c.id)).subquery()
+
+    tweet_ids = await db.scalars(
+        select(timeline.c.id).order_by(desc(timeline.c.id)).limit(limit)
+    )
+    return list(tweet_ids)
@@ -0,0 +1,204 @@
+import asyncio
+import heapq
+import logging
+import math
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from core import settings
+from core.metrics import registry
+from db.database import session
+from db.models import Like, Tweet, utcnow
+from sqlalchemy import func, select
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+
+trending_rebuilds = registry.counter(
+    "trending_rebuilds_total", "Пересчётов рейтинга популярного по likes"
+)
+
+
+# Рейтинг популярного: твиты моложе window по числу лайков, которое убывает
+# вдвое за каждые half_life секунд возраста твита. Вес
+# likes * 2 ** (-(now - created_at) / half_life) у всех твитов делится на
+# одно и то же 2 ** (now / half_life), поэтому порядок задаёт ключ
+# log2(likes) + created_at / half_life, который со временем не меняется.
+#
+# В памяти держится не больше capacity твитов с лучшими ключами и min-куча
+# по ключам для вытеснения худшего. Лайки и удаления обновляют рейтинг
+# сразу, а фоновая задача пересчитывает его по таблице likes при старте и
+# раз в refresh_interval секунд: так подтягиваются лайки из других
+# процессов и выпадают твиты, вытесненные раньше времени.
+class TrendingBoard:
+    def __init__(
+        self,
+        session_factory,
+        capacity: int,
+        window: float,
+        half_life: float,
+        refresh_interval: float,
+    ):
+        self.session_factory = session_factory
+        self.capacity = capacity
+        self.window = window
+        self.half_life = half_life
+        self.refresh_interval = refresh_interval
+        self.loaded = False
+        self.last_rebuild_seconds = 0.0
+        # id твита -> (ключ, лайки, время создания)
+        self._entries: Dict[int, Tuple[float, int, datetime]] = {}
+        self._heap: List[Tuple[float, int]] = []
+        # Изменения, пришедшие во время пересчёта: применяются поверх него
+        self._changes: Optional[Dict[int, Tuple[int, datetime]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _key(self, likes: int, created_at: datetime) -> float:
+        age = (created_at - EPOCH).total_seconds()
+        return math.log2(likes) + age / self.half_life
+
+    def _cutoff(self) -> datetime:
+        return utcnow() - timedelta(seconds=self.window)
+
+    # Худший из отслеживаемых твитов; устаревшие записи кучи выбрасываются
+    def _lowest(self) -> Optional[Tuple[float, int]]:
+        while self._heap:
+            key, tweet_id = self._heap[0]
+            entry = self._entries.get(tweet_id)
+            if entry is not None and entry[0] == key:
+                return key, tweet_id
+            heapq.heappop(self._heap)
+        return None
+
+    def _set(self, tweet_id: int, likes: int, created_at: datetime) -> None:
+        if likes <= 0 or created_at < self._cutoff():
+            self._entries.pop(tweet_id, None)
+            return
+
+        key = self._key(likes, created_at)
+        if tweet_id not in self._entries and len(self) >= self.capacity:
+            lowest = self._lowest()
+            if lowest is None or key <= lowest[0]:
+                return
+            del self._entries[lowest[1]]
+
+        self._entries[tweet_id] = (key, likes, created_at)
+        heapq.heappush(self._heap, (key, tweet_id))
+        if len(self._heap) > 2 * self.capacity + 64:
+            self._heap = [
+                (entry[0], entry_id)
+                for entry_id, entry in self._entries.items()
+            ]
+            heapq.heapify(self._heap)
+
+    # Новое число лайков твита после лайка или снятия лайка
+    def update(self, tweet_id: int, likes: int, created_at: datetime) -> None:
+        if self._changes is not None:
+            self._changes[tweet_id] = (likes, created_at)
+        self._set(tweet_id, likes, created_at)
+
+    def remove(self, tweet_id: int) -> None:
+        self.update(tweet_id, 0, EPOCH)
+
+    # id limit самых популярных твитов, от лучшего к худшему
+    def top(self, limit: int) -> List[int]:
+        cutoff = self._cutoff()
+        best = heapq.nlargest(
+            limit,
+            (
+                (key, tweet_id)
+                for tweet_id, (key, _, created_at) in self._entries.items()
+                if created_at >= cutoff
+            ),
+        )
+        return [tweet_id for _, tweet_id in best]
+
+    # Пересчёт по таблице likes. Строки читаются потоком, а в памяти
+    # остаются только capacity лучших, сколько бы твитов ни было в окне.
+    async def rebuild(self) -> None:
+        started = time.perf_counter()
+        self._changes = {}
+        try:
+            best: List[Tuple[float, int, int, datetime]] = []
+            async with self.session_factory() as db:
+                rows = await db.stream(
+                    select(Like.tweet_id, Tweet.created_at, func.count())
+                    .join(Tweet, Tweet.id == Like.tweet_id)
+                    .where(Tweet.created_at >= self._cutoff())
+                    .group_by(Like.tweet_id, Tweet.created_at)
+                )
+                async for tweet_id, created_at, likes in rows:
+                    item = (
+                        self._key(likes, created_at),
+                        tweet_id,
+                        likes,
+                        created_at,
+                    )
+                    if len(best) < self.capacity:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+
+            self._entries = {
+                tweet_id: (key, likes, created_at)
+                for key, tweet_id, likes, created_at in best
+            }
+            self._heap = [(key, tweet_id) for key, tweet_id, _, _ in best]
+            heapq.heapify(self._heap)
+            for tweet_id, (likes, created_at) in self._changes.items():
+                self._set(tweet_id, likes, created_at)
+        finally:
+            self._changes = None
+
+        self.loaded = True
+        self.last_rebuild_seconds = time.perf_counter() - started
+        trending_rebuilds.inc()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.rebuild()
+            except Exception:
+                logger.exception("Не удалось пересчитать рейтинг популярного")
+            await asyncio.sleep(self.refresh_interval)
+
+    # Первый пересчёт идёт в фоне: до его окончания рейтинг собирается
+    # только из новых лайков, а старт приложения не ждёт запроса к likes
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+trending_board = TrendingBoard(
+    session_factory=session,
+    capacity=settings.TRENDING_CAPACITY,
+    window=settings.TRENDING_WINDOW,
+    half_life=settings.TRENDING_HALF_LIFE,
+    refresh_interval=settings.TRENDING_REFRESH_INTERVAL,
+)
+
+registry.gauge(
+    "trending_tracked_tweets",
+    "Твитов в рейтинге популярного",
+    lambda: len(trending_board),
+)
+registry.gauge(
+    "trending_rebuild_seconds",
+    "Длительность последнего пересчёта рейтинга популярного",
+    lambda: trending_board.last_rebuild_seconds,
+)
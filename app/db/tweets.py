@@ -0,0 +1,102 @@
+from contextlib import AsyncExitStack
+from typing import Dict, List, Sequence, Tuple
+
+from core.media import file_lock, remove_files
+from db.jobs import job_runner
+from db.models import Like, Media, Tweet
+from sqlalchemy import case, delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+tweets_table = Tweet.__table__
+media_table = Media.__table__
+
+
+# Функция прикрепляет медиа к твитам одним UPDATE: media_id -> tweet_id.
+# Прикрепляются только медиа пользователя, ещё не прикреплённые к твиту.
+# Возвращает (media_id, tweet_id, image_url) прикреплённых медиа.
+async def attach_media(
+    db: AsyncSession, user_id: int, media: Dict[int, int]
+) -> List[Tuple[int, int, str]]:
+    result = await db.execute(
+        update(media_table)
+        .where(
+            media_table.c.id.in_(list(media)),
+            media_table.c.user_id == user_id,
+            media_table.c.tweet_id.is_(None),
+        )
+        .values(tweet_id=case(media, value=media_table.c.id))
+        .returning(
+            media_table.c.id, media_table.c.tweet_id, media_table.c.image_url
+        )
+    )
+    return [tuple(row) for row in result]
+
+
+# Функция создаёт твиты пользователя пакетным INSERT ... RETURNING и
+# прикрепляет к ним медиа в той же транзакции. items - пары
+# (текст, id медиа); возвращает id твитов в порядке items с путями
+# прикреплённых к ним медиа: {tweet_id: [image_url, ...]}.
+async def create_tweets(
+    db: AsyncSession, user_id: int, items: Sequence[Tuple[str, Sequence[int]]]
+) -> Dict[int, List[str]]:
+    # На PostgreSQL порядок RETURNING при пакетной вставке гарантирует
+    # sort_by_parameter_order. SQLite с этим флагом вставляет по строке, а
+    # без него - одним запросом, выдавая rowid по порядку VALUES.
+    ordered = db.bind.dialect.name == "postgresql"
+    result = await db.execute(
+        insert(tweets_table).returning(
+            tweets_table.c.id, sort_by_parameter_order=ordered
+        ),
+        [{"text": text, "user_id": user_id} for text, _ in items],
+    )
+    tweet_ids = list(result.scalars())
+    if not ordered:
+        tweet_ids.sort()
+
+    media = {
+        media_id: tweet_id
+        for tweet_id, (_, media_ids) in zip(tweet_ids, items)
+        for media_id in media_ids
+    }
+    created: Dict[int, List[str]] = {tweet_id: [] for tweet_id in tweet_ids}
+    if media:
+        attached = await attach_media(db, user_id, media)
+        for _, tweet_id, image_url in sorted(attached):
+            created[tweet_id].append(image_url)
+
+    return created
+
+
+# Функция удаляет твит вместе с лайками и записями медиа (ленты чистит
+# timeline.remove_tweet), а файлы медиа удаляет отложенная задача.
+# Возвращает True, если задача поставлена.
+async def delete_tweet(db: AsyncSession, tweet_id: int) -> bool:
+    await db.execute(delete(Like).where(Like.tweet_id == tweet_id))
+    result = await db.execute(
+        delete(media_table)
+        .where(media_table.c.tweet_id == tweet_id)
+        .returning(media_table.c.image_url)
+    )
+    filenames = sorted(set(result.scalars()))
+    if filenames:
+        await job_runner.enqueue(db, "purge_media", {"filenames": filenames})
+    await db.execute(delete(tweets_table).where(tweets_table.c.id == tweet_id))
+    return bool(filenames)
+
+
+# Файл удаляется, только если на него не ссылаются другие записи медиа:
+# одинаковые загрузки хранятся одним файлом. Ссылки проверяются под
+# блокировками файлов (в порядке имён), которые держит и загрузка до
+# commit своей записи.
+@job_runner.handler("purge_media")
+async def _purge_media_job(db: AsyncSession, payload: dict) -> None:
+    filenames = sorted(payload["filenames"])
+    async with AsyncExitStack() as locks:
+        for filename in filenames:
+            await locks.enter_async_context(file_lock(filename))
+        used = await db.scalars(
+            select(media_table.c.image_url).where(
+                media_table.c.image_url.in_(filenames)
+            )
+        )
+        await remove_files(set(filenames) - set(used))
@@ -1,36 +1,52 @@
 from api.endpoints import routes
-from db.database import Base, engine, get_db
+from core.capture import RequestCaptureMiddleware, capture_writer
+from core.instrumentation import RequestMetricsMiddleware
+from core.limits import RateLimitMiddleware
+from core.media import (
+    MediaSizeLimitMiddleware,
+    MediaTooLarge,
+    too_large_response,
+)
+from db.database import session
+from db.jobs import job_runner
+from db.like_buffer import like_buffer
 from db.models import User
+from db.trending import trending_board
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.staticfiles import StaticFiles
 
-app = FastAPI(title="FakeTwitter")
+app = FastAPI(title="FakeTwitter", default_response_class=ORJSONResponse)
 app.include_router(routes.router)
+app.add_middleware(MediaSizeLimitMiddleware)
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(RequestCaptureMiddleware)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
-def initialize_database(db: Session):
-    existing_users = db.query(User.id).count()
+async def initialize_database(db: AsyncSession):
+    existing_users = await db.scalar(select(func.count(User.id)))
 
     if existing_users == 0:
         db.add(User(username="Admin", api_key="test"))
         db.add(User(username="Vasiliy Pupkin", api_key="test2"))
         db.add(User(username="Elon Musk", api_key="Elon"))
 
-        db.commit()
+        await db.commit()
 
 
-def startup_db():
-    Base.metadata.create_all(bind=engine)
-    db = next(get_db())
-    initialize_database(db)
+# Схема БД создаётся миграциями (alembic upgrade head), а не здесь
+async def startup_db():
+    async with session() as db:
+        await initialize_database(db)
 
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         {
             "result": False,
             "error_type": "HTTPException",
@@ -39,9 +55,14 @@ async def http_exception_handler(request, exc):
     )
 
 
+@app.exception_handler(MediaTooLarge)
+async def media_too_large_handler(request, exc):
+    return too_large_response()
+
+
 @app.exception_handler(Exception)
 async def generic_exception_handler(request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         {
             "result": False,
             "error_type": "InternalServerError",
@@ -51,5 +72,14 @@ async def generic_exception_handler(request, exc):
 
 
 app.add_exception_handler(HTTPException, http_exception_handler)
+app.add_exception_handler(MediaTooLarge, media_too_large_handler)
 app.add_exception_handler(Exception, generic_exception_handler)
 app.add_event_handler("startup", startup_db)
+app.add_event_handler("startup", like_buffer.start)
+app.add_event_handler("shutdown", like_buffer.stop)
+app.add_event_handler("startup", capture_writer.start)
+app.add_event_handler("shutdown", capture_writer.stop)
+app.add_event_handler("startup", trending_board.start)
+app.add_event_handler("shutdown", trending_board.stop)
+app.add_event_handler("startup", job_runner.start)
+app.add_event_handler("shutdown", job_runner.stop)
@@ -0,0 +1,192 @@
+"""initial schema and indexes
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+
+База, созданная раньше через Base.metadata.create_all, принимается как
+есть: недостающие таблицы, колонки и индексы создаются, подписки из
+subscriptions/subscribers переносятся в follows, дубли лайков удаляются.
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (таблица, имя индекса, колонки, уникальный)
+INDEXES = [
+    ("tweets", "ix_tweets_user_id_id", ["user_id", "id"], False),
+    ("likes", "uq_likes_user_tweet", ["user_id", "tweet_id"], True),
+    ("likes", "ix_likes_tweet_id", ["tweet_id"], False),
+    ("media", "ix_media_tweet_id", ["tweet_id"], False),
+    ("media", "ix_media_user_id", ["user_id"], False),
+    ("media", "ix_media_image_url", ["image_url"], False),
+    ("timelines", "ix_timelines_tweet_id", ["tweet_id"], False),
+    (
+        "follows",
+        "ix_follows_followee_follower",
+        ["followee_id", "follower_id"],
+        False,
+    ),
+]
+
+
+def _create_tables(existing) -> None:
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("username", sa.String(50), nullable=False),
+            sa.Column("api_key", sa.String(), unique=True),
+            sa.Column(
+                "followers_count",
+                sa.Integer(),
+                nullable=False,
+                server_default="0",
+            ),
+        )
+    if "tweets" not in existing:
+        op.create_table(
+            "tweets",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("text", sa.String(), nullable=False),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+            sa.Column("count_likes", sa.Integer()),
+        )
+    if "likes" not in existing:
+        op.create_table(
+            "likes",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+            sa.Column("tweet_id", sa.Integer(), sa.ForeignKey("tweets.id")),
+        )
+    if "media" not in existing:
+        op.create_table(
+            "media",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("image_url", sa.String()),
+            sa.Column("tweet_id", sa.Integer(), sa.ForeignKey("tweets.id")),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        )
+    if "follows" not in existing:
+        op.create_table(
+            "follows",
+            sa.Column(
+                "follower_id",
+                sa.Integer(),
+                sa.ForeignKey("users.id"),
+                primary_key=True,
+            ),
+            sa.Column(
+                "followee_id",
+                sa.Integer(),
+                sa.ForeignKey("users.id"),
+                primary_key=True,
+            ),
+        )
+    if "timelines" not in existing:
+        op.create_table(
+            "timelines",
+            sa.Column(
+                "user_id",
+                sa.Integer(),
+                sa.ForeignKey("users.id"),
+                primary_key=True,
+            ),
+            sa.Column(
+                "tweet_id",
+                sa.Integer(),
+                sa.ForeignKey("tweets.id"),
+                primary_key=True,
+            ),
+        )
+
+
+def _migrate_legacy_follows(existing) -> None:
+    legacy = [
+        (table, follower)
+        for table, follower in (
+            ("subscriptions", "subscriptions_id"),
+            ("subscribers", "subscribers_id"),
+        )
+        if table in existing
+    ]
+
+    for table, follower in legacy:
+        op.execute(
+            f"INSERT INTO follows (follower_id, followee_id) "
+            f"SELECT DISTINCT {follower}, subscriber_id FROM {table} "
+            f"WHERE {follower} IS NOT NULL AND subscriber_id IS NOT NULL "
+            f"ON CONFLICT DO NOTHING"
+        )
+        op.drop_table(table)
+
+    if legacy:
+        op.execute(
+            "UPDATE users SET followers_count = "
+            "(SELECT count(*) FROM follows "
+            "WHERE follows.followee_id = users.id)"
+        )
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    existing = set(sa.inspect(bind).get_table_names())
+
+    if "users" in existing:
+        columns = {
+            column["name"] for column in sa.inspect(bind).get_columns("users")
+        }
+        if "followers_count" not in columns:
+            op.add_column(
+                "users",
+                sa.Column(
+                    "followers_count",
+                    sa.Integer(),
+                    nullable=False,
+                    server_default="0",
+                ),
+            )
+
+    _create_tables(existing)
+    _migrate_legacy_follows(existing)
+
+    if "likes" in existing:
+        # Перед уникальным индексом убираем повторные лайки
+        op.execute(
+            "DELETE FROM likes WHERE id NOT IN "
+            "(SELECT min(id) FROM likes GROUP BY user_id, tweet_id)"
+        )
+        op.execute(
+            "UPDATE tweets SET count_likes = "
+            "(SELECT count(*) FROM likes WHERE likes.tweet_id = tweets.id)"
+        )
+
+    if "tweets" in existing and "timelines" not in existing:
+        # Ленты для уже опубликованных твитов: автору и его подписчикам
+        op.execute(
+            "INSERT INTO timelines (user_id, tweet_id) "
+            "SELECT user_id, id FROM tweets WHERE user_id IS NOT NULL "
+            "UNION "
+            "SELECT follows.follower_id, tweets.id FROM tweets "
+            "JOIN follows ON follows.followee_id = tweets.user_id"
+        )
+
+    inspector = sa.inspect(bind)
+    for table, name, columns, unique in INDEXES:
+        present = {index["name"] for index in inspector.get_indexes(table)}
+        if name not in present:
+            op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade() -> None:
+    for table, name, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+
+    for table in ("timelines", "follows", "media", "likes", "tweets", "users"):
+        op.drop_table(table)
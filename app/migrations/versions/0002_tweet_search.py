@@ -0,0 +1,58 @@
+"""full-text search over tweets
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+
+PostgreSQL: GIN-индекс по to_tsvector('simple', text). SQLite: FTS5-таблица
+tweets_fts с внешним содержимым (tweets) и триггерами синхронизации.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE tweets_fts USING fts5("
+    "text, content='tweets', content_rowid='id')",
+    "CREATE TRIGGER tweets_fts_insert AFTER INSERT ON tweets BEGIN "
+    "INSERT INTO tweets_fts (rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER tweets_fts_delete AFTER DELETE ON tweets BEGIN "
+    "INSERT INTO tweets_fts (tweets_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER tweets_fts_update AFTER UPDATE OF text ON tweets BEGIN "
+    "INSERT INTO tweets_fts (tweets_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO tweets_fts (rowid, text) VALUES (new.id, new.text); END",
+    "INSERT INTO tweets_fts (tweets_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER tweets_fts_update",
+    "DROP TRIGGER tweets_fts_delete",
+    "DROP TRIGGER tweets_fts_insert",
+    "DROP TABLE tweets_fts",
+]
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            "CREATE INDEX ix_tweets_text_search ON tweets "
+            "USING gin (to_tsvector('simple'::regconfig, text))"
+        )
+    else:
+        for statement in SQLITE_UPGRADE:
+            op.execute(statement)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.drop_index("ix_tweets_text_search", table_name="tweets")
+    else:
+        for statement in SQLITE_DOWNGRADE:
+            op.execute(statement)
@@ -0,0 +1,44 @@
+"""tweet creation time
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+
+Время создания твита (UTC) для рейтинга популярного. Уже существующим
+твитам проставляется время применения миграции. SQLite не позволяет
+добавить столбец с CURRENT_TIMESTAMP по умолчанию, поэтому там столбец
+создаётся с постоянным значением и заполняется отдельным UPDATE; новые
+строки получают время из default модели.
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        default = sa.text("timezone('utc', now())")
+    else:
+        default = sa.text("'1970-01-01 00:00:00'")
+
+    op.add_column(
+        "tweets",
+        sa.Column(
+            "created_at", sa.DateTime(), nullable=False, server_default=default
+        ),
+    )
+    if op.get_bind().dialect.name != "postgresql":
+        op.execute("UPDATE tweets SET created_at = CURRENT_TIMESTAMP")
+
+    op.create_index("ix_tweets_created_at", "tweets", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_tweets_created_at", table_name="tweets")
+    op.drop_column("tweets", "created_at")
@@ -1,16 +1,51 @@
+import os
+
 import pytest
-from db.database import Base, get_db
+from alembic import command
+from alembic.config import Config
+from api.feed import tweet_cache
+from core.limits import client_keys, rate_limiter
+from core.security import api_key_cache
+from db.database import get_db, get_read_db
 from db.models import User
 from fastapi.testclient import TestClient
 from main import app
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
+TEST_DB_PATH = "./test.db"
 DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+ALEMBIC_INI = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "alembic.ini"
+)
+
+
+def make_alembic_config(url):
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("sqlalchemy.url", url)
+    config.attributes["configure_logger"] = False
+    return config
+
+
+@pytest.fixture
+def alembic_config():
+    return make_alembic_config
+
+
+# Схема тестовой БД создаётся теми же миграциями, что и в продакшене.
+# Файл БД пересоздаётся: тесты рассчитывают на id, выданные с нуля.
+@pytest.fixture(scope="session")
+def migrated_db():
+    if os.path.exists(TEST_DB_PATH):
+        os.remove(TEST_DB_PATH)
+    command.upgrade(make_alembic_config(ASYNC_DATABASE_URL), "head")
 
 
 @pytest.fixture
-def test_engine():
+def test_engine(migrated_db):
     engine = create_engine(DATABASE_URL)
     return engine
 
@@ -19,8 +54,6 @@ def test_engine():
 def test_db(test_engine):
     session = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
 
-    Base.metadata.create_all(bind=test_engine)
-
     db = session()
 
     try:
@@ -56,12 +89,33 @@ def test_users(test_db):
     return test_users
 
 
+# Приложение работает через aiosqlite с тем же файлом БД, что и test_db.
+# NullPool: TestClient запускает каждый запрос в своём event loop.
+@pytest.fixture
+def test_async_engine():
+    engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+    return engine
+
+
+@pytest.fixture
+def test_async_session(test_async_engine):
+    return async_sessionmaker(
+        bind=test_async_engine, autoflush=False, expire_on_commit=False
+    )
+
+
 @pytest.fixture
-def test_app(test_db):
-    def override_get_db():
-        return test_db
+def test_app(test_db, test_async_session):
+    async def override_get_db():
+        async with test_async_session() as db:
+            yield db
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    api_key_cache.clear()
+    tweet_cache.clear()
+    rate_limiter.clear()
+    client_keys.session_factory = test_async_session
 
     client = TestClient(app, base_url="http://127.0.0.1:8000")
     return client
@@ -1,7 +1,29 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
 from io import BytesIO
 
+import httpx
 import pytest
-from db.models import Media, Subscribers, Tweet, User
+from api import feed as feed_module
+from api.feed import tweet_cache
+from core import settings
+from core.media import MEDIA_CHUNK_SIZE, MEDIA_FORM_OVERHEAD, media_dir
+from core.metrics import registry
+from core.security import api_key_cache
+from db import database
+from db.database import make_engine
+from db.like_buffer import like_buffer
+from db.models import Follow, Like, Media, TimelineEntry, Tweet, User
+from db.pool import pool_checkouts, pool_timeouts, pool_wait_seconds
+from main import app
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
 
 
 @pytest.mark.tweets
@@ -170,9 +192,7 @@ def test_follow_user(test_app, test_db, test_users):
 
     user = test_db.query(User).filter(User.id == 1).first()
     followers_count = (
-        test_db.query(Subscribers)
-        .filter(Subscribers.subscribers_id == user.id)
-        .count()
+        test_db.query(Follow).filter(Follow.follower_id == user.id).count()
     )
     assert followers_count == 1
 
@@ -190,8 +210,755 @@ def test_unfollow_user(test_app, test_db, test_users):
 
     user = test_db.query(User).filter(User.id == 1).first()
     followers_count = (
-        test_db.query(Subscribers)
-        .filter(Subscribers.subscribers_id == user.id)
-        .count()
+        test_db.query(Follow).filter(Follow.follower_id == user.id).count()
     )
     assert followers_count == 0
+
+
+@pytest.mark.tweets
+def test_get_tweets_pagination(test_app, test_db, test_users):
+    tweet_ids = []
+    for text in ("first", "second", "third"):
+        response = test_app.post(
+            "/api/tweets",
+            json={"tweet_data": text, "tweet_media_ids": []},
+            headers={"api-key": "test"},
+        )
+        tweet_ids.append(response.json()["tweet_id"])
+
+    response = test_app.get(
+        "/api/tweets", params={"limit": 2}, headers={"api-key": "test"}
+    )
+    result = response.json()
+
+    assert [tweet["id"] for tweet in result["tweets"]] == tweet_ids[:0:-1]
+    assert result["next_cursor"] == tweet_ids[1]
+
+    response = test_app.get(
+        "/api/tweets",
+        params={"limit": 2, "cursor": result["next_cursor"]},
+        headers={"api-key": "test"},
+    )
+    result = response.json()
+
+    assert [tweet["id"] for tweet in result["tweets"]] == tweet_ids[:1]
+    assert result["next_cursor"] is None
+
+    for tweet_id in tweet_ids:
+        test_app.delete(f"/api/tweets/{tweet_id}", headers={"api-key": "test"})
+
+
+@pytest.mark.tweets
+def test_get_tweets_query_count(test_app, test_async_engine, test_users):
+    tweet_ids = []
+    for text in ("first", "second", "third"):
+        response = test_app.post(
+            "/api/tweets",
+            json={"tweet_data": text, "tweet_media_ids": []},
+            headers={"api-key": "test"},
+        )
+        tweet_id = response.json()["tweet_id"]
+        tweet_ids.append(tweet_id)
+        for api_key in ("test", "test2"):
+            test_app.post(
+                f"/api/tweets/{tweet_id}/likes", headers={"api-key": api_key}
+            )
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sync_engine = test_async_engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", count_statement)
+    try:
+        response = test_app.get("/api/tweets", headers={"api-key": "test"})
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", count_statement)
+
+    tweets = response.json()["tweets"]
+    assert len(tweets) == 3
+    assert all(len(tweet["likes"]) == 2 for tweet in tweets)
+    assert tweets[0]["author"]["name"] == "user1"
+    # api-key уже в кэше: id ленты, твиты с авторами, медиа, лайки
+    assert len(statements) == 4
+
+    # Повторно твиты берутся из кэша, в БД только id ленты
+    statements.clear()
+    event.listen(sync_engine, "before_cursor_execute", count_statement)
+    try:
+        response = test_app.get("/api/tweets", headers={"api-key": "test"})
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", count_statement)
+
+    assert response.json()["tweets"] == tweets
+    assert len(statements) == 1
+
+    test_app.delete(
+        f"/api/tweets/{tweet_ids[0]}/likes", headers={"api-key": "test"}
+    )
+    response = test_app.get("/api/tweets", headers={"api-key": "test"})
+    assert len(response.json()["tweets"][2]["likes"]) == 1
+
+    for tweet_id in tweet_ids:
+        test_app.delete(f"/api/tweets/{tweet_id}", headers={"api-key": "test"})
+
+
+@pytest.mark.users
+def test_home_timeline(test_app, test_users, monkeypatch):
+    def feed(api_key):
+        response = test_app.get("/api/tweets", headers={"api-key": api_key})
+        return [tweet["id"] for tweet in response.json()["tweets"]]
+
+    response = test_app.post(
+        "/api/tweets",
+        json={"tweet_data": "before follow", "tweet_media_ids": []},
+        headers={"api-key": "test"},
+    )
+    old_tweet_id = response.json()["tweet_id"]
+
+    assert feed("test") == [old_tweet_id]
+    assert feed("test2") == []
+
+    test_app.post("/api/users/1/follow", headers={"api-key": "test2"})
+    assert feed("test2") == [old_tweet_id]
+
+    response = test_app.post(
+        "/api/tweets",
+        json={"tweet_data": "after follow", "tweet_media_ids": []},
+        headers={"api-key": "test"},
+    )
+    new_tweet_id = response.json()["tweet_id"]
+    assert feed("test2") == [new_tweet_id, old_tweet_id]
+
+    # Твиты популярного автора подмешиваются в ленту при чтении
+    monkeypatch.setattr(settings, "TIMELINE_FANOUT_LIMIT", 1)
+    response = test_app.post(
+        "/api/tweets",
+        json={"tweet_data": "celebrity", "tweet_media_ids": []},
+        headers={"api-key": "test"},
+    )
+    celebrity_tweet_id = response.json()["tweet_id"]
+    assert feed("test2") == [celebrity_tweet_id, new_tweet_id, old_tweet_id]
+
+    test_app.delete(f"/api/tweets/{new_tweet_id}", headers={"api-key": "test"})
+    assert feed("test2") == [celebrity_tweet_id, old_tweet_id]
+
+    test_app.delete("/api/users/1/follow", headers={"api-key": "test2"})
+    assert feed("test2") == []
+
+    for tweet_id in (old_tweet_id, celebrity_tweet_id):
+        test_app.delete(f"/api/tweets/{tweet_id}", headers={"api-key": "test"})
+
+
+@pytest.mark.users
+def test_celebrity_tweets_after_demotion(
+    test_app, test_db, test_users, monkeypatch
+):
+    def feed(api_key):
+        response = test_app.get("/api/tweets", headers={"api-key": api_key})
+        return [tweet["id"] for tweet in response.json()["tweets"]]
+
+    fan = User(username="fan", api_key="fan")
+    test_db.add(fan)
+    test_db.commit()
+    monkeypatch.setattr(settings, "TIMELINE_FANOUT_LIMIT", 2)
+    for api_key in ("test2", "fan"):
+        test_app.post("/api/users/1/follow", headers={"api-key": api_key})
+
+    response = test_app.post(
+        "/api/tweets",
+        json={"tweet_data": "celebrity", "tweet_media_ids": []},
+        headers={"api-key": "test"},
+    )
+    tweet_id = response.json()["tweet_id"]
+    assert feed("test2") == [tweet_id]
+
+    # Автор опустился ниже лимита: твит, который не рассылали, остаётся
+    # в ленте оставшегося подписчика
+    test_app.delete("/api/users/1/follow", headers={"api-key": "fan"})
+    assert feed("test2") == [tweet_id]
+
+    test_app.delete("/api/users/1/follow", headers={"api-key": "test2"})
+    test_app.delete(f"/api/tweets/{tweet_id}", headers={"api-key": "test"})
+    test_db.delete(fan)
+    test_db.commit()
+
+
+def test_api_key_cache(test_app, test_db, test_users):
+    api_key_cache.clear()
+
+    test_app.get("/api/users/me", headers={"api-key": "test"})
+    test_app.get("/api/users/me", headers={"api-key": "test"})
+    # В БД пользователь ищется один раз - в middleware лимитов, роуты
+    # обоих запросов находят его в кэше
+    assert (api_key_cache.hits, api_key_cache.misses) == (2, 1)
+
+    user = test_db.query(User).filter_by(api_key="test").first()
+    user.username = "renamed"
+    test_db.commit()
+
+    response = test_app.get("/api/users/me", headers={"api-key": "test"})
+    assert response.json()["user"]["name"] == "renamed"
+
+    user.username = "user1"
+    test_db.commit()
+
+
+def test_upload_media_deduplicated(test_app, test_users):
+    image_data = b"\x89PNG\r\n\x1a\n" + b"\x00" * 256
+
+    media_ids = []
+    for filename in ("first.png", "second.png"):
+        response = test_app.post(
+            "/api/medias",
+            headers={"api-key": "test2"},
+            files={"file": (filename, BytesIO(image_data), "image/png")},
+        )
+        media_ids.append(response.json()["media_id"])
+
+    assert media_ids[0] == media_ids[1]
+    assert os.path.exists(
+        os.path.join(
+            media_dir, hashlib.sha256(image_data).hexdigest() + ".png"
+        )
+    )
+
+
+def test_upload_media_too_large(test_app, test_users, monkeypatch):
+    monkeypatch.setattr(settings, "MEDIA_MAX_SIZE", 16)
+
+    response = test_app.post(
+        "/api/medias",
+        headers={"api-key": "test"},
+        files={"file": ("big.jpg", BytesIO(b"\x00" * 17), "image/jpg")},
+    )
+
+    assert response.status_code == 413
+    assert response.json()["result"] is False
+    assert not any(name.endswith(".part") for name in os.listdir(media_dir))
+
+
+# Тело больше предела отклоняется до разбора формы: по Content-Length или,
+# без него, как только прочитано больше предела
+def test_upload_media_body_limit(test_app, test_users, monkeypatch):
+    monkeypatch.setattr(settings, "MEDIA_MAX_SIZE", 16)
+    headers = {"api-key": "test"}
+    big = b"\x00" * (MEDIA_FORM_OVERHEAD + 1024)
+
+    response = test_app.post(
+        "/api/medias",
+        headers=headers,
+        files={"file": ("big.jpg", BytesIO(big), "image/jpg")},
+    )
+    assert response.status_code == 413
+    assert response.json()["error_message"] == "Файл слишком большой"
+
+    sent = []
+
+    async def chunked():
+        yield b"--boundary\r\nContent-Disposition: form-data; "
+        yield b'name="file"; filename="big.jpg"\r\n\r\n'
+        for _ in range(100):
+            sent.append(MEDIA_CHUNK_SIZE)
+            yield b"\x00" * MEDIA_CHUNK_SIZE
+
+    async def post():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            return await client.post(
+                "/api/medias",
+                headers={
+                    **headers,
+                    "content-type": "multipart/form-data; boundary=boundary",
+                },
+                content=chunked(),
+            )
+
+    response = asyncio.run(post())
+    assert response.status_code == 413
+    assert sum(sent) <= MEDIA_FORM_OVERHEAD + 2 * MEDIA_CHUNK_SIZE
+
+
+@pytest.mark.likes
+def test_like_tweet_idempotent(test_app, test_db, test_users):
+    response = test_app.post(
+        "/api/tweets",
+        json={"tweet_data": "like me", "tweet_media_ids": []},
+        headers={"api-key": "test"},
+    )
+    tweet_id = response.json()["tweet_id"]
+
+    for _ in range(2):
+        response = test_app.post(
+            f"/api/tweets/{tweet_id}/likes", headers={"api-key": "test2"}
+        )
+        assert response.json()["result"] is True
+
+    tweet = test_db.query(Tweet).filter_by(id=tweet_id).first()
+    assert tweet.count_likes == 1
+    assert test_db.query(Like).filter_by(tweet_id=tweet_id).count() == 1
+
+    for _ in range(2):
+        response = test_app.delete(
+            f"/api/tweets/{tweet_id}/likes", headers={"api-key": "test2"}
+        )
+        assert response.json()["result"] is True
+
+    test_db.refresh(tweet)
+    assert tweet.count_likes == 0
+
+    response = test_app.post(
+        "/api/tweets/999999/likes", headers={"api-key": "test2"}
+    )
+    assert response.json()["result"] is False
+
+    test_app.delete(f"/api/tweets/{tweet_id}", headers={"api-key": "test"})
+
+
+@pytest.mark.likes
+def test_like_buffer(test_app, test_db, test_async_session, monkeypatch):
+    monkeypatch.setattr(like_buffer, "enabled", True)
+    monkeypatch.setattr(like_buffer, "session_factory", test_async_session)
+
+    response = test_app.post(
+        "/api/tweets",
+        json={"tweet_data": "buffered", "tweet_media_ids": []},
+        headers={"api-key": "test"},
+    )
+    tweet_id = response.json()["tweet_id"]
+    test_app.post(f"/api/tweets/{tweet_id}/likes", headers={"api-key": "test"})
+
+    tweet = test_db.query(Tweet).filter_by(id=tweet_id).first()
+    assert tweet.count_likes == 0
+    assert like_buffer.backlog == 1
+
+    response = test_app.get("/api/tweets", headers={"api-key": "test"})
+    assert response.json()["tweets"][0]["count_likes"] == 1
+
+    asyncio.run(like_buffer.stop())
+
+    test_db.refresh(tweet)
+    assert tweet.count_likes == 1
+    assert like_buffer.backlog == 0
+    assert like_buffer.last_flush_size == 1
+
+    test_app.delete(f"/api/tweets/{tweet_id}", headers={"api-key": "test"})
+
+
+@pytest.mark.users
+def test_follow_user_idempotent(test_app, test_db, test_users):
+    for _ in range(2):
+        response = test_app.post(
+            "/api/users/2/follow", headers={"api-key": "test"}
+        )
+        assert response.json()["result"] is True
+
+    assert test_db.query(Follow).count() == 1
+    followee = test_db.query(User).filter(User.id == 2).first()
+    test_db.refresh(followee)
+    assert followee.followers_count == 1
+
+    response = test_app.get("/api/users/me", headers={"api-key": "test"})
+    user_data = response.json()["user"]
+    assert user_data["following"] == [{"id": 2, "name": "user2"}]
+    assert user_data["followers"] == []
+
+    response = test_app.get("/api/users/2")
+    user_data = response.json()["user"]
+    assert user_data["followers"] == [{"id": 1, "name": "user1"}]
+    assert user_data["following"] == []
+
+    test_app.delete("/api/users/2/follow", headers={"api-key": "test"})
+    response = test_app.delete(
+        "/api/users/2/follow", headers={"api-key": "test"}
+    )
+    assert response.json()["result"] is False
+
+    test_db.refresh(followee)
+    assert followee.followers_count == 0
+
+
+@pytest.mark.tweets
+def test_get_tweets_etag(test_app, test_users):
+    response = test_app.get("/api/tweets", headers={"api-key": "test"})
+    etag = response.headers["ETag"]
+
+    response = test_app.get(
+        "/api/tweets", headers={"api-key": "test", "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = test_app.post(
+        "/api/tweets",
+        json={"tweet_data": "new", "tweet_media_ids": []},
+        headers={"api-key": "test"},
+    )
+    tweet_id = response.json()["tweet_id"]
+
+    response = test_app.get(
+        "/api/tweets", headers={"api-key": "test", "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    test_app.delete(f"/api/tweets/{tweet_id}", headers={"api-key": "test"})
+
+
+@pytest.mark.users
+def test_user_info_etag(test_app, test_users):
+    response = test_app.get("/api/users/2")
+    etag = response.headers["ETag"]
+
+    response = test_app.get("/api/users/2", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    test_app.post("/api/users/2/follow", headers={"api-key": "test"})
+
+    response = test_app.get("/api/users/2", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["user"]["followers"] == [{"id": 1, "name": "user1"}]
+
+    test_app.delete("/api/users/2/follow", headers={"api-key": "test"})
+
+
+def upload(test_app, data, api_key="test"):
+    response = test_app.post(
+        "/api/medias",
+        headers={"api-key": api_key},
+        files={"file": ("image.jpg", BytesIO(data), "image/jpg")},
+    )
+    return response.json()["media_id"]
+
+
+@pytest.mark.tweets
+def test_create_tweets_bulk(test_app, test_db, test_users):
+    own_media = upload(test_app, b"bulk own")
+    foreign_media = upload(test_app, b"bulk foreign", api_key="test2")
+
+    response = test_app.post(
+        "/api/tweets/bulk",
+        headers={"api-key": "test"},
+        json={
+            "tweets": [
+                {"tweet_data": "bulk 1", "tweet_media_ids": [own_media]},
+                {"tweet_data": "bulk 2", "tweet_media_ids": [foreign_media]},
+                {"tweet_data": "bulk 3"},
+            ]
+        },
+    )
+    result = response.json()
+    assert result["result"] is True
+
+    tweet_ids = result["tweet_ids"]
+    assert len(tweet_ids) == 3
+    assert tweet_ids == sorted(tweet_ids)
+    assert [test_db.get(Tweet, id).text for id in tweet_ids] == [
+        "bulk 1",
+        "bulk 2",
+        "bulk 3",
+    ]
+
+    test_db.expire_all()
+    assert test_db.get(Media, own_media).tweet_id == tweet_ids[0]
+    assert test_db.get(Media, foreign_media).tweet_id is None
+
+    # Уже прикреплённое медиа к другому твиту не переносится
+    response = test_app.post(
+        "/api/tweets",
+        headers={"api-key": "test"},
+        json={"tweet_data": "again", "tweet_media_ids": [own_media]},
+    )
+    test_db.expire_all()
+    assert test_db.get(Media, own_media).tweet_id == tweet_ids[0]
+
+    feed = test_app.get("/api/tweets", headers={"api-key": "test"}).json()
+    feed_ids = [tweet["id"] for tweet in feed["tweets"]]
+    assert set(tweet_ids) <= set(feed_ids)
+
+    for tweet_id in tweet_ids + [response.json()["tweet_id"]]:
+        test_app.delete(f"/api/tweets/{tweet_id}", headers={"api-key": "test"})
+
+
+@pytest.mark.tweets
+def test_create_tweets_bulk_too_many(test_app, test_users, monkeypatch):
+    monkeypatch.setattr(settings, "TWEETS_BULK_MAX_SIZE", 2)
+
+    response = test_app.post(
+        "/api/tweets/bulk",
+        headers={"api-key": "test"},
+        json={"tweets": [{"tweet_data": "x"}] * 3},
+    )
+    assert response.json()["result"] is False
+
+
+def test_pool_metrics(tmp_path):
+    engine = make_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}",
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    checkouts = pool_checkouts.value
+    timeouts = pool_timeouts.value
+    waits = pool_wait_seconds.count
+
+    async def exhaust():
+        async with engine.connect():
+            with pytest.raises(TimeoutError):
+                async with engine.connect():
+                    pass
+        await engine.dispose()
+
+    asyncio.run(exhaust())
+
+    assert pool_checkouts.value == checkouts + 1
+    assert pool_timeouts.value == timeouts + 1
+    assert pool_wait_seconds.count == waits + 2
+
+
+def test_metrics_endpoint(test_app):
+    response = test_app.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    body = response.text
+    assert "# TYPE db_pool_checkouts_total counter" in body
+    assert "db_pool_size 10.0" in body
+    assert 'db_pool_checkout_wait_seconds_bucket{le="+Inf"}' in body
+
+
+def test_read_replica_routing(
+    test_app, test_async_session, tmp_path, monkeypatch
+):
+    replica_path = tmp_path / "replica.db"
+    shutil.copyfile("test.db", replica_path)
+
+    # Твит, который есть только на "реплике"
+    with Session(create_engine(f"sqlite:///{replica_path}")) as replica:
+        replica.add(Tweet(id=9000, text="replica", user_id=2, count_likes=0))
+        replica.add(TimelineEntry(user_id=1, tweet_id=9000))
+        replica.add(TimelineEntry(user_id=2, tweet_id=9000))
+        replica.commit()
+
+    replica_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{replica_path}", poolclass=NullPool
+    )
+    monkeypatch.setattr(database, "session", test_async_session)
+    monkeypatch.setattr(
+        database,
+        "replica_session",
+        async_sessionmaker(bind=replica_engine, expire_on_commit=False),
+    )
+    monkeypatch.setattr(app, "dependency_overrides", {})
+    database.recent_writers.clear()
+
+    def feed(api_key):
+        response = test_app.get("/api/tweets", headers={"api-key": api_key})
+        return [tweet["id"] for tweet in response.json()["tweets"]]
+
+    assert 9000 in feed("test2")
+
+    response = test_app.post(
+        "/api/tweets",
+        headers={"api-key": "test2"},
+        json={"tweet_data": "primary"},
+    )
+    tweet_id = response.json()["tweet_id"]
+
+    # Только что записавший пользователь читает из основной БД
+    ids = feed("test2")
+    assert tweet_id in ids
+    assert 9000 not in ids
+    assert 9000 in feed("test")
+
+    test_app.delete(f"/api/tweets/{tweet_id}", headers={"api-key": "test2"})
+    database.recent_writers.clear()
+    tweet_cache.clear()
+
+
+def test_tweet_cache_skips_stale_render(
+    test_app, test_users, test_async_session
+):
+    response = test_app.post(
+        "/api/tweets",
+        headers={"api-key": "test"},
+        json={"tweet_data": "raced"},
+    )
+    tweet_id = response.json()["tweet_id"]
+    tweet_cache.clear()
+
+    # Лайк сбрасывает кэш, пока представление загружается из БД
+    async def render(invalidate):
+        async with test_async_session() as db:
+            scalars = db.scalars
+
+            async def racing_scalars(*args, **kwargs):
+                result = await scalars(*args, **kwargs)
+                if invalidate:
+                    feed_module.invalidate_tweets([tweet_id])
+                return result
+
+            db.scalars = racing_scalars
+            await feed_module.render_tweets(db, [tweet_id])
+
+    asyncio.run(render(invalidate=True))
+    assert tweet_cache.get(tweet_id) is None
+    asyncio.run(render(invalidate=False))
+    assert tweet_cache.get(tweet_id) is not None
+
+    test_app.delete(f"/api/tweets/{tweet_id}", headers={"api-key": "test"})
+
+
+def test_openapi_response_models(test_app):
+    schema = test_app.get("/openapi.json").json()
+
+    feed = schema["paths"]["/api/tweets"]["get"]["responses"]["200"]
+    assert feed["content"]["application/json"]["schema"] == {
+        "$ref": "#/components/schemas/FeedResponse"
+    }
+    tweet = schema["components"]["schemas"]["TweetOut"]
+    assert set(tweet["properties"]) == {
+        "id",
+        "content",
+        "attachments",
+        "author",
+        "count_likes",
+        "likes",
+    }
+
+
+def test_request_metrics(test_app, test_users):
+    test_app.get("/api/tweets", headers={"api-key": "test"})
+    test_app.get("/api/users/2")
+
+    body = test_app.get("/metrics").text
+
+    assert (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/api/tweets",status="200"}'
+    ) in body
+    assert (
+        'http_request_db_queries_count{method="GET",'
+        'route="/api/users/{user_id}"}'
+    ) in body
+    assert "db_query_duration_seconds_count" in body
+
+    queries = registry.get("http_request_db_queries")
+    assert queries.labels("GET", "/api/users/{user_id}").sum > 0
+
+
+def test_slow_request_log(test_app, test_users, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "SLOW_REQUEST_THRESHOLD", 1e-9)
+
+    with caplog.at_level(logging.WARNING, logger="core.instrumentation"):
+        test_app.get("/api/users/2")
+
+    [record] = caplog.records
+    assert "/api/users/2" in record.getMessage()
+    assert "SELECT" in record.getMessage()
+
+
+@pytest.mark.tweets
+def test_search_tweets(test_app, test_users):
+    headers = {"api-key": "test"}
+    texts = [
+        "Поиск по твитам работает",
+        "поиск и ещё раз поиск",
+        "совсем другой текст",
+        'спецсимволы "поиск* OR',
+    ]
+    tweet_ids = [
+        test_app.post(
+            "/api/tweets", json={"tweet_data": text}, headers=headers
+        ).json()["tweet_id"]
+        for text in texts
+    ]
+
+    response = test_app.get(
+        "/api/tweets/search", params={"q": "поиск"}, headers=headers
+    )
+    found = [tweet["id"] for tweet in response.json()["tweets"]]
+    assert set(found) == {tweet_ids[0], tweet_ids[1], tweet_ids[3]}
+    # Двойное совпадение релевантнее
+    assert found[0] == tweet_ids[1]
+    assert response.json()["tweets"][0]["author"]["name"] == "user1"
+
+    pages = []
+    cursor = None
+    while True:
+        params = {"q": "поиск", "limit": 1}
+        if cursor:
+            params["cursor"] = cursor
+        result = test_app.get(
+            "/api/tweets/search", params=params, headers=headers
+        ).json()
+        pages.extend(tweet["id"] for tweet in result["tweets"])
+        cursor = result["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == found
+
+    # Операторы FTS5 в запросе ищутся как обычные слова
+    response = test_app.get(
+        "/api/tweets/search", params={"q": '"OR*'}, headers=headers
+    )
+    assert [t["id"] for t in response.json()["tweets"]] == [tweet_ids[3]]
+
+    response = test_app.get(
+        "/api/tweets/search",
+        params={"q": "поиск", "cursor": "bad"},
+        headers=headers,
+    )
+    assert response.json()["result"] is False
+
+    # Удалённый твит из поиска пропадает
+    test_app.delete(f"/api/tweets/{tweet_ids[1]}", headers=headers)
+    response = test_app.get(
+        "/api/tweets/search", params={"q": "поиск"}, headers=headers
+    )
+    assert tweet_ids[1] not in [t["id"] for t in response.json()["tweets"]]
+
+    for tweet_id in tweet_ids:
+        test_app.delete(f"/api/tweets/{tweet_id}", headers=headers)
+
+
+@pytest.mark.tweets
+def test_trending_tweets(test_app, test_users):
+    headers = {"api-key": "test"}
+    tweet_ids = [
+        test_app.post(
+            "/api/tweets", json={"tweet_data": text}, headers=headers
+        ).json()["tweet_id"]
+        for text in ("два лайка", "один лайк", "без лайков")
+    ]
+    for api_key in ("test", "test2"):
+        test_app.post(
+            f"/api/tweets/{tweet_ids[0]}/likes", headers={"api-key": api_key}
+        )
+    test_app.post(f"/api/tweets/{tweet_ids[1]}/likes", headers=headers)
+
+    def trending():
+        response = test_app.get("/api/tweets/trending", headers=headers)
+        return [
+            tweet["id"]
+            for tweet in response.json()["tweets"]
+            if tweet["id"] in tweet_ids
+        ]
+
+    assert trending() == tweet_ids[:2]
+
+    for api_key in ("test", "test2"):
+        test_app.delete(
+            f"/api/tweets/{tweet_ids[0]}/likes", headers={"api-key": api_key}
+        )
+    assert trending() == [tweet_ids[1]]
+
+    test_app.delete(f"/api/tweets/{tweet_ids[1]}", headers=headers)
+    assert trending() == []
+
+    for tweet_id in tweet_ids:
+        test_app.delete(f"/api/tweets/{tweet_id}", headers=headers)
@@ -0,0 +1,57 @@
+from benchmarks.compare import compare
+from benchmarks.driver import run_benchmark
+from benchmarks.seed import SIZES
+from sqlalchemy import create_engine, text
+
+
+def test_benchmark_run(tmp_path):
+    url = f"sqlite+aiosqlite:///{tmp_path}/bench-{{size}}.db"
+    report = run_benchmark(
+        url,
+        ["tiny"],
+        ["feed", "trending", "like", "unlike"],
+        requests=10,
+        concurrency=2,
+        warmup=2,
+    )
+
+    dataset = report["datasets"]["tiny"]
+    assert dataset["users"] == SIZES["tiny"].users
+    assert dataset["tweets"] == SIZES["tiny"].tweets
+    assert dataset["timelines"] >= dataset["tweets"]
+
+    engine = create_engine(f"sqlite:///{tmp_path}/bench-tiny.db")
+    with engine.connect() as connection:
+        assert (
+            connection.execute(
+                text("SELECT sum(count_likes) FROM tweets")
+            ).scalar()
+            == connection.execute(text("SELECT count(*) FROM likes")).scalar()
+        )
+
+    results = {result["scenario"]: result for result in report["results"]}
+    assert set(results) == {"feed", "trending", "like", "unlike"}
+    assert results["feed"]["requests"] == 10
+    assert results["feed"]["errors"] == 0
+    assert results["feed"]["p50_ms"] <= results["feed"]["p99_ms"]
+
+
+def test_benchmark_compare():
+    def report(p99, rps):
+        return {
+            "results": [
+                {
+                    "dataset": "tiny",
+                    "scenario": "feed",
+                    "p50_ms": 1.0,
+                    "p99_ms": p99,
+                    "rps": rps,
+                }
+            ]
+        }
+
+    _, regressions = compare(report(10.0, 100), report(10.5, 98))
+    assert regressions == []
+
+    _, regressions = compare(report(10.0, 100), report(20.0, 50))
+    assert regressions == ["tiny/feed p99_ms", "tiny/feed rps"]
@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import httpx
+from benchmarks.replay import load_capture, replay
+from core import settings
+from core.capture import (
+    CaptureWriter,
+    capture_writer,
+    dropped_requests,
+    user_tag,
+)
+from main import app
+
+
+def test_capture_and_replay(test_app, test_users, tmp_path, monkeypatch):
+    path = tmp_path / "requests.jsonl"
+    monkeypatch.setattr(capture_writer, "path", str(path))
+    monkeypatch.setattr(capture_writer, "enabled", True)
+    monkeypatch.setattr(settings, "CAPTURE_SAMPLE_RATE", 1.0)
+
+    headers = {"api-key": "test"}
+    test_app.get("/api/tweets?limit=5", headers=headers)
+    test_app.post("/api/users/2/follow", headers=headers)
+    test_app.delete("/api/users/2/follow", headers=headers)
+    test_app.get("/metrics")
+    asyncio.run(capture_writer.flush())
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(record["method"], record["path"]) for record in records] == [
+        ("GET", "/api/tweets"),
+        ("POST", "/api/users/2/follow"),
+        ("DELETE", "/api/users/2/follow"),
+    ]
+    assert records[0]["query"] == "limit=5"
+    assert records[0]["status"] == 200
+    assert records[0]["user"] == user_tag("test")
+    assert "api-key" not in records[0]["headers"]
+    assert '"test"' not in path.read_text()
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://replay"
+        ) as client:
+            return await replay(
+                client, load_capture(str(path)), speed=0, api_keys=["test"]
+            )
+
+    monkeypatch.setattr(capture_writer, "enabled", False)
+    report = asyncio.run(run())
+    assert report["total"]["requests"] == 3
+    assert report["total"]["errors"] == 0
+    assert set(report["routes"]) == {
+        "GET /api/tweets",
+        "POST /api/users/{id}/follow",
+        "DELETE /api/users/{id}/follow",
+    }
+
+
+def test_capture_drops_when_full(tmp_path):
+    writer = CaptureWriter(
+        str(tmp_path / "requests.jsonl"),
+        enabled=True,
+        flush_interval=1,
+        max_pending=1,
+    )
+    dropped = dropped_requests.value
+
+    writer.add({"path": "/api/a"})
+    writer.add({"path": "/api/b"})
+    asyncio.run(writer.flush())
+
+    assert (tmp_path / "requests.jsonl").read_text() == '{"path":"/api/a"}\n'
+    assert dropped_requests.value == dropped + 1
@@ -0,0 +1,284 @@
+import asyncio
+import hashlib
+import os
+from io import BytesIO
+
+from core import settings
+from core.media import file_lock, media_dir
+from db.jobs import FAILED, JobRunner, job_runner
+from db.models import Job, Media
+from sqlalchemy import delete, insert
+
+
+def make_runner(session_factory, **options):
+    return JobRunner(
+        session_factory=session_factory,
+        **{
+            "concurrency": 2,
+            "poll_interval": 0.05,
+            "max_attempts": 3,
+            "retry_delay": 0,
+            "retry_max_delay": 0,
+            "lease": 60,
+            **options,
+        },
+    )
+
+
+def clear_jobs(test_db):
+    test_db.execute(delete(Job))
+    test_db.commit()
+
+
+def test_job_enqueued_with_transaction(test_db, test_async_session):
+    clear_jobs(test_db)
+    runner = make_runner(test_async_session)
+    done = []
+
+    @runner.handler("record")
+    async def record(db, payload):
+        done.append(payload["value"])
+
+    async def run():
+        async with test_async_session() as db:
+            await runner.enqueue(db, "record", {"value": "rolled back"})
+            await db.rollback()
+        async with test_async_session() as db:
+            await runner.enqueue(db, "record", {"value": "committed"})
+            await runner.enqueue(db, "record", {"value": "later"}, delay=60)
+            await db.commit()
+        return await runner.run_pending()
+
+    assert asyncio.run(run()) == 1
+    assert done == ["committed"]
+    assert [job.payload for job in test_db.query(Job)] == [{"value": "later"}]
+    clear_jobs(test_db)
+
+
+def test_job_retries(test_db, test_async_session):
+    clear_jobs(test_db)
+    runner = make_runner(test_async_session)
+    calls = []
+
+    @runner.handler("flaky")
+    async def flaky(db, payload):
+        calls.append(payload)
+        if len(calls) < 2:
+            raise RuntimeError("временная ошибка")
+
+    @runner.handler("broken")
+    async def broken(db, payload):
+        raise RuntimeError("всегда ошибка")
+
+    async def run():
+        async with test_async_session() as db:
+            await runner.enqueue(db, "flaky", {})
+            await runner.enqueue(db, "broken", {})
+            await db.commit()
+        return await runner.run_pending()
+
+    # flaky: две попытки, broken: три попытки до статуса failed
+    assert asyncio.run(run()) == 5
+    assert len(calls) == 2
+    [job] = test_db.query(Job).all()
+    assert (job.kind, job.status, job.attempts) == ("broken", FAILED, 3)
+    assert "всегда ошибка" in job.last_error
+    clear_jobs(test_db)
+
+
+def test_job_backoff(test_db, test_async_session):
+    clear_jobs(test_db)
+    runner = make_runner(
+        test_async_session, retry_delay=10, retry_max_delay=15
+    )
+
+    @runner.handler("broken")
+    async def broken(db, payload):
+        raise RuntimeError
+
+    async def run():
+        async with test_async_session() as db:
+            await runner.enqueue(db, "broken", {})
+            await db.commit()
+        return await runner.run_pending()
+
+    assert asyncio.run(run()) == 1
+    job = test_db.query(Job).one()
+    assert job.attempts == 1
+    assert job.locked_until is None
+    assert 9 <= (job.run_at - job.created_at).total_seconds() <= 11
+    clear_jobs(test_db)
+
+
+def test_job_runner_background(test_db, test_async_session):
+    clear_jobs(test_db)
+    runner = make_runner(test_async_session, concurrency=1)
+    done = asyncio.Event()
+
+    @runner.handler("signal")
+    async def signal(db, payload):
+        done.set()
+
+    async def run():
+        await runner.start()
+        async with test_async_session() as db:
+            await runner.enqueue(db, "signal", {})
+            await db.commit()
+        runner.wake()
+        await asyncio.wait_for(done.wait(), 5)
+        await runner.stop()
+
+    asyncio.run(run())
+    assert test_db.query(Job).count() == 0
+
+
+def test_deferred_fan_out(
+    test_app, test_db, test_users, test_async_session, monkeypatch
+):
+    clear_jobs(test_db)
+    monkeypatch.setattr(settings, "JOBS_FANOUT_INLINE_LIMIT", -1)
+    monkeypatch.setattr(job_runner, "session_factory", test_async_session)
+
+    def feed(api_key):
+        response = test_app.get("/api/tweets", headers={"api-key": api_key})
+        return [tweet["id"] for tweet in response.json()["tweets"]]
+
+    test_app.post("/api/users/1/follow", headers={"api-key": "test2"})
+    response = test_app.post(
+        "/api/tweets",
+        json={"tweet_data": "deferred"},
+        headers={"api-key": "test"},
+    )
+    tweet_id = response.json()["tweet_id"]
+
+    # Автор видит твит сразу, подписчик - после выполнения задачи
+    assert tweet_id in feed("test")
+    assert tweet_id not in feed("test2")
+    assert asyncio.run(job_runner.run_pending()) == 1
+    assert tweet_id in feed("test2")
+
+    test_app.delete("/api/users/1/follow", headers={"api-key": "test2"})
+    test_app.delete(f"/api/tweets/{tweet_id}", headers={"api-key": "test"})
+
+
+def test_deferred_fan_out_after_follow(
+    test_app, test_db, test_users, test_async_session, monkeypatch
+):
+    clear_jobs(test_db)
+    monkeypatch.setattr(settings, "JOBS_FANOUT_INLINE_LIMIT", -1)
+    monkeypatch.setattr(job_runner, "session_factory", test_async_session)
+
+    tweet_id = test_app.post(
+        "/api/tweets",
+        json={"tweet_data": "followed late"},
+        headers={"api-key": "test"},
+    ).json()["tweet_id"]
+    # Подписка между постановкой задачи и её выполнением уже добавила
+    # твит в ленту: задача не должна падать на повторной вставке
+    test_app.post("/api/users/1/follow", headers={"api-key": "test2"})
+    assert asyncio.run(job_runner.run_pending()) == 1
+    assert test_db.query(Job).count() == 0
+
+    response = test_app.get("/api/tweets", headers={"api-key": "test2"})
+    assert tweet_id in [tweet["id"] for tweet in response.json()["tweets"]]
+
+    test_app.delete("/api/users/1/follow", headers={"api-key": "test2"})
+    test_app.delete(f"/api/tweets/{tweet_id}", headers={"api-key": "test"})
+
+
+def test_delete_tweet_purges_media(
+    test_app, test_db, test_users, test_async_session, monkeypatch
+):
+    clear_jobs(test_db)
+    monkeypatch.setattr(job_runner, "session_factory", test_async_session)
+    headers = {"api-key": "test"}
+
+    media_ids = [
+        test_app.post(
+            "/api/medias",
+            headers=headers,
+            files={"file": ("a.jpg", BytesIO(content), "image/jpeg")},
+        ).json()["media_id"]
+        for content in (b"purge me", b"shared", b"uploaded again")
+    ]
+    tweet_id = test_app.post(
+        "/api/tweets",
+        json={"tweet_data": "with media", "tweet_media_ids": media_ids},
+        headers=headers,
+    ).json()["tweet_id"]
+    # Тот же файл, загруженный другим пользователем, удалять нельзя
+    other_media_id = test_app.post(
+        "/api/medias",
+        headers={"api-key": "test2"},
+        files={"file": ("b.jpg", BytesIO(b"shared"), "image/jpeg")},
+    ).json()["media_id"]
+
+    test_app.delete(f"/api/tweets/{tweet_id}", headers=headers)
+    assert test_db.query(Job).count() == 1
+    assert test_db.query(Media).filter(Media.id.in_(media_ids)).count() == 0
+
+    def filename(content):
+        return hashlib.sha256(content).hexdigest() + ".jpg"
+
+    def stored(content):
+        return os.path.exists(os.path.join(media_dir, filename(content)))
+
+    # Повторная загрузка до выполнения задачи получает новую свободную
+    # запись, и её файл задача не удаляет
+    reuploaded_id = test_app.post(
+        "/api/medias",
+        headers=headers,
+        files={"file": ("c.jpg", BytesIO(b"uploaded again"), "image/jpeg")},
+    ).json()["media_id"]
+    reuploaded = test_db.get(Media, reuploaded_id)
+    assert reuploaded.image_url == filename(b"uploaded again")
+    assert reuploaded.tweet_id is None
+    assert asyncio.run(job_runner.run_pending()) == 1
+    assert test_db.get(Media, other_media_id) is not None
+
+    assert not stored(b"purge me")
+    assert stored(b"shared")
+    assert stored(b"uploaded again")
+
+    test_db.execute(
+        delete(Media).where(Media.id.in_([other_media_id, reuploaded_id]))
+    )
+    test_db.commit()
+    for content in (b"shared", b"uploaded again"):
+        os.remove(os.path.join(media_dir, filename(content)))
+
+
+def test_purge_waits_for_upload(test_db, test_users, test_async_session):
+    clear_jobs(test_db)
+    runner = make_runner(test_async_session)
+    runner.handlers["purge_media"] = job_runner.handlers["purge_media"]
+    filename = "locked-upload.jpg"
+    path = os.path.join(media_dir, filename)
+
+    async def run():
+        with open(path, "wb") as image:
+            image.write(b"locked")
+        async with test_async_session() as db:
+            await runner.enqueue(db, "purge_media", {"filenames": [filename]})
+            await db.commit()
+
+        # Загрузка держит блокировку файла до commit своей записи медиа
+        async with file_lock(filename):
+            task = asyncio.create_task(runner.run_pending())
+            await asyncio.sleep(0.05)
+            assert not task.done()
+            async with test_async_session() as db:
+                await db.execute(
+                    insert(Media).values(
+                        image_url=filename, user_id=test_users[0].id
+                    )
+                )
+                await db.commit()
+        assert await task == 1
+
+    asyncio.run(run())
+    assert os.path.exists(path)
+
+    test_db.execute(delete(Media).where(Media.image_url == filename))
+    test_db.commit()
+    os.remove(path)
@@ -0,0 +1,152 @@
+from io import BytesIO
+from types import SimpleNamespace
+
+from core import limits
+from core.limits import (
+    READ,
+    UPLOAD,
+    WRITE,
+    Budget,
+    LoadShedder,
+    RateLimiter,
+    load_shedder,
+    rate_limiter,
+    request_budget,
+)
+from core.security import api_key_cache
+from db.pool import recent_pool_wait
+
+
+def test_rate_limiter_token_bucket(monkeypatch):
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(
+        limits, "time", SimpleNamespace(monotonic=lambda: clock.now)
+    )
+    limiter = RateLimiter(
+        budgets={READ: Budget(2, 3), WRITE: Budget(0, 1)},
+        max_keys=2,
+        enabled=True,
+    )
+
+    decisions = [limiter.acquire("a", READ) for _ in range(4)]
+    assert [decision.allowed for decision in decisions] == [
+        True,
+        True,
+        True,
+        False,
+    ]
+    assert [decision.remaining for decision in decisions] == [2, 1, 0, 0]
+    assert decisions[-1].retry_after == 0.5
+
+    # Другой ключ и бюджет без лимита не затронуты
+    assert limiter.acquire("b", READ).allowed
+    assert all(limiter.acquire("a", WRITE).allowed for _ in range(10))
+
+    clock.now += 0.5
+    assert limiter.acquire("a", READ).allowed
+    assert not limiter.acquire("a", READ).allowed
+
+    # Корзина не копит больше burst токенов
+    clock.now += 60
+    assert [limiter.acquire("a", READ).allowed for _ in range(4)] == [
+        True,
+        True,
+        True,
+        False,
+    ]
+
+    # Давно не использованная корзина вытесняется и создаётся полной
+    limiter.acquire("c", READ)
+    assert len(limiter) == 2
+    assert limiter.acquire("b", READ).remaining == 2
+
+    limiter.enabled = False
+    assert all(limiter.acquire("a", READ).allowed for _ in range(10))
+
+
+def test_request_budget():
+    assert request_budget("GET", "/api/tweets") == READ
+    assert request_budget("POST", "/api/medias") == UPLOAD
+    assert request_budget("POST", "/api/tweets") == WRITE
+    assert request_budget("DELETE", "/api/tweets/1/likes") == WRITE
+
+
+def test_load_shedder(monkeypatch):
+    shedder = LoadShedder(
+        max_concurrency=3, min_concurrency=1, pool_wait=0.5, retry_after=1
+    )
+    assert [shedder.admit() for _ in range(4)] == [True, True, True, False]
+
+    monkeypatch.setattr(recent_pool_wait, "seconds", 1.0)
+    assert shedder.overloaded
+    shedder.release()
+    shedder.release()
+    assert shedder.in_flight == 1
+    assert not shedder.admit()
+
+    monkeypatch.setattr(recent_pool_wait, "seconds", 0.1)
+    assert shedder.admit()
+    assert shedder.in_flight == 2
+
+
+def test_rate_limit_endpoint(test_app, test_users, monkeypatch):
+    monkeypatch.setitem(rate_limiter.budgets, UPLOAD, Budget(0.01, 1))
+    monkeypatch.setitem(rate_limiter.budgets, READ, Budget(0.01, 1))
+    monkeypatch.setattr(rate_limiter, "enabled", True)
+
+    def upload(api_key):
+        return test_app.post(
+            "/api/medias",
+            headers={"api-key": api_key},
+            files={"file": ("a.jpg", BytesIO(b"limited"), "image/jpeg")},
+        )
+
+    assert upload("test").json()["result"] is True
+    response = upload("test")
+    assert response.status_code == 429
+    assert response.json() == {
+        "result": False,
+        "error_type": "TooManyRequests",
+        "error_message": "Превышен лимит запросов, повторите через 100 с",
+    }
+    assert response.headers["retry-after"] == "100"
+    assert response.headers["x-ratelimit-limit"] == "1"
+    assert response.headers["x-ratelimit-remaining"] == "0"
+
+    # Чтения и загрузки другого пользователя считаются отдельно
+    response = test_app.get("/api/users/me", headers={"api-key": "test"})
+    assert response.json()["result"] is True
+    assert upload("test2").json()["result"] is True
+    assert load_shedder.in_flight == 0
+
+    # Неизвестные api-key делят корзину адреса клиента
+    response = test_app.get("/api/users/me", headers={"api-key": "bogus1"})
+    assert response.json()["result"] is False
+    response = test_app.get("/api/users/me", headers={"api-key": "bogus2"})
+    assert response.status_code == 429
+
+    # Ключ, выпавший из кэша авторизации, находится в БД и получает свою
+    # корзину, а не исчерпанную корзину адреса
+    api_key_cache.clear()
+    response = test_app.get("/api/users/me", headers={"api-key": "test2"})
+    assert response.json()["result"] is True
+    assert api_key_cache.peek("test2") is not None
+
+
+def test_load_shedding_endpoint(test_app, test_users, monkeypatch):
+    monkeypatch.setattr(recent_pool_wait, "seconds", 10.0)
+    monkeypatch.setattr(load_shedder, "min_concurrency", 1)
+    monkeypatch.setattr(load_shedder, "in_flight", 1)
+
+    response = test_app.get("/api/tweets", headers={"api-key": "test"})
+    assert response.status_code == 503
+    assert response.json()["error_type"] == "ServiceUnavailable"
+    assert response.headers["retry-after"] == str(load_shedder.retry_after)
+
+    # Метрики не ограничиваются
+    assert test_app.get("/metrics").status_code == 200
+
+    monkeypatch.setattr(recent_pool_wait, "seconds", 0.0)
+    response = test_app.get("/api/tweets", headers={"api-key": "test"})
+    assert response.json()["result"] is True
+    assert load_shedder.in_flight == 1
@@ -0,0 +1,104 @@
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from db.database import Base
+from db.search import include_name
+from sqlalchemy import create_engine, inspect, text
+
+# Схема до появления миграций (Base.metadata.create_all из первой версии)
+LEGACY_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(50) "
+    "NOT NULL, api_key VARCHAR UNIQUE)",
+    "CREATE TABLE tweets (id INTEGER PRIMARY KEY, text VARCHAR NOT NULL, "
+    "user_id INTEGER REFERENCES users (id), count_likes INTEGER)",
+    "CREATE TABLE likes (id INTEGER PRIMARY KEY, "
+    "user_id INTEGER REFERENCES users (id), "
+    "tweet_id INTEGER REFERENCES tweets (id))",
+    "CREATE TABLE media (id INTEGER PRIMARY KEY, image_url VARCHAR, "
+    "tweet_id INTEGER REFERENCES tweets (id), "
+    "user_id INTEGER REFERENCES users (id))",
+    "CREATE TABLE subscribers (id INTEGER PRIMARY KEY, "
+    "subscribers_id INTEGER REFERENCES users (id), "
+    "subscriber_id INTEGER REFERENCES users (id))",
+    "CREATE TABLE subscriptions (id INTEGER PRIMARY KEY, "
+    "subscriptions_id INTEGER REFERENCES users (id), "
+    "subscriber_id INTEGER REFERENCES users (id))",
+]
+
+
+def test_upgrade_matches_models(tmp_path, alembic_config):
+    path = tmp_path / "fresh.db"
+    command.upgrade(alembic_config(f"sqlite+aiosqlite:///{path}"), "head")
+
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.connect() as connection:
+        context = MigrationContext.configure(
+            connection, opts={"include_name": include_name}
+        )
+        diff = compare_metadata(context, Base.metadata)
+
+    assert diff == []
+
+
+def test_downgrade_to_base(tmp_path, alembic_config):
+    config = alembic_config(f"sqlite+aiosqlite:///{tmp_path / 'base.db'}")
+    command.upgrade(config, "head")
+    command.downgrade(config, "base")
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'base.db'}")
+    assert inspect(engine).get_table_names() == ["alembic_version"]
+
+
+def test_upgrade_adopts_legacy_database(tmp_path, alembic_config):
+    path = tmp_path / "legacy.db"
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(
+            text(
+                "INSERT INTO users (id, username, api_key) "
+                "VALUES (1, 'a', 'a'), (2, 'b', 'b')"
+            )
+        )
+        connection.execute(
+            text("INSERT INTO tweets VALUES (1, 'hello', 2, 2)")
+        )
+        connection.execute(
+            text("INSERT INTO likes (user_id, tweet_id) VALUES (1, 1), (1, 1)")
+        )
+        for table, follower in (
+            ("subscriptions", "subscriptions_id"),
+            ("subscribers", "subscribers_id"),
+        ):
+            connection.execute(
+                text(
+                    f"INSERT INTO {table} ({follower}, subscriber_id) "
+                    f"VALUES (1, 2), (1, 2)"
+                )
+            )
+
+    command.upgrade(alembic_config(f"sqlite+aiosqlite:///{path}"), "head")
+
+    with engine.connect() as connection:
+        assert connection.execute(
+            text("SELECT follower_id, followee_id FROM follows")
+        ).all() == [(1, 2)]
+        assert connection.execute(
+            text("SELECT id, followers_count FROM users ORDER BY id")
+        ).all() == [(1, 0), (2, 1)]
+        assert connection.execute(
+            text("SELECT count(*), max(count_likes) FROM likes, tweets")
+        ).one() == (1, 1)
+        assert connection.execute(
+            text("SELECT user_id, tweet_id FROM timelines ORDER BY user_id")
+        ).all() == [(1, 1), (2, 1)]
+
+        tables = inspect(connection).get_table_names()
+        assert "subscriptions" not in tables
+        assert "subscribers" not in tables
+
+        indexes = {
+            index["name"] for index in inspect(connection).get_indexes("likes")
+        }
+        assert {"uq_likes_user_tweet", "ix_likes_tweet_id"} <= indexes
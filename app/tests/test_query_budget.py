@@ -0,0 +1,295 @@
+import asyncio
+from contextlib import contextmanager
+from io import BytesIO
+
+import pytest
+from api.feed import tweet_cache
+from benchmarks.seed import DatasetSize, api_key, migrate, seed_database
+from core.security import api_key_cache
+from db.database import get_db, get_read_db
+from db.like_buffer import like_buffer
+from fastapi.testclient import TestClient
+from main import app
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+# Набор побольше, чем в test_app: у твитов десятки лайков, у
+# пользователей десятки подписок, так что ленивые загрузки по строкам
+# сразу вылезут за бюджет
+BUDGET_DATASET = DatasetSize("budget", 300, 3000, 20, 15, 0.5)
+
+USER = 2
+OTHER_USER = 3
+
+
+@pytest.fixture(scope="module")
+def budget_engine(tmp_path_factory):
+    url = "sqlite+aiosqlite:///{}".format(
+        tmp_path_factory.mktemp("budget") / "budget.db"
+    )
+    migrate(url)
+    seed_database(url, BUDGET_DATASET)
+    engine = create_async_engine(url, poolclass=NullPool)
+    yield engine
+
+
+@pytest.fixture(scope="module")
+def budget_client(budget_engine):
+    factory = async_sessionmaker(
+        bind=budget_engine, autoflush=False, expire_on_commit=False
+    )
+
+    async def override_get_db():
+        async with factory() as db:
+            yield db
+
+    overrides = dict(app.dependency_overrides)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    yield TestClient(app, base_url="http://127.0.0.1:8000")
+    app.dependency_overrides = overrides
+
+
+@contextmanager
+def recorded_statements(engine):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+# Функция выполняет запрос с пустыми кэшами (худший случай) и падает,
+# если он сделал больше запросов к БД, чем budget, печатая эти запросы
+def assert_budget(client, engine, budget, method, url, **kwargs):
+    api_key_cache.clear()
+    tweet_cache.clear()
+
+    with recorded_statements(engine) as statements:
+        response = client.request(method, url, **kwargs)
+
+    assert response.status_code == 200
+    assert response.json().get("result") is not False, response.json()
+    if len(statements) > budget:
+        pytest.fail(
+            "{} {}: {} запросов к БД при бюджете {}:\n{}".format(
+                method,
+                url,
+                len(statements),
+                budget,
+                "\n".join(
+                    f"{number}. {statement}"
+                    for number, statement in enumerate(statements, 1)
+                ),
+            ),
+            pytrace=False,
+        )
+    return response
+
+
+def headers(user_id=USER):
+    return {"api-key": api_key(user_id)}
+
+
+# Лента: api-key, id ленты, твиты с авторами, медиа, лайки с пользователями.
+# Не зависит от размера страницы и числа лайков.
+@pytest.mark.parametrize("limit", [1, 50, 200])
+def test_feed_budget(budget_client, budget_engine, limit):
+    response = assert_budget(
+        budget_client,
+        budget_engine,
+        5,
+        "GET",
+        f"/api/tweets?limit={limit}",
+        headers=headers(),
+    )
+    tweets = response.json()["tweets"]
+    assert len(tweets) == limit
+    assert any(tweet["likes"] for tweet in tweets)
+
+
+def test_feed_next_page_budget(budget_client, budget_engine):
+    first = budget_client.get("/api/tweets?limit=20", headers=headers())
+    cursor = first.json()["next_cursor"]
+
+    assert_budget(
+        budget_client,
+        budget_engine,
+        5,
+        "GET",
+        f"/api/tweets?limit=20&cursor={cursor}",
+        headers=headers(),
+    )
+
+
+def test_user_me_budget(budget_client, budget_engine):
+    response = assert_budget(
+        budget_client,
+        budget_engine,
+        3,
+        "GET",
+        "/api/users/me",
+        headers=headers(1),
+    )
+    assert len(response.json()["user"]["followers"]) > 20
+
+
+def test_user_by_id_budget(budget_client, budget_engine):
+    assert_budget(budget_client, budget_engine, 3, "GET", "/api/users/1")
+
+
+def test_write_budgets(budget_client, budget_engine):
+    client, engine = budget_client, budget_engine
+
+    media_ids = [
+        client.post(
+            "/api/medias",
+            headers=headers(),
+            files={"file": ("b.jpg", BytesIO(content), "image/jpeg")},
+        ).json()["media_id"]
+        for content in (b"budget one", b"budget two")
+    ]
+    assert_budget(
+        client,
+        engine,
+        3,
+        "POST",
+        "/api/medias",
+        headers=headers(),
+        files={"file": ("b.jpg", BytesIO(b"budget three"), "image/jpeg")},
+    )
+
+    response = assert_budget(
+        client,
+        engine,
+        4,
+        "POST",
+        "/api/tweets",
+        headers=headers(),
+        json={"tweet_data": "budget", "tweet_media_ids": media_ids},
+    )
+    tweet_id = response.json()["tweet_id"]
+
+    # 50 твитов без медиа: api-key, INSERT, раскладка по лентам
+    assert_budget(
+        client,
+        engine,
+        3,
+        "POST",
+        "/api/tweets/bulk",
+        headers=headers(),
+        json={"tweets": [{"tweet_data": "bulk"}] * 50},
+    )
+
+    for user_id in range(10, 40):
+        client.post(f"/api/tweets/{tweet_id}/likes", headers=headers(user_id))
+    assert_budget(
+        client,
+        engine,
+        3,
+        "POST",
+        f"/api/tweets/{tweet_id}/likes",
+        headers=headers(OTHER_USER),
+    )
+    assert_budget(
+        client,
+        engine,
+        3,
+        "DELETE",
+        f"/api/tweets/{tweet_id}/likes",
+        headers=headers(OTHER_USER),
+    )
+
+    # Удаление твита с медиа и 30 лайками: лайки удаляются одним запросом,
+    # медиа - отложенной задачей
+    assert_budget(
+        client,
+        engine,
+        7,
+        "DELETE",
+        f"/api/tweets/{tweet_id}",
+        headers=headers(),
+    )
+
+
+# С буфером лайков счётчик не обновляется UPDATE, а читается по первичному
+# ключу вместе с автором и временем создания для рейтинга и потока:
+# api-key, INSERT/DELETE лайка, SELECT твита
+def test_like_buffer_budgets(budget_client, budget_engine, monkeypatch):
+    client, engine = budget_client, budget_engine
+    monkeypatch.setattr(like_buffer, "enabled", True)
+    monkeypatch.setattr(
+        like_buffer,
+        "session_factory",
+        async_sessionmaker(bind=engine, expire_on_commit=False),
+    )
+
+    for method in ("POST", "DELETE"):
+        assert_budget(
+            client,
+            engine,
+            3,
+            method,
+            "/api/tweets/2000/likes",
+            headers=headers(OTHER_USER),
+        )
+    asyncio.run(like_buffer.flush())
+    assert like_buffer.backlog == 0
+
+
+def test_follow_budgets(budget_client, budget_engine):
+    client, engine = budget_client, budget_engine
+    client.delete("/api/users/1/follow", headers=headers(OTHER_USER))
+
+    assert_budget(
+        client,
+        engine,
+        5,
+        "POST",
+        "/api/users/1/follow",
+        headers=headers(OTHER_USER),
+    )
+    assert_budget(
+        client,
+        engine,
+        4,
+        "DELETE",
+        "/api/users/1/follow",
+        headers=headers(OTHER_USER),
+    )
+
+
+def test_search_budget(budget_client, budget_engine):
+    response = assert_budget(
+        budget_client,
+        budget_engine,
+        5,
+        "GET",
+        "/api/tweets/search?q=user1&limit=50",
+        headers=headers(),
+    )
+    assert len(response.json()["tweets"]) == 50
+
+
+# Рейтинг популярного берётся из памяти: api-key и отрисовка твитов
+def test_trending_budget(budget_client, budget_engine):
+    for tweet_id in range(2990, 3000):
+        budget_client.post(
+            f"/api/tweets/{tweet_id}/likes", headers=headers(OTHER_USER)
+        )
+
+    response = assert_budget(
+        budget_client,
+        budget_engine,
+        4,
+        "GET",
+        "/api/tweets/trending?limit=50",
+        headers=headers(),
+    )
+    assert len(response.json()["tweets"]) >= 10
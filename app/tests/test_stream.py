@@ -0,0 +1,263 @@
+import asyncio
+
+import httpx
+import orjson
+import pytest
+from core.limits import load_shedder
+from core.pubsub import PubSubHub, StreamFull
+from main import app
+
+
+def make_hub(history_size=10, queue_size=3, max_subscribers=10):
+    return PubSubHub(
+        history_size=history_size,
+        queue_size=queue_size,
+        max_subscribers=max_subscribers,
+    )
+
+
+def frames(subscriber):
+    items = []
+    while not subscriber.queue.empty():
+        items.append(subscriber.queue.get_nowait())
+    return items
+
+
+def test_hub_delivers_to_followers():
+    async def run():
+        hub = make_hub()
+        reader, _ = hub.subscribe(1, [1, 2])
+        other, _ = hub.subscribe(3, [3])
+
+        hub.publish("tweet", 2, {"id": 10})
+        hub.publish("likes", 4, {"id": 11, "count_likes": 1})
+
+        [frame] = frames(reader)
+        assert frame.startswith(b"id: %s-1\n" % hub.epoch.encode())
+        assert b"event: tweet\ndata: " + orjson.dumps({"id": 10}) in frame
+        assert frames(other) == []
+
+        hub.follow(1, 4)
+        hub.unfollow(1, 2)
+        hub.unfollow(1, 1)
+        hub.publish("tweet", 4, {"id": 12})
+        hub.publish("tweet", 2, {"id": 13})
+        hub.publish("tweet", 1, {"id": 14})
+        assert len(frames(reader)) == 2
+
+        hub.unsubscribe(reader)
+        hub.unsubscribe(reader)
+        assert hub.subscribers == 1
+
+    asyncio.run(run())
+
+
+def test_hub_serializes_lazily():
+    async def run():
+        hub = make_hub(max_subscribers=2)
+        start = hub.last_event_id
+        calls = []
+
+        def data():
+            calls.append(1)
+            return {"id": 1}
+
+        # Без подписчиков автора событие не сериализуется, а при досылке
+        # кадр собирается один раз
+        hub.publish("tweet", 1, data)
+        assert calls == []
+        for user_id in (2, 3):
+            _, backlog = hub.subscribe(user_id, [1], start)
+            assert b"data: " + orjson.dumps({"id": 1}) in backlog[0]
+        assert calls == [1]
+
+        # Предел подключений проверяется при самой подписке
+        with pytest.raises(StreamFull):
+            hub.subscribe(4, [1])
+        assert hub.subscribers == 2
+
+    asyncio.run(run())
+
+
+def test_hub_drops_slow_subscriber():
+    async def run():
+        hub = make_hub(queue_size=2)
+        slow, _ = hub.subscribe(1, [1])
+        fast, _ = hub.subscribe(2, [1])
+
+        for tweet_id in range(3):
+            hub.publish("tweet", 1, {"id": tweet_id})
+            frames(fast)
+
+        assert slow.closed
+        assert len(frames(slow)) == 2
+        assert hub.subscribers == 1
+        assert not fast.closed
+
+    asyncio.run(run())
+
+
+def test_hub_resume():
+    async def run():
+        hub = make_hub(history_size=3)
+        start = hub.last_event_id
+        for tweet_id in range(3):
+            hub.publish("tweet", tweet_id % 2, {"id": tweet_id})
+
+        _, backlog = hub.subscribe(1, [0], start)
+        assert [
+            orjson.loads(frame.split(b"data: ")[1]) for frame in backlog
+        ] == [{"id": 0}, {"id": 2}]
+
+        # Буфер ушёл вперёд, чужой или испорченный id: начать заново
+        hub.publish("tweet", 0, {"id": 3})
+        for last_event_id in (start, "other-1", "garbage"):
+            _, backlog = hub.subscribe(1, [0], last_event_id)
+            assert len(backlog) == 1
+            assert b"event: reset" in backlog[0]
+
+    asyncio.run(run())
+
+
+# Клиент потока: запрос к ASGI-приложению в том же event loop, что и
+# запросы, которые публикуют события
+class StreamClient:
+    def __init__(self, api_key, last_event_id=None):
+        headers = [(b"host", b"test"), (b"api-key", api_key.encode())]
+        if last_event_id:
+            headers.append((b"last-event-id", last_event_id.encode()))
+        self.scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/api/stream",
+            "raw_path": b"/api/stream",
+            "query_string": b"",
+            "root_path": "",
+            "headers": headers,
+            "client": ("127.0.0.1", 1),
+            "server": ("test", 80),
+        }
+        self.messages = asyncio.Queue()
+        self.disconnected = asyncio.Event()
+        self.requested = False
+        self.buffer = b""
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        await self.messages.put(message)
+
+    async def __aenter__(self):
+        self.task = asyncio.create_task(
+            app(self.scope, self.receive, self.send)
+        )
+        start = await asyncio.wait_for(self.messages.get(), 5)
+        assert start["status"] == 200
+        assert (b"content-type", b"text/event-stream; charset=utf-8") in (
+            start["headers"]
+        )
+        return self
+
+    async def __aexit__(self, *args):
+        self.disconnected.set()
+        await asyncio.wait_for(self.task, 5)
+
+    # Следующее событие: (id, тип, данные); пинги пропускаются
+    async def event(self):
+        while True:
+            if b"\n\n" in self.buffer:
+                frame, self.buffer = self.buffer.split(b"\n\n", 1)
+                fields = dict(
+                    line.split(b": ", 1)
+                    for line in frame.split(b"\n")
+                    if b": " in line and not line.startswith(b":")
+                )
+                if b"event" in fields:
+                    return (
+                        fields[b"id"].decode(),
+                        fields[b"event"].decode(),
+                        orjson.loads(fields[b"data"]),
+                    )
+                continue
+            message = await asyncio.wait_for(self.messages.get(), 5)
+            self.buffer += message.get("body", b"")
+
+
+def test_stream_endpoint(test_app, test_users):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            author = {"api-key": "test"}
+            async with StreamClient("test") as stream:
+                # Открытый поток не занимает место в пределе нагрузки
+                assert load_shedder.in_flight == 0
+                response = await client.post(
+                    "/api/tweets",
+                    json={"tweet_data": "в поток"},
+                    headers=author,
+                )
+                tweet_id = response.json()["tweet_id"]
+                first_id, event, data = await stream.event()
+                assert event == "tweet"
+                assert data["id"] == tweet_id
+                assert data["content"] == "в поток"
+                assert data["author"]["name"] == "user1"
+
+                await client.post(
+                    f"/api/tweets/{tweet_id}/likes",
+                    headers={"api-key": "test2"},
+                )
+                _, event, data = await stream.event()
+                assert (event, data) == (
+                    "likes",
+                    {"id": tweet_id, "count_likes": 1},
+                )
+
+                await client.delete(f"/api/tweets/{tweet_id}", headers=author)
+                _, event, data = await stream.event()
+                assert (event, data) == ("delete", {"id": tweet_id})
+
+            # Переподключение досылает пропущенное после Last-Event-ID
+            async with StreamClient("test", first_id) as stream:
+                assert (await stream.event())[1] == "likes"
+                assert (await stream.event())[1] == "delete"
+
+            async with StreamClient("test", "unknown-1") as stream:
+                assert (await stream.event())[1] == "reset"
+
+            # Твиты автора приходят только после подписки на него
+            reader = {"api-key": "test2"}
+            user_id = (
+                await client.get("/api/users/me", headers=author)
+            ).json()["user"]["id"]
+            await client.delete(f"/api/users/{user_id}/follow", headers=reader)
+            async with StreamClient("test2") as stream:
+                tweet_ids = []
+                for text in ("до подписки", "после подписки"):
+                    response = await client.post(
+                        "/api/tweets",
+                        json={"tweet_data": text},
+                        headers=author,
+                    )
+                    tweet_ids.append(response.json()["tweet_id"])
+                    await client.post(
+                        f"/api/users/{user_id}/follow", headers=reader
+                    )
+                _, event, data = await stream.event()
+                assert (event, data["id"]) == ("tweet", tweet_ids[1])
+
+            await client.delete(f"/api/users/{user_id}/follow", headers=reader)
+            for tweet_id in tweet_ids:
+                await client.delete(f"/api/tweets/{tweet_id}", headers=author)
+
+    asyncio.run(run())
@@ -0,0 +1,97 @@
+import asyncio
+from datetime import timedelta
+
+from db.models import Like, Tweet, User, utcnow
+from db.trending import TrendingBoard
+from sqlalchemy import delete
+
+
+def make_board(session_factory=None, capacity=3):
+    return TrendingBoard(
+        session_factory=session_factory,
+        capacity=capacity,
+        window=24 * 60 * 60,
+        half_life=60 * 60,
+        refresh_interval=60,
+    )
+
+
+def test_trending_decay():
+    board = make_board()
+    now = utcnow()
+
+    # Три часа - три периода полураспада: 10 лайков весят как 1.25
+    board.update(1, 10, now - timedelta(hours=3))
+    board.update(2, 2, now)
+    board.update(3, 1, now)
+    assert board.top(10) == [2, 1, 3]
+
+    board.update(1, 20, now - timedelta(hours=3))
+    assert board.top(2) == [1, 2]
+
+    # Твиты старше окна и без лайков в рейтинг не попадают
+    board.update(3, 0, now)
+    board.update(4, 100, now - timedelta(days=2))
+    assert board.top(10) == [1, 2]
+
+
+def test_trending_capacity():
+    board = make_board(capacity=3)
+    now = utcnow()
+
+    for tweet_id in range(1, 4):
+        board.update(tweet_id, tweet_id, now)
+    board.update(4, 1, now)
+    assert len(board) == 3
+    assert board.top(10) == [3, 2, 1]
+
+    # Новый твит лучше худшего вытесняет его
+    board.update(5, 5, now)
+    assert board.top(10) == [5, 3, 2]
+
+    board.remove(5)
+    board.update(1, 1, now)
+    assert board.top(10) == [3, 2, 1]
+
+    for _ in range(100):
+        board.update(2, 2, now)
+    assert len(board._heap) <= 2 * board.capacity + 64
+
+
+def test_trending_rebuild(test_db, test_users, test_async_session):
+    user = test_db.query(User).filter_by(api_key="test").first()
+    now = utcnow()
+    tweets = [
+        Tweet(text="rebuild old", user_id=user.id, created_at=now),
+        Tweet(text="rebuild new", user_id=user.id, created_at=now),
+        Tweet(
+            text="rebuild expired",
+            user_id=user.id,
+            created_at=now - timedelta(days=2),
+        ),
+    ]
+    test_db.add_all(tweets)
+    test_db.flush()
+    test_db.add_all(
+        [
+            Like(user_id=liker.id, tweet_id=tweet.id)
+            for tweet, likers in zip(tweets, (test_users, test_users[:1]))
+            for liker in likers
+        ]
+        + [Like(user_id=user.id, tweet_id=tweets[2].id)]
+    )
+    test_db.commit()
+    tweet_ids = [tweet.id for tweet in tweets]
+
+    board = make_board(test_async_session, capacity=100)
+    # Изменение, пришедшее до рестарта, заменяется пересчётом по likes
+    board.update(tweet_ids[1], 50, now)
+    asyncio.run(board.rebuild())
+
+    assert board.loaded
+    found = [tweet_id for tweet_id in board.top(100) if tweet_id in tweet_ids]
+    assert found == tweet_ids[:2]
+
+    test_db.execute(delete(Like).where(Like.tweet_id.in_(tweet_ids)))
+    test_db.execute(delete(Tweet).where(Tweet.id.in_(tweet_ids)))
+    test_db.commit()